@@ -0,0 +1,171 @@
+"""Agendador único para lembretes diários, contas agendadas e insights semanais.
+
+Em vez de um job do JobQueue por usuário, cada tarefa é uma linha em
+tarefas_agendadas com a próxima execução (UTC) indexada. Um único job
+repetitivo acorda a cada INTERVALO segundos, busca em lotes o que venceu,
+grava a execução seguinte e despacha os lotes. Como a agenda fica no banco, um
+restart não precisa registrar nada de novo; só `sincronizar` cria as tarefas
+que faltarem.
+
+A próxima execução é gravada antes do envio: uma queda no meio do lote perde
+aquele disparo em vez de repeti-lo.
+"""
+import asyncio
+import calendar
+import logging
+import os
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytz
+
+import banco
+import metricas
+import relogio
+
+logger = logging.getLogger(__name__)
+
+FUSO = pytz.timezone('America/Sao_Paulo')
+INTERVALO = float(os.getenv("AGENDADOR_INTERVALO", "30"))
+LOTE = int(os.getenv("AGENDADOR_LOTE", "500"))
+CONCORRENCIA = int(os.getenv("AGENDADOR_CONCORRENCIA", "20"))
+HORARIO_INSIGHT = os.getenv("INSIGHT_HORARIO", "10:00")
+DIA_INSIGHT = 0  # segunda-feira
+
+LEMBRETE, AGENDAMENTO, INSIGHT = 'lembrete', 'agendamento', 'insight'
+
+# Para agendamentos, `dados` traz (titulo, valor) da tabela de origem. A tarefa de
+# insights é global: id_usuario 0, sem chat.
+Tarefa = namedtuple('Tarefa', 'tipo id_usuario referencia chat_id dados')
+
+SQL_TAREFAS_DEVIDAS = """
+    SELECT t.tipo, t.id_usuario, t.referencia, t.chat_id, t.dia, t.horario, t.proxima_execucao, a.titulo, a.valor
+    FROM tarefas_agendadas t
+    LEFT JOIN agendamentos a ON t.tipo = 'agendamento' AND a.id = t.referencia
+    WHERE t.proxima_execucao <= ?
+    ORDER BY t.proxima_execucao
+    LIMIT ?
+"""
+
+CONSULTAS_QUENTES = {
+    'tarefas_devidas': (SQL_TAREFAS_DEVIDAS, ('2000-01-01 00:00:00', LOTE)),
+}
+
+_executores = {}
+_executando = False
+
+
+def _formatar(momento):
+    return momento.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def proxima_execucao(tipo, dia, horario, depois_de):
+    """Próximo disparo (string UTC) estritamente depois de `depois_de` (datetime com fuso).
+
+    Lembretes são diários, insights semanais (dia = dia da semana) e
+    agendamentos mensais; dias que não existem no mês caem no último dia.
+    """
+    hora, minuto = map(int, horario.split(':'))
+    local = depois_de.astimezone(FUSO)
+
+    def no_dia(d):
+        return FUSO.localize(datetime.combine(d, time(hora, minuto)))
+
+    if tipo == LEMBRETE:
+        d = local.date()
+        passo = timedelta(days=1)
+    elif tipo == INSIGHT:
+        d = local.date() + timedelta(days=(dia - local.weekday()) % 7)
+        passo = timedelta(days=7)
+    else:
+        def no_mes(ano, mes):
+            return no_dia(date(ano, mes, min(dia, calendar.monthrange(ano, mes)[1])))
+        ano, mes = local.year, local.month
+        while no_mes(ano, mes) <= depois_de:
+            ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+        return _formatar(no_mes(ano, mes))
+    while no_dia(d) <= depois_de:
+        d += passo
+    return _formatar(no_dia(d))
+
+
+# --- Manutenção da agenda (rodam dentro das unidades de escrita do repositório) ---
+def definir_tarefa(conn, tipo, user_id, chat_id, horario, dia=None, referencia=0, agora=None):
+    proxima = proxima_execucao(tipo, dia, horario, agora or relogio.agora())
+    conn.execute("""
+        INSERT INTO tarefas_agendadas (tipo, id_usuario, referencia, chat_id, dia, horario, proxima_execucao) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tipo, id_usuario, referencia) DO UPDATE SET chat_id = excluded.chat_id, dia = excluded.dia, horario = excluded.horario, proxima_execucao = excluded.proxima_execucao
+    """, (tipo, user_id, referencia, chat_id, dia, horario, proxima))
+
+
+def remover_tarefa(conn, tipo, user_id, referencia=0):
+    return conn.execute("DELETE FROM tarefas_agendadas WHERE tipo = ? AND id_usuario = ? AND referencia = ?", (tipo, user_id, referencia)).rowcount > 0
+
+
+def remover_tarefas_usuario(conn, user_id):
+    conn.execute("DELETE FROM tarefas_agendadas WHERE id_usuario = ?", (user_id,))
+
+
+def _sincronizar(conn):
+    agora = relogio.agora()
+    faltando = {
+        LEMBRETE: conn.execute("SELECT l.id_usuario, l.chat_id, l.horario, NULL, 0 FROM lembretes_diarios l LEFT JOIN tarefas_agendadas t ON t.tipo = 'lembrete' AND t.id_usuario = l.id_usuario AND t.referencia = 0 WHERE t.id_usuario IS NULL").fetchall(),
+        AGENDAMENTO: conn.execute("SELECT a.id_usuario, a.chat_id, a.horario, a.dia, a.id FROM agendamentos a LEFT JOIN tarefas_agendadas t ON t.tipo = 'agendamento' AND t.id_usuario = a.id_usuario AND t.referencia = a.id WHERE t.id_usuario IS NULL").fetchall(),
+        # Os insights são uma tarefa só (id_usuario 0) que calcula todos os usuários em lote.
+        INSIGHT: conn.execute("SELECT 0, NULL, ?, ?, 0 WHERE NOT EXISTS (SELECT 1 FROM tarefas_agendadas WHERE tipo = 'insight' AND id_usuario = 0)", (HORARIO_INSIGHT, DIA_INSIGHT)).fetchall(),
+    }
+    for tipo, linhas in faltando.items():
+        for user_id, chat_id, horario, dia, referencia in linhas:
+            definir_tarefa(conn, tipo, user_id, chat_id, horario, dia, referencia, agora)
+    # Tarefas cuja origem sumiu por fora do bot.
+    conn.execute("DELETE FROM tarefas_agendadas WHERE tipo = 'lembrete' AND id_usuario NOT IN (SELECT id_usuario FROM lembretes_diarios)")
+    conn.execute("DELETE FROM tarefas_agendadas WHERE tipo = 'agendamento' AND referencia NOT IN (SELECT id FROM agendamentos)")
+    return {tipo: len(linhas) for tipo, linhas in faltando.items()}
+
+
+async def sincronizar():
+    """Cria as tarefas que faltam para lembretes, agendamentos e usuários; devolve quantas por tipo."""
+    return await banco.escrever(_sincronizar)
+
+
+# --- Execução ---
+def registrar_executor(tipo, funcao):
+    """`funcao(context, tarefa)` é chamada para cada tarefa vencida do tipo."""
+    _executores[tipo] = metricas.medir_job(funcao, f"tarefa_{tipo}")
+
+
+async def _despachar(context, tarefa):
+    try:
+        await _executores[tarefa.tipo](context, tarefa)
+    except Exception:
+        logger.exception(f"Falha ao executar tarefa {tarefa.tipo} do usuário {tarefa.id_usuario}.")
+
+
+async def executar_pendentes(context):
+    """Callback do job repetitivo: despacha, em lotes, todas as tarefas vencidas."""
+    global _executando
+    if _executando:
+        return  # o tick anterior ainda está despachando
+    _executando = True
+    try:
+        while True:
+            agora = relogio.agora()
+            linhas = await banco.buscar_todos(SQL_TAREFAS_DEVIDAS, (_formatar(agora), LOTE))
+            if not linhas:
+                return
+            proximas = [(proxima_execucao(tipo, dia, horario, agora), tipo, user_id, referencia, anterior)
+                        for tipo, user_id, referencia, _, dia, horario, anterior, _, _ in linhas]
+            # A condição em proxima_execucao preserva uma tarefa redefinida pelo usuário enquanto o lote era lido.
+            await banco.escrever(lambda conn: conn.executemany("UPDATE tarefas_agendadas SET proxima_execucao = ? WHERE tipo = ? AND id_usuario = ? AND referencia = ? AND proxima_execucao = ?", proximas))
+            tarefas = [Tarefa(tipo, user_id, referencia, chat_id, (titulo, valor)) for tipo, user_id, referencia, chat_id, _, _, _, titulo, valor in linhas]
+            for inicio in range(0, len(tarefas), CONCORRENCIA):
+                await asyncio.gather(*(_despachar(context, tarefa) for tarefa in tarefas[inicio:inicio + CONCORRENCIA]))
+            logger.info(f"Agendador: {len(tarefas)} tarefas despachadas.")
+            if len(linhas) < LOTE:
+                return
+    finally:
+        _executando = False
+
+
+def iniciar(job_queue):
+    return job_queue.run_repeating(executar_pendentes, interval=INTERVALO, first=1, name="agendador")
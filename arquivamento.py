@@ -0,0 +1,115 @@
+"""Arquivamento dos meses fechados de transacoes.
+
+Quase todo caminho quente (/start, orçamentos, fatura aberta, insights) lê só o
+mês corrente ou o ciclo do cartão, então os meses antigos vão para
+transacoes_arquivo e transacoes (e seus índices) fica pequena. resumo_mensal
+não muda: os agregados continuam cobrindo todo o histórico.
+
+O limite arquivado fica em arquivamento.limite_epoch. Quem consulta um período
+pede a tabela com `tabela_transacoes(conn, inicio)`: se o período começa antes
+do limite, recebe a view transacoes_completas (UNION ALL das duas tabelas, que
+o SQLite resolve com uma busca em cada índice); senão, só transacoes.
+
+O limite é gravado antes de mover as linhas, e cada lote move e apaga na mesma
+transação, então uma leitura concorrente nunca perde nem duplica lançamentos.
+"""
+import logging
+import os
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import timezone
+
+from dateutil.relativedelta import relativedelta
+
+import banco
+import relogio
+import unidades
+
+logger = logging.getLogger(__name__)
+
+LOTE = int(os.getenv("ARQUIVAMENTO_LOTE", "5000"))
+# Meses mantidos em transacoes, contando o atual. Com menos de 2, os insights
+# (14 dias) e a fatura aberta passariam a ler o arquivo.
+MESES_ATIVOS = max(int(os.getenv("ARQUIVAMENTO_MESES_ATIVOS", "3")), 2)
+
+COLUNAS = "id, id_usuario, id_categoria, valor_centavos, tipo, data_epoch, id_cartao, id_externo"
+# Um lote vai até a data (inclusive) do LOTE-ésimo lançamento antigo do usuário; mover e apagar
+# usam o mesmo corte. Lançamentos no mesmo instante (extratos importados) entram juntos.
+SQL_CORTE_LOTE = "SELECT data_epoch FROM transacoes WHERE id_usuario = ? AND data_epoch < ? ORDER BY data_epoch LIMIT 1 OFFSET ?"
+SQL_MOVER_LOTE = f"INSERT INTO transacoes_arquivo ({COLUNAS}) SELECT {COLUNAS} FROM transacoes WHERE id_usuario = ? AND data_epoch <= ? AND id < ?"
+SQL_APAGAR_LOTE = "DELETE FROM transacoes WHERE id_usuario = ? AND data_epoch <= ? AND id < ?"
+
+CONSULTAS_QUENTES = {
+    'arquivar_corte': (SQL_CORTE_LOTE, (1, 946684800, 5000)),
+    'arquivar_lote': (SQL_MOVER_LOTE, (1, 946684800, 1000)),
+}
+
+
+@dataclass
+class ResultadoArquivamento:
+    limite: int  # segundos UTC; lançamentos anteriores estão em transacoes_arquivo
+    movidas: int = 0
+    usuarios: int = 0
+
+
+def limite(conn):
+    linha = conn.execute("SELECT limite_epoch FROM arquivamento WHERE id = 1").fetchone()
+    return linha[0] if linha else 0
+
+
+def inclui_arquivo(conn, inicio):
+    """Se um período que começa em `inicio` (segundos UTC) chega aos meses arquivados."""
+    return inicio < limite(conn)
+
+
+def tabela_transacoes(conn, inicio):
+    """Nome da tabela (ou view) a consultar para um período que começa em `inicio`."""
+    return 'transacoes_completas' if inclui_arquivo(conn, inicio) else 'transacoes'
+
+
+def limite_para(agora, meses_ativos=MESES_ATIVOS):
+    """Início (UTC) do mais antigo dos `meses_ativos` meses mantidos em transacoes."""
+    inicio_mes = agora.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return unidades.epoch(inicio_mes - relativedelta(months=max(meses_ativos, 2) - 1))
+
+
+async def arquivar(meses_ativos=MESES_ATIVOS, agora=None):
+    """Move para transacoes_arquivo os lançamentos anteriores aos meses ativos, em lotes."""
+    novo_limite = limite_para(agora or relogio.agora(), meses_ativos)
+
+    def _avancar_limite(conn):
+        # O limite só anda para frente; um valor menor não traria nada de volta do arquivo.
+        conn.execute("UPDATE arquivamento SET limite_epoch = MAX(limite_epoch, ?), atualizado_em = ? WHERE id = 1",
+                     (novo_limite, unidades.texto_utc(unidades.epoch(relogio.agora()))))
+        return limite(conn), [user_id for user_id, in conn.execute("SELECT id FROM usuarios ORDER BY id")]
+    limite_atual, usuarios = await banco.escrever(_avancar_limite)
+    resultado = ResultadoArquivamento(limite_atual)
+
+    def _mover_lote(conn, pendentes):
+        """Move até ~LOTE lançamentos, percorrendo os usuários pendentes; devolve também quantos deles terminaram."""
+        # A maior id fica sempre em transacoes: sem AUTOINCREMENT, o SQLite reutilizaria ids já arquivados.
+        maior_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transacoes").fetchone()[0]
+        movidas = {}
+        concluidos = 0
+        while concluidos < len(pendentes) and sum(movidas.values()) < LOTE:
+            user_id = pendentes[concluidos]
+            linha = conn.execute(SQL_CORTE_LOTE, (user_id, limite_atual, LOTE - sum(movidas.values()))).fetchone()
+            corte = linha[0] if linha else limite_atual - 1
+            movidas[user_id] = movidas.get(user_id, 0) + conn.execute(SQL_MOVER_LOTE, (user_id, corte, maior_id)).rowcount
+            conn.execute(SQL_APAGAR_LOTE, (user_id, corte, maior_id))
+            if linha is None:
+                concluidos += 1
+        return movidas, concluidos
+
+    pendentes = deque(usuarios)
+    por_usuario = Counter()
+    while pendentes:
+        movidas, concluidos = await banco.escrever(lambda conn: _mover_lote(conn, pendentes))
+        # Só depois do commit: se a unidade falhar, os mesmos usuários continuam na fila.
+        por_usuario.update(movidas)
+        for _ in range(concluidos):
+            pendentes.popleft()
+    resultado.movidas = sum(por_usuario.values())
+    resultado.usuarios = sum(1 for movidas in por_usuario.values() if movidas)
+    logger.info(f"Arquivamento até {unidades.texto_utc(limite_atual)} UTC: {resultado.movidas} lançamentos de {resultado.usuarios} usuários.")
+    return resultado
@@ -0,0 +1,229 @@
+"""Pool de conexões SQLite usado por todos os handlers do bot.
+
+As consultas rodam fora do event loop: leituras num ThreadPoolExecutor com uma
+conexão por leitor, escritas numa fila única consumida por uma thread dona da
+conexão de escrita. As escritas enfileiradas são agrupadas numa só transação
+(group commit), cada uma isolada por um SAVEPOINT.
+"""
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+pool = None
+
+
+def pragmas_do_ambiente():
+    """PRAGMAs de desempenho, ajustáveis por variáveis de ambiente."""
+    return {
+        'synchronous': os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+        'cache_size': int(os.getenv("DB_CACHE_SIZE", "-20000")),
+        'mmap_size': int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+        'busy_timeout': int(os.getenv("DB_BUSY_TIMEOUT", "5000")),
+        'temp_store': os.getenv("DB_TEMP_STORE", "MEMORY"),
+    }
+
+
+class PoolConexoes:
+    """Um escritor dedicado e N leitores reaproveitados entre chamadas."""
+
+    def __init__(self, caminho, leitores=4, pragmas=None, lote_max=64, janela_lote=0.0, rastreio=None, fabrica=None):
+        self.caminho = caminho
+        self.pragmas = pragmas if pragmas is not None else pragmas_do_ambiente()
+        self.rastreio = rastreio  # chamado com cada comando SQL executado (ver ferramentas/benchmark.py)
+        self.fabrica = fabrica  # subclasse de sqlite3.Connection (ver metricas.ConexaoMedida)
+        self.lote_max = lote_max
+        self.janela_lote = janela_lote
+        self._escritor = self._conectar()
+        self._escritor.isolation_level = None  # transações controladas manualmente em _escrever_lote
+        modo = self._escritor.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if modo.lower() != 'wal':
+            logger.warning(f"Não foi possível ativar WAL (journal_mode={modo}).")
+        self._executor_escrita = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-escrita")
+        self._leitores = queue.Queue()
+        for _ in range(leitores):
+            conn = self._conectar()
+            conn.execute("PRAGMA query_only=1")
+            self._leitores.put(conn)
+        self._executor_leitura = ThreadPoolExecutor(max_workers=leitores, thread_name_prefix="db-leitura")
+        self._num_leitores = leitores
+        self._leituras = 0  # submetidas ao executor e ainda não concluídas
+        self._lock_leituras = threading.Lock()
+        self._fila_escrita = None
+        self._tarefa_escrita = None
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.caminho, timeout=self.pragmas['busy_timeout'] / 1000, check_same_thread=False,
+                               factory=self.fabrica or sqlite3.Connection)
+        for nome, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nome}={valor}")
+        if self.rastreio is not None:
+            conn.set_trace_callback(self.rastreio)
+        return conn
+
+    def _ler(self, funcao):
+        conn = self._leitores.get()
+        try:
+            return funcao(conn)
+        finally:
+            self._leitores.put(conn)
+
+    def _escrever_lote(self, funcoes):
+        """Roda todas as funções numa única transação; devolve [(ok, resultado)].
+
+        Uma função que falha desfaz apenas o próprio SAVEPOINT, sem derrubar as
+        demais do lote.
+        """
+        conn = self._escritor
+        resultados = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for funcao in funcoes:
+                conn.execute("SAVEPOINT unidade")
+                try:
+                    resultados.append((True, funcao(conn)))
+                    conn.execute("RELEASE unidade")
+                except Exception as erro:
+                    conn.execute("ROLLBACK TO unidade")
+                    conn.execute("RELEASE unidade")
+                    resultados.append((False, erro))
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return resultados
+
+    def _garantir_consumidor(self):
+        if self._tarefa_escrita is None:
+            self._fila_escrita = asyncio.Queue()
+            self._tarefa_escrita = asyncio.get_running_loop().create_task(self._consumir_escritas())
+
+    async def _consumir_escritas(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._fila_escrita.get()
+            if item is None:
+                return
+            lote = [item]
+            if self.janela_lote:
+                await asyncio.sleep(self.janela_lote)
+            encerrar = False
+            while len(lote) < self.lote_max and not self._fila_escrita.empty():
+                proximo = self._fila_escrita.get_nowait()
+                if proximo is None:
+                    encerrar = True
+                    break
+                lote.append(proximo)
+            try:
+                resultados = await loop.run_in_executor(self._executor_escrita, self._escrever_lote, [funcao for funcao, _ in lote])
+            except Exception as erro:
+                logger.exception(f"Falha ao gravar lote de {len(lote)} escritas.")
+                resultados = [(False, erro)] * len(lote)
+            for (_, futuro), (ok, resultado) in zip(lote, resultados):
+                if futuro.cancelled():
+                    continue
+                if ok:
+                    futuro.set_result(resultado)
+                else:
+                    futuro.set_exception(resultado)
+            if encerrar:
+                return
+
+    async def ler(self, funcao):
+        """Executa `funcao(conn)` numa conexão de leitura, fora do event loop."""
+        futuro = self._executor_leitura.submit(self._ler, funcao)
+        with self._lock_leituras:
+            self._leituras += 1
+        futuro.add_done_callback(self._leitura_concluida)
+        return await asyncio.wrap_future(futuro)
+
+    def _leitura_concluida(self, _futuro):
+        # Roda na thread do leitor (ou aqui mesmo, se a leitura já tiver terminado).
+        with self._lock_leituras:
+            self._leituras -= 1
+
+    async def escrever(self, funcao):
+        """Enfileira `funcao(conn)` para a conexão de escrita e espera o commit."""
+        self._garantir_consumidor()
+        futuro = asyncio.get_running_loop().create_future()
+        await self._fila_escrita.put((funcao, futuro))
+        return await futuro
+
+    def profundidade_fila_escrita(self):
+        return self._fila_escrita.qsize() if self._fila_escrita is not None else 0
+
+    def profundidade_fila_leitura(self):
+        """Leituras esperando um leitor livre: as em andamento além do número de leitores."""
+        return max(self._leituras - self._num_leitores, 0)
+
+    async def encerrar(self):
+        """Espera as escritas pendentes e fecha as conexões."""
+        if self._tarefa_escrita is not None:
+            await self._fila_escrita.put(None)
+            await self._tarefa_escrita
+            self._tarefa_escrita = None
+        self.fechar()
+
+    def fechar(self):
+        self._executor_leitura.shutdown(wait=True)
+        self._executor_escrita.shutdown(wait=True)
+        for _ in range(self._num_leitores):
+            self._leitores.get().close()
+        self._escritor.close()
+
+
+def configurar(caminho, leitores=4, rastreio=None, fabrica=None):
+    global pool
+    if pool is not None:
+        pool.fechar()
+    pool = PoolConexoes(caminho, leitores=leitores,
+                        lote_max=int(os.getenv("DB_LOTE_MAX", "64")),
+                        janela_lote=float(os.getenv("DB_JANELA_LOTE_MS", "0")) / 1000,
+                        rastreio=rastreio, fabrica=fabrica)
+    logger.info(f"Pool SQLite aberto em {caminho} com {leitores} leitores (WAL, {pool.pragmas}).")
+    return pool
+
+
+async def encerrar():
+    global pool
+    if pool is not None:
+        await pool.encerrar()
+        pool = None
+
+
+def fechar():
+    global pool
+    if pool is not None:
+        pool.fechar()
+        pool = None
+
+
+# --- Atalhos usados pelo repositório ---
+async def ler(funcao):
+    return await pool.ler(funcao)
+
+
+async def escrever(funcao):
+    return await pool.escrever(funcao)
+
+
+async def buscar_um(sql, params=()):
+    return await pool.ler(lambda conn: conn.execute(sql, params).fetchone())
+
+
+async def buscar_todos(sql, params=()):
+    return await pool.ler(lambda conn: conn.execute(sql, params).fetchall())
+
+
+async def executar(sql, params=()):
+    """Executa um único comando de escrita e devolve (lastrowid, rowcount)."""
+    def _executar(conn):
+        cursor = conn.execute(sql, params)
+        return cursor.lastrowid, cursor.rowcount
+    return await pool.escrever(_executar)
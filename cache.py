@@ -0,0 +1,57 @@
+"""Cache em memória com limite de tamanho (LRU) e tempo de vida (TTL).
+
+Usado apenas a partir do event loop, portanto não tem lock.
+"""
+import time
+from collections import OrderedDict
+
+AUSENTE = object()
+
+
+class CacheTTL:
+    def __init__(self, tamanho_max=10000, ttl=300.0, relogio=time.monotonic):
+        self.tamanho_max = tamanho_max
+        self.ttl = ttl
+        self._relogio = relogio
+        self._itens = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+
+    def obter(self, chave, padrao=AUSENTE):
+        """Devolve o valor em cache ou `padrao` (por padrão, AUSENTE)."""
+        item = self._itens.get(chave)
+        if item is not None:
+            valor, expira_em = item
+            if expira_em > self._relogio():
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return valor
+            del self._itens[chave]
+        self.falhas += 1
+        return padrao
+
+    def definir(self, chave, valor):
+        self._itens[chave] = (valor, self._relogio() + self.ttl)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.tamanho_max:
+            self._itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        if self._itens.pop(chave, None) is not None:
+            self.invalidacoes += 1
+
+    def limpar(self):
+        self.invalidacoes += len(self._itens)
+        self._itens.clear()
+
+    def estatisticas(self):
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self._itens),
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'invalidacoes': self.invalidacoes,
+            'taxa_acerto': self.acertos / total if total else 0.0,
+        }
+
@@ -0,0 +1,118 @@
+"""Correspondência de nomes de categoria digitados pelo usuário.
+
+Mantém, por usuário, as categorias já normalizadas (minúsculas, sem acento,
+tokens ordenados) e os apelidos aprendidos quando ele aceita uma sugestão.
+A comparação usa os scorers em C do RapidFuzz com `score_cutoff`.
+"""
+import os
+import unicodedata
+
+import banco
+from cache import AUSENTE, CacheTTL
+
+CORTE = float(os.getenv("CATEGORIAS_CORTE", "70"))
+# Descrições de extrato não têm a quem perguntar: só aceita correspondências fortes.
+CORTE_DESCRICAO = float(os.getenv("CATEGORIAS_CORTE_DESCRICAO", "85"))
+
+_indices = CacheTTL(tamanho_max=int(os.getenv("CATEGORIAS_INDICE_MAX", "20000")), ttl=float(os.getenv("CATEGORIAS_INDICE_TTL", "3600")))
+
+
+def normalizar(nome):
+    sem_acento = ''.join(c for c in unicodedata.normalize('NFKD', nome.lower()) if not unicodedata.combining(c))
+    return ' '.join(sorted(sem_acento.split()))
+
+
+class IndiceCategorias:
+    def __init__(self, nomes, apelidos):
+        self.nomes = list(nomes)
+        self.normalizados = [normalizar(nome) for nome in self.nomes]
+        self.por_normalizado = dict(zip(self.normalizados, self.nomes))
+        self.apelidos = {normalizar(apelido): nome for apelido, nome in apelidos}
+
+
+async def _carregar(user_id):
+    def _ler(conn):
+        nomes = [nome for nome, in conn.execute("SELECT nome FROM categorias WHERE id_usuario = ?", (user_id,))]
+        apelidos = conn.execute("SELECT a.apelido, c.nome FROM categoria_apelidos a JOIN categorias c ON a.id_categoria = c.id WHERE a.id_usuario = ?", (user_id,)).fetchall()
+        return nomes, apelidos
+    nomes, apelidos = await banco.ler(_ler)
+    return IndiceCategorias(nomes, apelidos)
+
+
+async def obter_indice(user_id):
+    indice = _indices.obter(user_id)
+    if indice is AUSENTE:
+        indice = await _carregar(user_id)
+        _indices.definir(user_id, indice)
+    return indice
+
+
+def invalidar(user_id):
+    """Chamada sempre que categorias ou apelidos do usuário mudam."""
+    _indices.invalidar(user_id)
+
+
+async def resolver(user_id, nome_categoria):
+    """Devolve (nome, origem, score) para o texto digitado.
+
+    origem é 'exata' ou 'apelido' quando a categoria pode ser usada direto,
+    'sugestao' quando vale perguntar ao usuário, ou None se nada chegou perto.
+    """
+    indice = await obter_indice(user_id)
+    if nome_categoria in indice.nomes:
+        return nome_categoria, 'exata', 100.0
+    normalizado = normalizar(nome_categoria)
+    if normalizado in indice.por_normalizado:
+        return indice.por_normalizado[normalizado], 'apelido', 100.0
+    if normalizado in indice.apelidos:
+        return indice.apelidos[normalizado], 'apelido', 100.0
+    if not indice.normalizados:
+        return None, None, 0.0
+    from rapidfuzz import fuzz, process
+    melhor = process.extractOne(normalizado, indice.normalizados, scorer=fuzz.ratio, processor=None, score_cutoff=CORTE)
+    if not melhor or melhor[1] <= CORTE:
+        return None, None, melhor[1] if melhor else 0.0
+    _, score, posicao = melhor
+    return indice.nomes[posicao], 'sugestao', score
+
+
+async def aprender_apelido(user_id, apelido, nome_categoria):
+    """Registra que `apelido` significa `nome_categoria` para este usuário."""
+    def _gravar(conn):
+        conn.execute("INSERT OR REPLACE INTO categoria_apelidos (id_usuario, apelido, id_categoria) SELECT ?, ?, id FROM categorias WHERE id_usuario = ? AND nome = ?",
+                     (user_id, apelido, user_id, nome_categoria))
+    await banco.escrever(_gravar)
+    invalidar(user_id)
+
+
+def _limpar_descricao(texto):
+    sem_acento = ''.join(c for c in unicodedata.normalize('NFKD', texto.lower()) if not unicodedata.combining(c))
+    return ' '.join(''.join(c if c.isalpha() else ' ' for c in sem_acento).split())
+
+
+async def classificar_descricoes(user_id, descricoes):
+    """Mapeia descrições de extrato para categorias existentes; {descricao: nome ou None}.
+
+    Usa os apelidos e, depois, `partial_ratio` (a categoria costuma aparecer no
+    meio da descrição, como em "PAG*MERCADO CENTRAL"). Nunca cria categorias.
+    """
+    indice = await obter_indice(user_id)
+    from rapidfuzz import fuzz, process
+    # Nomes muito curtos casariam com quase qualquer descrição.
+    candidatos = {posicao: nome for posicao, nome in enumerate(indice.normalizados) if len(nome) >= 3}
+    resultado = {}
+    for descricao in set(descricoes):
+        limpa = _limpar_descricao(descricao or '')
+        if not limpa:
+            resultado[descricao] = None
+            continue
+        nome = indice.por_normalizado.get(normalizar(limpa)) or indice.apelidos.get(normalizar(limpa))
+        if nome is None and candidatos:
+            melhor = process.extractOne(limpa, candidatos, scorer=fuzz.partial_ratio, processor=None, score_cutoff=CORTE_DESCRICAO)
+            nome = indice.nomes[melhor[2]] if melhor else None
+        resultado[descricao] = nome
+    return resultado
+
+
+def estatisticas_cache():
+    return _indices.estatisticas()
@@ -0,0 +1,131 @@
+"""Diário de updates: grava tudo o que chega ao bot para reproduzir depois.
+
+Ligado por DIARIO_UPDATES (caminho do arquivo; terminando em .gz, grava
+comprimido). Cada update vira uma linha JSON compacta {"t": instante, "u":
+update} e é anexado ao arquivo antes de qualquer handler rodar. O
+ferramentas/replay.py passa o diário pelos mesmos handlers, com o relógio
+congelado em cada "t".
+
+Os ids de usuários e chats são trocados por pseudônimos (HMAC com
+DIARIO_SEGREDO, estáveis entre execuções), username e sobrenome são
+descartados e o nome vira "U<pseudônimo>". Textos, valores e botões ficam
+como vieram, já que é o que os handlers leem. Sem DIARIO_SEGREDO o diário
+não é gravado. `pseudonimizar_base` aplica os mesmos pseudônimos a uma cópia
+do banco, para o replay encontrar os usuários do diário.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO = os.getenv("DIARIO_UPDATES")
+SEGREDO = os.getenv("DIARIO_SEGREDO")
+LINHAS_POR_FLUSH = 100
+
+TIPOS_CHAT = {'private', 'group', 'supergroup', 'channel'}
+
+_arquivo = None
+_pendentes = 0
+
+
+def pseudonimo(identificador, segredo=SEGREDO):
+    """Id de 48 bits derivado do original; mantém o sinal (chats de grupo são negativos)."""
+    if identificador is None:
+        return None
+    digest = hmac.new(segredo.encode(), str(abs(int(identificador))).encode(), hashlib.sha256).digest()
+    valor = int.from_bytes(digest[:6], 'big') or 1
+    return -valor if int(identificador) < 0 else valor
+
+
+def _pessoa(dados):
+    """Um User ou Chat do Telegram (os dicts com 'id' que identificam alguém)."""
+    return 'id' in dados and ('is_bot' in dados or dados.get('type') in TIPOS_CHAT)
+
+
+def pseudonimizar(dados, segredo=SEGREDO):
+    """Cópia de um update (em dict) com usuários e chats pseudonimizados. O próprio bot fica como está."""
+    if isinstance(dados, list):
+        return [pseudonimizar(item, segredo) for item in dados]
+    if not isinstance(dados, dict):
+        return dados
+    if _pessoa(dados) and not dados.get('is_bot'):
+        novo_id = pseudonimo(dados['id'], segredo)
+        dados = {chave: valor for chave, valor in dados.items() if chave not in ('username', 'last_name')}
+        dados['id'] = novo_id
+        if 'first_name' in dados:
+            dados['first_name'] = f"U{abs(novo_id)}"
+        if dados.get('title'):
+            dados['title'] = f"G{abs(novo_id)}"
+        return dados
+    return {chave: pseudonimizar(valor, segredo) for chave, valor in dados.items()}
+
+
+def ativo():
+    """Se o diário deve ser gravado; sem DIARIO_SEGREDO, avisa e não grava."""
+    if not ARQUIVO:
+        return False
+    if not SEGREDO:
+        logger.error("ERRO: DIARIO_UPDATES exige DIARIO_SEGREDO; o diário de updates não será gravado.")
+        return False
+    return True
+
+
+def _abrir(caminho, modo):
+    if caminho.endswith('.gz'):
+        return gzip.open(caminho, modo + 't', encoding='utf-8')
+    return open(caminho, modo, encoding='utf-8')
+
+
+async def registrar_update(update, context):
+    """TypeHandler(Update) no grupo -1: anexa o update ao diário e deixa os demais handlers seguirem."""
+    global _arquivo, _pendentes
+    if _arquivo is None:
+        _arquivo = _abrir(ARQUIVO, 'a')
+        logger.info(f"Gravando diário de updates em {ARQUIVO}.")
+    linha = {'t': round(time.time(), 3), 'u': pseudonimizar(update.to_dict())}
+    _arquivo.write(json.dumps(linha, ensure_ascii=False, separators=(',', ':')) + "\n")
+    _pendentes += 1
+    if _pendentes >= LINHAS_POR_FLUSH:
+        _arquivo.flush()
+        _pendentes = 0
+
+
+def fechar():
+    global _arquivo, _pendentes
+    if _arquivo is not None:
+        _arquivo.close()
+        _arquivo, _pendentes = None, 0
+
+
+def ler(caminho):
+    """Gera (instante, update em dict) de cada linha do diário, na ordem de chegada."""
+    with _abrir(caminho, 'r') as arquivo:
+        for numero, linha in enumerate(arquivo, 1):
+            if not linha.strip():
+                continue
+            try:
+                entrada = json.loads(linha)
+            except ValueError:
+                # A última linha pode ter ficado pela metade se o bot caiu no meio de uma escrita.
+                logger.warning(f"{caminho}:{numero}: linha inválida ignorada.")
+                continue
+            yield entrada['t'], entrada['u']
+
+
+def pseudonimizar_base(conn, segredo):
+    """Troca, numa cópia do banco, os ids do Telegram pelos mesmos pseudônimos do diário."""
+    conn.create_function('pseudonimo', 1, lambda valor: pseudonimo(valor, segredo), deterministic=True)
+    conn.execute("UPDATE usuarios SET telegram_id = pseudonimo(telegram_id), chat_id = pseudonimo(chat_id), nome_usuario = NULL")
+    for tabela in ('lembretes_diarios', 'agendamentos', 'tarefas_agendadas'):
+        conn.execute(f"UPDATE {tabela} SET chat_id = pseudonimo(chat_id)")
+    conn.execute("UPDATE estado_usuarios SET telegram_id = pseudonimo(telegram_id)")
+    # Chaves de conversa são listas JSON de ids (chat, usuário).
+    conversas = conn.execute("SELECT nome, chave FROM estado_conversas").fetchall()
+    conn.executemany("UPDATE estado_conversas SET chave = ? WHERE nome = ? AND chave = ?",
+                     [(json.dumps([pseudonimo(parte, segredo) for parte in json.loads(chave)]), nome, chave) for nome, chave in conversas])
+    conn.commit()
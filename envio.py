@@ -0,0 +1,246 @@
+"""Fila de envio de mensagens com limite de taxa, para os disparos em massa.
+
+Lembretes, insights e avisos de contas agendadas não chamam o bot direto:
+entram numa fila ordenada pelo momento de liberação (opcionalmente espalhado
+com jitter numa janela) e saem respeitando dois baldes de tokens, um global e
+um por chat, abaixo dos limites do Telegram (~30 msg/s no total, ~1 msg/s por
+chat). RetryAfter pausa todo o envio pelo tempo pedido; erros de rede são
+retentados com backoff exponencial.
+
+As respostas a comandos continuam indo direto pelo bot.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+JANELA_LEMBRETES = float(os.getenv("ENVIO_JANELA_LEMBRETES", "60"))
+JANELA_INSIGHTS = float(os.getenv("ENVIO_JANELA_INSIGHTS", "900"))
+
+despachante = None
+
+
+class BaldeTokens:
+    def __init__(self, taxa, capacidade, relogio=time.monotonic):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = float(capacidade)
+        self._relogio = relogio
+        self._atualizado = relogio()
+
+    def _repor(self):
+        agora = self._relogio()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def espera(self):
+        """Segundos até haver um token disponível (0 se já houver)."""
+        self._repor()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.taxa
+
+    def consumir(self):
+        self._repor()
+        self.tokens -= 1
+
+    def cheio(self):
+        self._repor()
+        return self.tokens >= self.capacidade
+
+
+@dataclass
+class _Envio:
+    chat_id: int
+    kwargs: dict
+    futuro: asyncio.Future
+    criado_em: float
+    tentativas: int = 0
+    seq: int = field(default=0, compare=False)
+
+
+class DespachanteMensagens:
+    def __init__(self, bot, taxa_global=25.0, taxa_chat=1.0, rajada_chat=3, max_em_envio=16,
+                 tentativas=5, backoff_base=1.0, backoff_max=60.0, relogio=time.monotonic):
+        self.bot = bot
+        self.taxa_chat = taxa_chat
+        self.rajada_chat = rajada_chat
+        self.tentativas = tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._relogio = relogio
+        self._balde_global = BaldeTokens(taxa_global, max(1, int(taxa_global)), relogio)
+        self._baldes_chat = {}
+        self._vagas = asyncio.Semaphore(max_em_envio)
+        self._fila = asyncio.PriorityQueue()
+        self._novo_item = asyncio.Event()
+        self._seq = 0
+        self._pausado_ate = 0.0
+        self._tarefa = None
+        self._em_envio = 0
+        self._latencias = deque(maxlen=1000)
+        self.enviados = 0
+        self.falhas = 0
+        self.retry_after = 0
+        self.retentativas = 0
+
+    def enviar(self, chat_id, text=None, espalhar=0.0, **kwargs):
+        """Enfileira um send_message; devolve um Future com a Message (ou a exceção final).
+
+        `espalhar` adia a liberação por um tempo aleatório entre 0 e `espalhar`
+        segundos, para diluir disparos que vencem todos no mesmo minuto.
+        """
+        if self._tarefa is None:
+            self._tarefa = asyncio.get_running_loop().create_task(self._consumir())
+        if text is not None:
+            kwargs['text'] = text
+        agora = self._relogio()
+        envio = _Envio(chat_id, kwargs, asyncio.get_running_loop().create_future(), agora)
+        self._agendar(envio, agora + (random.uniform(0, espalhar) if espalhar else 0.0))
+        return envio.futuro
+
+    def _agendar(self, envio, liberar_em):
+        self._seq += 1
+        self._fila.put_nowait((liberar_em, self._seq, envio))
+        self._novo_item.set()
+
+    def _balde_chat(self, chat_id):
+        balde = self._baldes_chat.get(chat_id)
+        if balde is None:
+            if len(self._baldes_chat) > 10000:
+                # Um balde cheio equivale a um novo; descarta-os para não crescer sem limite.
+                self._baldes_chat = {chave: b for chave, b in self._baldes_chat.items() if not b.cheio()}
+            balde = self._baldes_chat[chat_id] = BaldeTokens(self.taxa_chat, self.rajada_chat, self._relogio)
+        return balde
+
+    async def _consumir(self):
+        while True:
+            liberar_em, seq, envio = await self._fila.get()
+            atraso = max(liberar_em, self._pausado_ate) - self._relogio()
+            if atraso > 0:
+                # Ainda não venceu: devolve e dorme até ele vencer ou chegar algo mais urgente.
+                self._fila.put_nowait((liberar_em, seq, envio))
+                self._novo_item.clear()
+                try:
+                    await asyncio.wait_for(self._novo_item.wait(), atraso)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            balde_chat = self._balde_chat(envio.chat_id)
+            espera = balde_chat.espera()
+            if espera > 0:
+                # Chat no limite: reagenda só esta mensagem e segue com os outros chats.
+                self._agendar(envio, self._relogio() + espera)
+                continue
+            while (espera := self._balde_global.espera()) > 0:
+                await asyncio.sleep(espera)
+            balde_chat.consumir()
+            self._balde_global.consumir()
+            await self._vagas.acquire()
+            self._em_envio += 1
+            asyncio.get_running_loop().create_task(self._enviar(envio))
+
+    async def _enviar(self, envio):
+        try:
+            mensagem = await self.bot.send_message(chat_id=envio.chat_id, **envio.kwargs)
+        except RetryAfter as erro:
+            self.retry_after += 1
+            segundos = erro.retry_after.total_seconds() if isinstance(erro.retry_after, timedelta) else float(erro.retry_after)
+            self._pausado_ate = max(self._pausado_ate, self._relogio() + segundos)
+            logger.warning(f"RetryAfter do Telegram: envio pausado por {segundos:.0f}s.")
+            self._retentar(envio, erro, segundos)
+        except BadRequest as erro:
+            self._falhar(envio, erro)
+        except NetworkError as erro:
+            self._retentar(envio, erro, min(self.backoff_max, self.backoff_base * 2 ** envio.tentativas) * random.uniform(0.5, 1.0))
+        except TelegramError as erro:
+            # Forbidden (bot bloqueado), chat inexistente etc.: não adianta tentar de novo.
+            self._falhar(envio, erro)
+        except Exception as erro:
+            logger.exception(f"Erro inesperado ao enviar para o chat {envio.chat_id}.")
+            self._falhar(envio, erro)
+        else:
+            self.enviados += 1
+            self._latencias.append(self._relogio() - envio.criado_em)
+            if not envio.futuro.done():
+                envio.futuro.set_result(mensagem)
+        finally:
+            self._em_envio -= 1
+            self._vagas.release()
+
+    def _retentar(self, envio, erro, espera):
+        envio.tentativas += 1
+        if envio.tentativas >= self.tentativas:
+            self._falhar(envio, erro)
+            return
+        self.retentativas += 1
+        self._agendar(envio, self._relogio() + espera)
+
+    def _falhar(self, envio, erro):
+        self.falhas += 1
+        logger.warning(f"Mensagem para o chat {envio.chat_id} descartada após {envio.tentativas + 1} tentativa(s): {erro}")
+        if not envio.futuro.done():
+            envio.futuro.set_exception(erro)
+            envio.futuro.exception()  # marca como observada; quem não aguarda o futuro não gera aviso
+
+    def estatisticas(self):
+        latencias = sorted(self._latencias)
+        def percentil(p):
+            return latencias[min(len(latencias) - 1, int(p * len(latencias)))] if latencias else 0.0
+        return {
+            'fila': self._fila.qsize(),
+            'em_envio': self._em_envio,
+            'enviados': self.enviados,
+            'falhas': self.falhas,
+            'retry_after': self.retry_after,
+            'retentativas': self.retentativas,
+            'latencia_p50': percentil(0.50),
+            'latencia_p95': percentil(0.95),
+            'latencia_max': latencias[-1] if latencias else 0.0,
+        }
+
+    async def encerrar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        pendentes = self._fila.qsize()
+        if pendentes:
+            logger.warning(f"{pendentes} mensagens na fila de envio descartadas no encerramento.")
+
+
+def configurar(bot):
+    global despachante
+    despachante = DespachanteMensagens(
+        bot,
+        taxa_global=float(os.getenv("ENVIO_TAXA_GLOBAL", "25")),
+        taxa_chat=float(os.getenv("ENVIO_TAXA_CHAT", "1")),
+        rajada_chat=int(os.getenv("ENVIO_RAJADA_CHAT", "3")),
+        max_em_envio=int(os.getenv("ENVIO_MAX_SIMULTANEOS", "16")),
+        tentativas=int(os.getenv("ENVIO_TENTATIVAS", "5")),
+    )
+    return despachante
+
+
+def enviar(chat_id, text=None, espalhar=0.0, **kwargs):
+    return despachante.enviar(chat_id, text, espalhar=espalhar, **kwargs)
+
+
+def estatisticas():
+    return despachante.estatisticas() if despachante is not None else {}
+
+
+async def encerrar():
+    global despachante
+    if despachante is not None:
+        await despachante.encerrar()
+        despachante = None
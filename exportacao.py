@@ -0,0 +1,233 @@
+"""Exportação dos lançamentos em CSV (opcionalmente gzip), XLSX ou Parquet.
+
+As linhas saem do cursor em lotes (`fetchmany`) e vão direto para um
+SpooledTemporaryFile, que fica em memória até EXPORTACAO_MEMORIA_MAX bytes e
+depois passa para o disco: o uso de memória não cresce com o histórico. Tudo
+roda na thread de leitura do banco, fora do event loop. O resumo (totais,
+categorias, formas de pagamento) é acumulado na mesma passada. No envio,
+gastos.exportar entrega o arquivo ao httpx sem lê-lo (InputFile com
+read_file_handle=False), que o manda em blocos.
+
+XLSX e Parquet dependem de openpyxl e pyarrow, que são opcionais
+(requirements-opcional.txt); sem eles o formato fica indisponível e o CSV
+continua funcionando.
+"""
+import csv
+import gzip
+import heapq
+import io
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+
+import pytz
+from dateutil.relativedelta import relativedelta
+
+import arquivamento
+import banco
+import relogio
+import unidades
+from relatorios import SEM_CARTAO, SEM_CATEGORIA, ResultadoRelatorio
+
+FUSO = pytz.timezone('America/Sao_Paulo')
+LOTE = int(os.getenv("EXPORTACAO_LOTE", "1000"))
+MEMORIA_MAX = int(os.getenv("EXPORTACAO_MEMORIA_MAX", str(1024 * 1024)))
+LIMITE_UPLOAD = 50 * 1024 * 1024  # limite de envio de arquivos da Bot API
+
+# Extensão -> (formato, gzip)
+FORMATOS = {'csv': ('csv', False), 'csv.gz': ('csv', True), 'xlsx': ('xlsx', False), 'parquet': ('parquet', False)}
+CABECALHO = ['Data (UTC)', 'Tipo', 'Valor', 'Categoria', 'Forma Pagamento']
+TODO_HISTORICO = (0, 253402300799)  # até 9999-12-31 23:59:59 UTC
+
+SQL_LANCAMENTOS_PERIODO = """
+    SELECT datetime(t.data_epoch, 'unixepoch'), t.tipo, t.valor_centavos, c.nome, cart.nome
+    FROM {tabela} t
+    LEFT JOIN categorias c ON t.id_categoria = c.id
+    LEFT JOIN cartoes cart ON t.id_cartao = cart.id
+    WHERE t.id_usuario = ? AND t.data_epoch BETWEEN ? AND ?
+    ORDER BY t.data_epoch ASC
+"""
+
+CONSULTAS_QUENTES = {
+    'lancamentos_periodo': (SQL_LANCAMENTOS_PERIODO.format(tabela='transacoes'), (1, 946684800, 949363199)),
+    'lancamentos_periodo_arquivo': (SQL_LANCAMENTOS_PERIODO.format(tabela='transacoes_arquivo'), (1, 946684800, 949363199)),
+}
+
+
+class FormatoIndisponivel(Exception):
+    """O formato pedido depende de uma biblioteca opcional que não está instalada."""
+
+
+@dataclass
+class Exportacao:
+    arquivo: object  # SpooledTemporaryFile posicionado no início; None se não houve lançamentos
+    nome: str
+    tamanho: int
+    resultado: ResultadoRelatorio
+
+
+def _decimal(valor):
+    return f"{valor:.2f}".replace('.', ',')
+
+
+def _linhas(conn, tabela, user_id, inicio, fim):
+    cursor = conn.execute(SQL_LANCAMENTOS_PERIODO.format(tabela=tabela), (user_id, inicio, fim))
+    while lote := cursor.fetchmany(LOTE):
+        yield from lote
+
+
+def _lancamentos(conn, user_id, inicio, fim, resultado):
+    """Gera os lançamentos do período em lotes (valor em reais), acumulando o resumo."""
+    linhas = _linhas(conn, 'transacoes', user_id, inicio, fim)
+    if arquivamento.inclui_arquivo(conn, inicio):
+        # As duas buscas já saem ordenadas pelo índice; intercalá-las evita ordenar o histórico inteiro.
+        linhas = heapq.merge(_linhas(conn, 'transacoes_arquivo', user_id, inicio, fim), linhas, key=itemgetter(0))
+    for data, tipo, valor_centavos, categoria, cartao in linhas:
+        resultado.acumular(data[:10], tipo, categoria, cartao, valor_centavos)
+        yield data, tipo, unidades.reais(valor_centavos), (categoria or SEM_CATEGORIA).capitalize(), cartao or SEM_CARTAO
+
+
+def _linhas_resumo(resultado):
+    yield ['Total de entradas', '', resultado.entradas]
+    yield ['Total de saídas', '', resultado.saidas]
+    yield ['Saldo', '', resultado.saldo]
+    for nome, total in resultado.gastos_por_categoria():
+        yield ['Saídas por categoria', '', total, nome.capitalize()]
+    for nome, total in resultado.gastos_por_cartao():
+        yield ['Saídas por forma de pagamento', '', total, '', nome]
+
+
+def escrever_csv(destino, lancamentos, resultado, compactar=False):
+    """Escreve os lançamentos e, ao final, o resumo calculado na mesma passada."""
+    binario = gzip.GzipFile(fileobj=destino, mode='wb') if compactar else destino
+    texto = io.TextIOWrapper(binario, encoding='utf-8', newline='')
+    writer = csv.writer(texto, delimiter=';')
+    writer.writerow(CABECALHO)
+    for data, tipo, valor, categoria, cartao in lancamentos:
+        writer.writerow([data, tipo, _decimal(valor), categoria, cartao])
+    writer.writerow([])
+    for linha in _linhas_resumo(resultado):
+        writer.writerow([_decimal(v) if isinstance(v, float) else v for v in linha])
+    texto.flush()
+    texto.detach()  # fecha só o wrapper de texto; `destino` continua aberto
+    if compactar:
+        binario.close()
+
+
+def escrever_xlsx(destino, lancamentos, resultado):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise FormatoIndisponivel('xlsx') from None
+    # write_only grava as linhas num arquivo temporário em vez de montar a planilha na memória.
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet('Lançamentos')
+    aba.append(CABECALHO)
+    for linha in lancamentos:
+        aba.append(list(linha))
+    aba_resumo = planilha.create_sheet('Resumo')
+    for linha in _linhas_resumo(resultado):
+        aba_resumo.append(linha)
+    planilha.save(destino)
+
+
+def escrever_parquet(destino, lancamentos, resultado):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise FormatoIndisponivel('parquet') from None
+    esquema = pa.schema([('data_utc', pa.string()), ('tipo', pa.string()), ('valor', pa.float64()), ('categoria', pa.string()), ('forma_pagamento', pa.string())])
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as escritor:
+        colunas = [[] for _ in esquema]
+        for linha in lancamentos:
+            for coluna, valor in zip(colunas, linha):
+                coluna.append(valor)
+            if len(colunas[0]) >= LOTE:
+                escritor.write_batch(pa.record_batch(colunas, schema=esquema))
+                colunas = [[] for _ in esquema]
+        if colunas[0]:
+            escritor.write_batch(pa.record_batch(colunas, schema=esquema))
+
+
+ESCRITORES = {'csv': escrever_csv, 'xlsx': escrever_xlsx, 'parquet': escrever_parquet}
+
+
+async def exportar(user_id, extensao='csv', inicio=None, fim=None):
+    """Exporta os lançamentos de [inicio, fim] (segundos UTC); sem período, todo o histórico.
+
+    Levanta FormatoIndisponivel se a biblioteca do formato não estiver instalada.
+    """
+    formato, compactar = FORMATOS[extensao]
+    if inicio is None:
+        inicio, fim = TODO_HISTORICO
+
+    def _exportar(conn):
+        resultado = ResultadoRelatorio(inicio, fim)
+        arquivo = tempfile.SpooledTemporaryFile(max_size=MEMORIA_MAX)
+        try:
+            lancamentos = _lancamentos(conn, user_id, inicio, fim, resultado)
+            if formato == 'csv':
+                escrever_csv(arquivo, lancamentos, resultado, compactar)
+            else:
+                ESCRITORES[formato](arquivo, lancamentos, resultado)
+        except BaseException:
+            arquivo.close()
+            raise
+        tamanho = arquivo.tell()
+        if not resultado.quantidade:
+            arquivo.close()
+            return None, 0, resultado
+        arquivo.seek(0)
+        return arquivo, tamanho, resultado
+
+    arquivo, tamanho, resultado = await banco.ler(_exportar)
+    return Exportacao(arquivo, f"lancamentos_{_sufixo_nome(inicio, fim)}.{extensao}", tamanho, resultado)
+
+
+def _sufixo_nome(inicio, fim):
+    if (inicio, fim) == TODO_HISTORICO:
+        return 'completo'
+    return f"{unidades.momento_utc(inicio):%Y%m%d}_{unidades.momento_utc(fim):%Y%m%d}"
+
+
+def interpretar_argumentos(args, agora=None):
+    """Lê `[formato] [tudo | MM/AAAA | DD/MM/AAAA DD/MM/AAAA]` do /exportar.
+
+    Devolve (extensao, inicio, fim, descricao), com o período em segundos UTC; None = todo o
+    histórico. Sem período, exporta o mês atual (UTC, como antes). Datas
+    avulsas são dias do fuso de São Paulo, como no relatório personalizado.
+    Levanta ValueError com a mensagem para o usuário.
+    """
+    agora = agora or relogio.agora()
+    args = [arg.lower() for arg in args]
+    extensao = 'csv'
+    if args and args[0] in FORMATOS:
+        extensao = args.pop(0)
+    if not args:
+        inicio = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return extensao, *_intervalo_utc(inicio, inicio + relativedelta(months=1)), "do mês atual"
+    if args == ['tudo']:
+        return extensao, None, None, "de todo o histórico"
+    if len(args) == 1 and re.fullmatch(r'\d{1,2}/\d{4}', args[0]):
+        mes, ano = map(int, args[0].split('/'))
+        if not 1 <= mes <= 12:
+            raise ValueError("Mês inválido.")
+        inicio = datetime(ano, mes, 1, tzinfo=timezone.utc)
+        return extensao, *_intervalo_utc(inicio, inicio + relativedelta(months=1)), f"de {mes:02d}/{ano}"
+    if len(args) == 2:
+        try:
+            inicio, fim = (datetime.strptime(arg, '%d/%m/%Y') for arg in args)
+        except ValueError:
+            raise ValueError("Datas inválidas. Use `DD/MM/AAAA DD/MM/AAAA`.") from None
+        if inicio > fim:
+            raise ValueError("A data de fim não pode ser anterior à de início.")
+        return extensao, *_intervalo_utc(FUSO.localize(inicio), FUSO.localize(fim + timedelta(days=1))), f"de {args[0]} a {args[1]}"
+    raise ValueError("Uso: `/exportar [csv|csv.gz|xlsx|parquet] [tudo | MM/AAAA | DD/MM/AAAA DD/MM/AAAA]`")
+
+
+def _intervalo_utc(inicio, fim_exclusivo):
+    return unidades.epoch(inicio), unidades.epoch(fim_exclusivo) - 1
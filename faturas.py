@@ -0,0 +1,123 @@
+"""Faturas de cartão de crédito calculadas em lote.
+
+As janelas (fechamento anterior + 1 dia até o fechamento) são montadas em
+Python, no fuso de São Paulo, e enviadas numa única consulta com uma CTE de
+VALUES: totais e últimos lançamentos de todos os cartões saem de uma vez.
+Meses mais curtos que o dia de fechamento fecham no último dia do mês.
+"""
+import calendar
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+
+import pytz
+
+import arquivamento
+import banco
+import relogio
+import unidades
+
+FUSO = pytz.timezone('America/Sao_Paulo')
+
+SQL_FATURAS = """
+    WITH janelas(chave, id_cartao, inicio, fim) AS (VALUES {valores}),
+    lancamentos AS (
+        SELECT janelas.chave, t.valor_centavos AS valor, c.nome AS categoria,
+               SUM(t.valor_centavos) OVER (PARTITION BY janelas.chave) AS total,
+               ROW_NUMBER() OVER (PARTITION BY janelas.chave ORDER BY t.data_epoch DESC, t.id DESC) AS ordem
+        FROM janelas
+        JOIN {tabela} t ON t.id_cartao = janelas.id_cartao AND t.data_epoch BETWEEN janelas.inicio AND janelas.fim AND t.tipo = 'saida'
+        LEFT JOIN categorias c ON t.id_categoria = c.id
+    )
+    SELECT chave, total, valor, categoria, ordem FROM lancamentos WHERE ordem <= ?
+"""
+
+CONSULTAS_QUENTES = {
+    'faturas': (SQL_FATURAS.format(valores='(?, ?, ?, ?)', tabela='transacoes'), (0, 1, 946695600, 949373999, 5)),
+    'faturas_arquivo': (SQL_FATURAS.format(valores='(?, ?, ?, ?)', tabela='transacoes_completas'), (0, 1, 946695600, 949373999, 5)),
+}
+
+
+@dataclass
+class Fatura:
+    id_cartao: int
+    nome: str
+    limite: float
+    dia_fechamento: int
+    inicio: date
+    fim: date
+    aberta: bool
+    total: float = 0.0
+    ultimos_lancamentos: list = field(default_factory=list)  # [(valor, categoria)], mais recente primeiro
+
+    @property
+    def limite_disponivel(self):
+        return self.limite - self.total
+
+
+def data_fechamento(ano, mes, dia_fechamento):
+    """Dia de fechamento no mês dado, limitado ao último dia do mês."""
+    return date(ano, mes, min(dia_fechamento, calendar.monthrange(ano, mes)[1]))
+
+
+def _somar_meses(ano, mes, meses):
+    total = ano * 12 + (mes - 1) + meses
+    return total // 12, total % 12 + 1
+
+
+def janela(dia_fechamento, ano, mes):
+    """(início, fim) da fatura que fecha no mês ano/mes."""
+    fim = data_fechamento(ano, mes, dia_fechamento)
+    anterior = data_fechamento(*_somar_meses(ano, mes, -1), dia_fechamento)
+    return anterior + timedelta(days=1), fim
+
+
+def mes_fatura_aberta(dia_fechamento, hoje):
+    """(ano, mês) em que fecha a fatura ainda aberta em `hoje`."""
+    if hoje > data_fechamento(hoje.year, hoje.month, dia_fechamento):
+        return _somar_meses(hoje.year, hoje.month, 1)
+    return hoje.year, hoje.month
+
+
+def _limites_utc(inicio, fim):
+    inicio_utc = FUSO.localize(datetime.combine(inicio, time.min)).astimezone(pytz.utc)
+    fim_utc = FUSO.localize(datetime.combine(fim, time(23, 59, 59))).astimezone(pytz.utc)
+    return unidades.epoch(inicio_utc), unidades.epoch(fim_utc)
+
+
+def _preencher(conn, faturas, limite_lancamentos):
+    if not faturas:
+        return faturas
+    params = []
+    for chave, fatura in enumerate(faturas):
+        params.extend((chave, fatura.id_cartao, *_limites_utc(fatura.inicio, fatura.fim)))
+    # Faturas antigas (referencia) podem cair nos meses arquivados.
+    tabela = arquivamento.tabela_transacoes(conn, min(params[2::4]))
+    sql = SQL_FATURAS.format(valores=', '.join(['(?, ?, ?, ?)'] * len(faturas)), tabela=tabela)
+    for chave, total, valor, categoria, ordem in conn.execute(sql, (*params, max(limite_lancamentos, 1))):
+        fatura = faturas[chave]
+        fatura.total = unidades.reais(total)
+        if ordem <= limite_lancamentos:
+            fatura.ultimos_lancamentos.append((unidades.reais(valor), categoria))
+    return faturas
+
+
+async def calcular(user_id, nome_cartao=None, referencia=None, limite_lancamentos=5, hoje=None):
+    """Faturas dos cartões do usuário (ou só de `nome_cartao`).
+
+    Sem `referencia`, devolve a fatura aberta de cada cartão; com
+    referencia=(ano, mes), a fatura que fechou (ou fecha) naquele mês.
+    """
+    hoje = hoje or relogio.agora(FUSO).date()
+
+    def _calcular(conn):
+        if nome_cartao is None:
+            cartoes = conn.execute("SELECT id, nome, limite, dia_fechamento FROM cartoes WHERE id_usuario = ? ORDER BY nome", (user_id,)).fetchall()
+        else:
+            cartoes = conn.execute("SELECT id, nome, limite, dia_fechamento FROM cartoes WHERE id_usuario = ? AND nome = ?", (user_id, nome_cartao)).fetchall()
+        faturas = []
+        for id_cartao, nome, limite, dia_fechamento in cartoes:
+            ano, mes = referencia or mes_fatura_aberta(dia_fechamento, hoje)
+            inicio, fim = janela(dia_fechamento, ano, mes)
+            faturas.append(Fatura(id_cartao, nome, limite, dia_fechamento, inicio, fim, aberta=fim >= hoje))
+        return _preencher(conn, faturas, limite_lancamentos)
+    return await banco.ler(_calcular)
@@ -0,0 +1,231 @@
+"""Mede os handlers do gastos.py contra uma base gerada por gerar_base.py.
+
+Uso:
+    python ferramentas/gerar_base.py --destino /tmp/bench.db --usuarios 10000
+    python ferramentas/benchmark.py --base /tmp/bench.db --repeticoes 200
+
+Os handlers de verdade são chamados com Updates do python-telegram-bot montados
+a partir de JSON e um bot falso que só registra as chamadas (nada sai para a
+rede). Cada cenário sorteia usuários da base e roda os handlers em sequência,
+um por vez; o SQL é contado pelo rastreio do banco.py. Ao final sai uma tabela
+com p50/p99 por cenário e a média de comandos SQL por execução.
+
+A base é copiada para um diretório temporário antes de começar, já que os
+lançamentos gravados pelo cenário alteram os dados (--sem-copia usa a original).
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+
+import banco  # noqa: E402
+import envio  # noqa: E402
+import gastos  # noqa: E402
+import graficos  # noqa: E402
+import repositorio  # noqa: E402
+
+_ids = itertools.count(1)
+
+
+class BotFalso:
+    """Faz as vezes do telegram.Bot: toda chamada da Bot API é só registrada."""
+
+    defaults = None
+    username = 'bot_benchmark'
+
+    def __init__(self):
+        self.chamadas = []
+
+    def __getattr__(self, metodo):
+        if metodo.startswith('_'):
+            raise AttributeError(metodo)
+
+        async def chamar(*args, **kwargs):
+            self.chamadas.append(metodo)
+            return True
+        return chamar
+
+
+class ContextoFalso:
+    """O que os handlers usam do CallbackContext."""
+
+    def __init__(self, bot, user_data, args=None):
+        self.bot = bot
+        self.user_data = user_data
+        self.chat_data = {}
+        self.args = args or []
+        self.application = None
+        self.job_queue = None
+
+
+def _remetente(telegram_id):
+    return {'id': telegram_id, 'is_bot': False, 'first_name': f"Bench {telegram_id}"}
+
+
+def _mensagem(telegram_id, texto):
+    mensagem = {
+        'message_id': next(_ids), 'date': int(time.time()), 'text': texto,
+        'chat': {'id': telegram_id, 'type': 'private'}, 'from': _remetente(telegram_id),
+    }
+    if texto.startswith('/'):
+        mensagem['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texto.split()[0])}]
+    return mensagem
+
+
+def update_texto(bot, telegram_id, texto):
+    return Update.de_json({'update_id': next(_ids), 'message': _mensagem(telegram_id, texto)}, bot)
+
+
+def update_botao(bot, telegram_id, dados):
+    consulta = {'id': str(next(_ids)), 'chat_instance': '1', 'data': dados, 'from': _remetente(telegram_id), 'message': _mensagem(telegram_id, "...")}
+    return Update.de_json({'update_id': next(_ids), 'callback_query': consulta}, bot)
+
+
+class Usuario:
+    def __init__(self, telegram_id, premium, categorias, cartoes):
+        self.telegram_id = telegram_id
+        self.premium = premium
+        self.categorias = categorias
+        self.cartoes = cartoes
+        self.user_data = {}
+
+
+def carregar_usuarios(caminho, limite, semente):
+    """Sorteia até `limite` usuários da base, com as categorias e cartões de cada um."""
+    conn = sqlite3.connect(caminho)
+    linhas = conn.execute("""
+        SELECT u.id, u.telegram_id, COALESCE(a.data_expiracao >= ?, 0) FROM usuarios u LEFT JOIN assinaturas a ON a.id_usuario = u.id
+    """, (repositorio.corte_premium(),)).fetchall()
+    random.Random(semente).shuffle(linhas)
+    usuarios = []
+    for user_id, telegram_id, premium in linhas[:limite]:
+        categorias = [nome for nome, in conn.execute("SELECT nome FROM categorias WHERE id_usuario = ?", (user_id,))]
+        cartoes = [id_cartao for id_cartao, in conn.execute("SELECT id FROM cartoes WHERE id_usuario = ?", (user_id,))]
+        usuarios.append(Usuario(telegram_id, bool(premium), categorias, cartoes))
+    conn.close()
+    return usuarios
+
+
+# --- Cenários: cada um recebe (bot, usuário, rng) e chama os handlers na ordem do Telegram ---
+async def cenario_lancamento(bot, usuario, rng):
+    contexto = ContextoFalso(bot, usuario.user_data)
+    texto = f"-{rng.randint(5, 300)},{rng.randint(0, 99):02d} {rng.choice(usuario.categorias)}"
+    estado = await gastos.iniciar_processo_transacao(update_texto(bot, usuario.telegram_id, texto), contexto)
+    if estado == gastos.AGUARDANDO_PAGAMENTO:
+        id_cartao = rng.choice([0, *usuario.cartoes])
+        await gastos.receber_forma_pagamento(update_botao(bot, usuario.telegram_id, f"cartao:{id_cartao}"), contexto)
+
+
+async def cenario_relatorio(bot, usuario, rng):
+    await gastos.processar_escolha_periodo(update_botao(bot, usuario.telegram_id, rng.choice(("rel_mes_atual", "rel_mes_anterior"))), ContextoFalso(bot, usuario.user_data))
+
+
+async def cenario_list_cartoes(bot, usuario, rng):
+    await gastos.list_cartoes(update_texto(bot, usuario.telegram_id, "/list_cartoes"), ContextoFalso(bot, usuario.user_data))
+
+
+async def cenario_list_orcamentos(bot, usuario, rng):
+    await gastos.list_orcamentos(update_texto(bot, usuario.telegram_id, "/meus_orcamentos"), ContextoFalso(bot, usuario.user_data))
+
+
+async def cenario_exportar(bot, usuario, rng):
+    args = rng.choice(([], ['tudo'], ['csv.gz', 'tudo']))
+    await gastos.exportar(update_texto(bot, usuario.telegram_id, " ".join(["/exportar", *args])), ContextoFalso(bot, usuario.user_data, args))
+
+
+async def cenario_start(bot, usuario, rng):
+    await gastos.start(update_texto(bot, usuario.telegram_id, "/start"), ContextoFalso(bot, usuario.user_data))
+
+
+# nome -> (função, só premium)
+CENARIOS = {
+    'lancamento': (cenario_lancamento, False),
+    'relatorio': (cenario_relatorio, False),
+    'list_cartoes': (cenario_list_cartoes, False),
+    'list_orcamentos': (cenario_list_orcamentos, True),
+    'exportar': (cenario_exportar, True),
+    'start': (cenario_start, False),
+}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+async def medir(nome, funcao, usuarios, repeticoes, contador, rng):
+    bot = BotFalso()
+    duracoes, consultas = [], []
+    for _ in range(repeticoes):
+        usuario = rng.choice(usuarios)
+        antes = contador[0]
+        inicio = time.perf_counter()
+        await funcao(bot, usuario, rng)
+        duracoes.append(time.perf_counter() - inicio)
+        consultas.append(contador[0] - antes)
+    return nome, duracoes, consultas, len(bot.chamadas)
+
+
+async def principal(args):
+    caminho = args.base
+    if not args.sem_copia:
+        diretorio = tempfile.mkdtemp(prefix='benchmark-')
+        caminho = os.path.join(diretorio, 'gastos_bot.db')
+        shutil.copyfile(args.base, caminho)
+    usuarios = carregar_usuarios(caminho, args.usuarios, args.semente)
+    if not usuarios:
+        sys.exit(f"Nenhum usuário em {args.base}; gere a base com ferramentas/gerar_base.py.")
+
+    # Conta os comandos SQL de todas as conexões do pool (os cenários rodam um por vez).
+    contador = [0]
+
+    def rastrear(_sql):
+        contador[0] += 1
+    banco.configurar(caminho, leitores=args.leitores, rastreio=rastrear)
+    envio.configurar(BotFalso())
+    rng = random.Random(args.semente)
+    escolhidos = args.cenarios or list(CENARIOS)
+    resultados = []
+    try:
+        for nome in escolhidos:
+            funcao, so_premium = CENARIOS[nome]
+            candidatos = [u for u in usuarios if u.premium] if so_premium else usuarios
+            if not candidatos:
+                print(f"{nome}: nenhum usuário premium sorteado; pulando.")
+                continue
+            await medir(nome, funcao, candidatos, min(args.aquecimento, args.repeticoes), contador, rng)
+            resultados.append(await medir(nome, funcao, candidatos, args.repeticoes, contador, rng))
+    finally:
+        await envio.encerrar()
+        await banco.encerrar()
+        graficos.encerrar()
+        if not args.sem_copia:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    print(f"\n{'cenário':<16} {'n':>6} {'p50 (ms)':>10} {'p99 (ms)':>10} {'máx (ms)':>10} {'SQL/exec':>9} {'API/exec':>9}")
+    for nome, duracoes, consultas, chamadas in resultados:
+        print(f"{nome:<16} {len(duracoes):>6} {percentil(duracoes, 0.50) * 1000:>10.2f} {percentil(duracoes, 0.99) * 1000:>10.2f} "
+              f"{max(duracoes) * 1000:>10.2f} {sum(consultas) / len(consultas):>9.1f} {chamadas / len(duracoes):>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base', required=True, help="gastos_bot.db gerado por ferramentas/gerar_base.py")
+    parser.add_argument('--cenarios', nargs='*', choices=list(CENARIOS))
+    parser.add_argument('--repeticoes', type=int, default=200)
+    parser.add_argument('--aquecimento', type=int, default=20, help="execuções descartadas antes de medir (caches, imports)")
+    parser.add_argument('--usuarios', type=int, default=1000, help="quantos usuários sortear da base")
+    parser.add_argument('--leitores', type=int, default=4)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--sem-copia', action='store_true')
+    asyncio.run(principal(parser.parse_args()))
@@ -0,0 +1,278 @@
+"""Servidor falso da Bot API do Telegram, para testes de carga locais.
+
+Uso:
+    python ferramentas/bot_api_falsa.py --porta 8081
+    TELEGRAM_TOKEN=123:falso TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python gastos.py
+
+Atende o que o bot usa (getMe, getUpdates com long polling, sendMessage,
+sendPhoto, sendDocument, editMessageText, deleteMessage, answerCallbackQuery...)
+e responde qualquer outro método com `true`. As mensagens do bot ganham
+message_id por chat e ficam guardadas, então um cliente pode "apertar" os botões
+inline delas. Com --taxa-retry-after e --limite-envios, parte dos envios recebe
+429 com `retry_after`, como o Telegram faz sob carga.
+
+Sozinho, só registra no log o que o bot envia. O gerador de carga
+(ferramentas/carga.py) usa a classe BotApiFalsa no mesmo processo para injetar
+updates e esperar as respostas; o replay de diários (ferramentas/replay.py) liga
+o bot a ela direto, sem HTTP, pela RequisicaoLocal.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+import tornado.web
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+# Métodos sujeitos aos limites de envio do Telegram (e, aqui, ao 429 simulado).
+METODOS_LIMITADOS = {'sendMessage', 'sendPhoto', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'}
+ARQUIVOS = {'sendPhoto': 'photo', 'sendDocument': 'document'}
+
+
+@dataclass
+class Saida:
+    """Uma mensagem enviada (ou editada) pelo bot."""
+    metodo: str
+    chat_id: int
+    mensagem: dict
+    momento: float = field(default_factory=time.perf_counter)
+
+    @property
+    def texto(self):
+        return self.mensagem.get('text') or self.mensagem.get('caption') or ''
+
+    @property
+    def botoes(self):
+        """callback_data dos botões inline, na ordem do teclado."""
+        teclado = (self.mensagem.get('reply_markup') or {}).get('inline_keyboard', [])
+        return [botao['callback_data'] for linha in teclado for botao in linha if 'callback_data' in botao]
+
+    @property
+    def teclado(self):
+        """Se a mensagem trouxe um teclado de resposta (o menu do /start)."""
+        return bool(self.mensagem.get('teclado'))
+
+
+class BotApiFalsa:
+    def __init__(self, taxa_retry_after=0.0, limite_envios=0, retry_after=1, semente=None):
+        self.taxa_retry_after = taxa_retry_after
+        self.limite_envios = limite_envios  # envios/s no total; 0 = sem limite
+        self.retry_after = retry_after
+        self.rng = random.Random(semente)
+        self.pendentes = deque()
+        self.novos_updates = asyncio.Event()
+        self.primeira_consulta = asyncio.Event()
+        self.encerrando = False
+        self.mensagens = {}  # (chat_id, message_id) -> mensagem
+        self.chamadas = Counter()
+        self.recusas = Counter()  # método -> 429 devolvidos
+        self.ao_enviar = None  # callback(Saida)
+        self._ids_update = itertools.count(1)
+        self._ids_mensagem = {}
+        self._ids_arquivo = itertools.count(1)
+        self._janela_envios = deque()
+        self.usuario_bot = {'id': 1, 'is_bot': True, 'first_name': 'Bot Falso', 'username': 'bot_falso',
+                            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+    # --- Lado do "Telegram": o que os usuários fazem ---
+    def proximo_message_id(self, chat_id):
+        self._ids_mensagem[chat_id] = self._ids_mensagem.get(chat_id, 0) + 1
+        return self._ids_mensagem[chat_id]
+
+    def injetar(self, update):
+        """Enfileira um update (sem update_id) para o próximo getUpdates; devolve o update_id."""
+        update['update_id'] = next(self._ids_update)
+        self.pendentes.append(update)
+        self.novos_updates.set()
+        return update['update_id']
+
+    def encerrar(self):
+        """Libera os getUpdates pendentes e faz os próximos voltarem sem esperar."""
+        self.encerrando = True
+        self.novos_updates.set()
+
+    # --- Lado da Bot API: o que o bot chama ---
+    async def get_updates(self, parametros):
+        self.primeira_consulta.set()
+        offset = int(parametros.get('offset') or 0)
+        limite = int(parametros.get('limit') or 100)
+        while self.pendentes and self.pendentes[0]['update_id'] < offset:
+            self.pendentes.popleft()
+        if not self.pendentes and not self.encerrando:
+            self.novos_updates.clear()
+            try:
+                await asyncio.wait_for(self.novos_updates.wait(), float(parametros.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.pendentes, limite))
+
+    def _recusar(self):
+        """Decide se o próximo envio leva 429: sorteio ou janela de 1 s acima de limite_envios."""
+        if self.taxa_retry_after and self.rng.random() < self.taxa_retry_after:
+            return True
+        if not self.limite_envios:
+            return False
+        agora = time.monotonic()
+        while self._janela_envios and self._janela_envios[0] <= agora - 1:
+            self._janela_envios.popleft()
+        if len(self._janela_envios) >= self.limite_envios:
+            return True
+        self._janela_envios.append(agora)
+        return False
+
+    def _nova_mensagem(self, chat_id, parametros, **campos):
+        mensagem = {
+            'message_id': self.proximo_message_id(chat_id), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': self.usuario_bot, **campos,
+        }
+        self._aplicar_teclado(mensagem, parametros.get('reply_markup'))
+        self.mensagens[(chat_id, mensagem['message_id'])] = mensagem
+        return mensagem
+
+    @staticmethod
+    def _aplicar_teclado(mensagem, teclado):
+        # O Telegram só devolve teclados inline na Message; o de resposta fica marcado à parte.
+        mensagem.pop('reply_markup', None)
+        if teclado and 'inline_keyboard' in teclado:
+            mensagem['reply_markup'] = teclado
+        mensagem['teclado'] = bool(teclado and 'keyboard' in teclado)
+
+    def _arquivo(self, metodo, tamanho):
+        numero = next(self._ids_arquivo)
+        if metodo == 'sendPhoto':
+            return [{'file_id': f"foto{numero}", 'file_unique_id': f"f{numero}", 'width': 800, 'height': 600, 'file_size': tamanho}]
+        return {'file_id': f"doc{numero}", 'file_unique_id': f"d{numero}", 'file_size': tamanho}
+
+    def _registrar(self, metodo, chat_id, mensagem):
+        if self.ao_enviar:
+            self.ao_enviar(Saida(metodo, chat_id, {chave: valor for chave, valor in mensagem.items()}))
+        else:
+            logger.info(f"{metodo} -> {chat_id}: {mensagem.get('text') or mensagem.get('caption') or ''!r}")
+
+    async def chamar(self, metodo, parametros, arquivos):
+        """Executa um método da Bot API. Devolve (status HTTP, corpo JSON)."""
+        self.chamadas[metodo] += 1
+        if metodo in METODOS_LIMITADOS and self._recusar():
+            self.recusas[metodo] += 1
+            return 429, {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {self.retry_after}",
+                         'parameters': {'retry_after': self.retry_after}}
+        if metodo == 'getMe':
+            return 200, {'ok': True, 'result': self.usuario_bot}
+        if metodo == 'getUpdates':
+            return 200, {'ok': True, 'result': await self.get_updates(parametros)}
+
+        chat_id = int(parametros['chat_id']) if 'chat_id' in parametros else None
+        if metodo == 'sendMessage':
+            mensagem = self._nova_mensagem(chat_id, parametros, text=parametros.get('text', ''))
+        elif metodo in ARQUIVOS:
+            campo = ARQUIVOS[metodo]
+            tamanho = len(arquivos[campo][0]['body']) if campo in arquivos else 0
+            mensagem = self._nova_mensagem(chat_id, parametros, caption=parametros.get('caption', ''), **{campo: self._arquivo(metodo, tamanho)})
+        elif metodo in ('editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'):
+            mensagem = self.mensagens.get((chat_id, int(parametros.get('message_id', 0))))
+            if mensagem is None:
+                return 400, {'ok': False, 'error_code': 400, 'description': "Bad Request: message to edit not found"}
+            if metodo == 'editMessageText':
+                mensagem['text'] = parametros.get('text', '')
+            elif metodo == 'editMessageCaption':
+                mensagem['caption'] = parametros.get('caption', '')
+            self._aplicar_teclado(mensagem, parametros.get('reply_markup'))
+            mensagem['edit_date'] = int(time.time())
+        elif metodo == 'deleteMessage':
+            self.mensagens.pop((chat_id, int(parametros.get('message_id', 0))), None)
+            return 200, {'ok': True, 'result': True}
+        else:
+            # answerCallbackQuery, deleteWebhook, setMyCommands, sendChatAction...
+            return 200, {'ok': True, 'result': True}
+        self._registrar(metodo, chat_id, mensagem)
+        return 200, {'ok': True, 'result': {chave: valor for chave, valor in mensagem.items() if chave != 'teclado'}}
+
+    def aplicacao(self):
+        return tornado.web.Application([(r"/bot([^/]+)/(\w+)", ManipuladorMetodo, {'api': self})])
+
+
+def _decodificar(valor):
+    texto = valor.decode('utf-8') if isinstance(valor, bytes) else valor
+    if isinstance(texto, str) and texto[:1] in '{[':
+        try:
+            return json.loads(texto)
+        except ValueError:
+            pass
+    return texto
+
+
+class RequisicaoLocal(BaseRequest):
+    """Liga o bot direto a uma BotApiFalsa, sem HTTP: `Application.builder().request(RequisicaoLocal(api))`.
+
+    Usada pelo replay de diários (ferramentas/replay.py), em que a ida e volta
+    pela rede só somaria ruído à medição dos handlers.
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        metodo = url.rsplit('/', 1)[-1]
+        parametros, arquivos = {}, {}
+        if request_data is not None:
+            parametros = {nome: _decodificar(valor) for nome, valor in request_data.json_parameters.items()}
+            if request_data.contains_files:
+                for campo, (nome_arquivo, conteudo, tipo) in request_data.multipart_data.items():
+                    corpo = conteudo if isinstance(conteudo, bytes) else conteudo.read()
+                    arquivos[campo] = [{'filename': nome_arquivo, 'body': corpo, 'content_type': tipo}]
+        status, corpo = await self.api.chamar(metodo, parametros, arquivos)
+        return status, json.dumps(corpo).encode('utf-8')
+
+
+class ManipuladorMetodo(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    def _parametros(self):
+        if self.request.headers.get('Content-Type', '').startswith('application/json') and self.request.body:
+            return json.loads(self.request.body)
+        # O python-telegram-bot manda form-urlencoded (ou multipart, com arquivos), com objetos em JSON.
+        return {nome: _decodificar(valores[-1]) for nome, valores in self.request.arguments.items()}
+
+    async def post(self, _token, metodo):
+        status, corpo = await self.api.chamar(metodo, self._parametros(), self.request.files)
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(corpo))
+
+    get = post
+
+
+async def principal(args):
+    api = BotApiFalsa(args.taxa_retry_after, args.limite_envios, args.retry_after)
+    api.aplicacao().listen(args.porta, args.host)
+    logger.info(f"Bot API falsa em http://{args.host}:{args.porta}/bot")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8081)
+    parser.add_argument('--taxa-retry-after', type=float, default=0.0, help="fração dos envios que recebe 429")
+    parser.add_argument('--limite-envios', type=int, default=0, help="envios por segundo antes do 429 (0 = sem limite)")
+    parser.add_argument('--retry-after', type=int, default=1, help="segundos informados no 429")
+    asyncio.run(principal(parser.parse_args()))
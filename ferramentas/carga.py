@@ -0,0 +1,279 @@
+"""Teste de carga de ponta a ponta contra a Bot API falsa.
+
+Uso:
+    python ferramentas/carga.py --usuarios 2000 --chegadas 50 --duracao 120
+    python ferramentas/carga.py --usuarios 500 --taxa-retry-after 0.02 --limite-envios 300
+
+Sobe a Bot API falsa (ferramentas/bot_api_falsa.py) e o gastos.py apontado
+para ela (TELEGRAM_BASE_URL), com um DATA_DIR temporário. Os usuários virtuais
+chegam a --chegadas por segundo (processo de Poisson) e rodam em malha fechada:
+mandam um update, esperam a resposta do bot, "pensam" e seguem. Os fluxos são
+os de verdade: onboarding, lançamento com escolha de cartão (e sugestão de
+categoria quando o nome vem com erro de digitação), desfazer e relatório.
+
+Ao final sai a latência (p50/p95/p99) de cada etapa, medida do update
+enfileirado no getUpdates até a resposta chegar na Bot API falsa, a vazão, os
+erros (resposta que não chegou em --timeout) e os 429 devolvidos ao bot.
+
+Com --sem-bot o gastos.py não é iniciado: rode-o à parte com
+TELEGRAM_TOKEN=<--token> e TELEGRAM_BASE_URL=http://127.0.0.1:<--porta>/bot.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from bot_api_falsa import BotApiFalsa
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Três categorias por usuário: o plano gratuito não deixa criar uma quarta.
+CATEGORIAS_SAIDA = ['mercado', 'restaurante', 'farmacia', 'padaria', 'combustivel', 'academia']
+
+
+class SemResposta(Exception):
+    """O bot não respondeu o que a etapa esperava dentro do timeout."""
+
+
+def _tem_botao(prefixo):
+    return lambda saida: any(dados.startswith(prefixo) for dados in saida.botoes)
+
+
+def _relatorio(saida):
+    return saida.metodo in ('sendMessage', 'sendPhoto') and 'Relatório' in saida.texto
+
+
+class Metricas:
+    def __init__(self):
+        self.latencias = defaultdict(list)  # etapa -> segundos
+        self.erros = Counter()
+        self.desfechos = Counter()  # fluxo concluído, upsell...
+
+    def medir(self, etapa, segundos):
+        self.latencias[etapa].append(segundos)
+
+
+class UsuarioVirtual:
+    def __init__(self, api, telegram_id, metricas, rng, timeout):
+        self.api = api
+        self.telegram_id = telegram_id
+        self.metricas = metricas
+        self.rng = rng
+        self.timeout = timeout
+        self.caixa = asyncio.Queue()  # Saida enviadas pelo bot a este chat
+        self.categorias = rng.sample(CATEGORIAS_SAIDA, 2) + ['salario']
+        self.usadas = set()
+
+    def _remetente(self):
+        return {'id': self.telegram_id, 'is_bot': False, 'first_name': f"Carga {self.telegram_id}"}
+
+    async def _enviar(self, etapa, update, espera):
+        """Injeta o update e espera a primeira saída do bot que satisfaz `espera`."""
+        while not self.caixa.empty():
+            self.caixa.get_nowait()
+        inicio = time.perf_counter()
+        self.api.injetar(update)
+        limite = inicio + self.timeout
+        while True:
+            restante = limite - time.perf_counter()
+            try:
+                saida = await asyncio.wait_for(self.caixa.get(), max(restante, 0))
+            except asyncio.TimeoutError:
+                self.metricas.erros[etapa] += 1
+                raise SemResposta(etapa) from None
+            if espera(saida):
+                self.metricas.medir(etapa, saida.momento - inicio)
+                return saida
+
+    async def texto(self, etapa, texto, espera):
+        chat = {'id': self.telegram_id, 'type': 'private', 'first_name': f"Carga {self.telegram_id}"}
+        mensagem = {'message_id': self.api.proximo_message_id(self.telegram_id), 'date': int(time.time()),
+                    'chat': chat, 'from': self._remetente(), 'text': texto}
+        if texto.startswith('/'):
+            mensagem['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texto.split()[0])}]
+        return await self._enviar(etapa, {'message': mensagem}, espera)
+
+    async def botao(self, etapa, saida, dados, espera):
+        """Aperta o botão `dados` da mensagem `saida`."""
+        consulta = {'id': f"{self.telegram_id}-{time.monotonic_ns()}", 'chat_instance': str(self.telegram_id),
+                    'from': self._remetente(), 'data': dados,
+                    'message': {chave: valor for chave, valor in saida.mensagem.items() if chave != 'teclado'}}
+        return await self._enviar(etapa, {'callback_query': consulta}, espera)
+
+
+# --- Fluxos: cada um roda uma conversa completa com o bot ---
+async def fluxo_onboarding(usuario, args):
+    # Usuário novo recebe os botões do tour; um que já existe, o menu (teclado de resposta).
+    saida = await usuario.texto('start', '/start', lambda s: s.botoes or s.teclado)
+    if 'onboarding_start' in saida.botoes and usuario.rng.random() < 0.3:
+        saida = await usuario.botao('onboarding_tour', saida, 'onboarding_start', _tem_botao('onboarding_skip_card'))
+        saida = await usuario.botao('onboarding_tour', saida, 'onboarding_skip_card', _tem_botao('onboarding_skip_all'))
+    if 'onboarding_skip_all' in saida.botoes:
+        await usuario.botao('onboarding_fim', saida, 'onboarding_skip_all', lambda s: s.teclado)
+    usuario.metricas.desfechos['onboarding'] += 1
+
+
+def _com_erro(nome, rng):
+    """Troca duas letras do meio de lugar, como um erro de digitação."""
+    i = rng.randint(1, len(nome) - 3)
+    return nome[:i] + nome[i + 1] + nome[i] + nome[i + 2:]
+
+
+async def fluxo_lancamento(usuario, args):
+    rng = usuario.rng
+    nome = rng.choice(usuario.categorias)
+    sinal = '+' if nome == 'salario' else '-'
+    valor = f"{rng.randint(5, 3000) if sinal == '+' else rng.randint(3, 300)},{rng.randint(0, 99):02d}"
+    digitado = nome
+    if nome in usuario.usadas and sinal == '-' and rng.random() < args.erros_digitacao:
+        digitado = _com_erro(nome, rng)
+    # Saída: pergunta o cartão (ou sugere a categoria); entrada: registra direto com o botão de desfazer.
+    saida = await usuario.texto('lancamento', f"{sinal}{valor} {digitado}", lambda s: bool(s.botoes))
+    if 'sugestao_sim' in saida.botoes:
+        saida = await usuario.botao('sugestao', saida, 'sugestao_sim', lambda s: bool(s.botoes))
+    cartoes = [dados for dados in saida.botoes if dados.startswith('cartao:')]
+    if cartoes:
+        saida = await usuario.botao('cartao', saida, rng.choice(cartoes), lambda s: bool(s.botoes))
+    desfazer = [dados for dados in saida.botoes if dados.startswith('undo:')]
+    if not desfazer:
+        usuario.metricas.desfechos['upsell'] += 1  # limite de categorias do plano gratuito
+        return
+    usuario.usadas.add(nome)
+    usuario.metricas.desfechos['lancamento'] += 1
+    if rng.random() < args.desfazer:
+        await usuario.botao('desfazer', saida, desfazer[0], lambda s: s.metodo == 'editMessageText' and 'desfeito' in s.texto)
+        usuario.metricas.desfechos['desfeito'] += 1
+
+
+async def fluxo_relatorio(usuario, args):
+    saida = await usuario.texto('relatorio', '/relatorio', _tem_botao('rel_'))
+    escolha = usuario.rng.choices(['rel_mes_atual', 'rel_mes_anterior'], [4, 1])[0]
+    await usuario.botao('relatorio_periodo', saida, escolha, _relatorio)
+    usuario.metricas.desfechos['relatorio'] += 1
+
+
+# nome -> (função, peso na escolha)
+FLUXOS = {
+    'lancamento': (fluxo_lancamento, 75),
+    'relatorio': (fluxo_relatorio, 15),
+    'start': (fluxo_onboarding, 10),
+}
+
+
+async def sessao(usuario, args, fim):
+    """Onboarding e depois fluxos sorteados, com tempo de pensar exponencial, até `fim`."""
+    nomes = args.fluxos or list(FLUXOS)
+    pesos = [FLUXOS[nome][1] for nome in nomes]
+    funcao = fluxo_onboarding
+    while time.monotonic() < fim:
+        try:
+            await funcao(usuario, args)
+        except SemResposta:
+            pass
+        if args.pensar:
+            await asyncio.sleep(min(usuario.rng.expovariate(1 / args.pensar), max(fim - time.monotonic(), 0)))
+        funcao = FLUXOS[usuario.rng.choices(nomes, pesos)[0]][0]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+async def iniciar_bot(args, data_dir):
+    ambiente = {**os.environ, 'TELEGRAM_TOKEN': args.token, 'TELEGRAM_BASE_URL': f"http://127.0.0.1:{args.porta}/bot",
+                'DATA_DIR': data_dir, 'BOT_MODO': 'polling'}
+    with open(os.path.join(data_dir, 'bot.log'), 'wb') as log:
+        return await asyncio.create_subprocess_exec(sys.executable, os.path.join(RAIZ, 'gastos.py'), env=ambiente,
+                                                    stdout=log, stderr=asyncio.subprocess.STDOUT)
+
+
+async def encerrar_bot(api, processo):
+    # A espera é assíncrona: o bot ainda chama a Bot API falsa (deste processo) enquanto encerra.
+    api.encerrar()
+    processo.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(processo.wait(), 30)
+    except asyncio.TimeoutError:
+        processo.kill()
+        await processo.wait()
+
+
+async def principal(args):
+    api = BotApiFalsa(args.taxa_retry_after, args.limite_envios, args.retry_after, args.semente)
+    api.aplicacao().listen(args.porta, '127.0.0.1')
+    metricas = Metricas()
+    usuarios = {}
+    api.ao_enviar = lambda saida: usuarios[saida.chat_id].caixa.put_nowait(saida) if saida.chat_id in usuarios else None
+
+    processo = None
+    if not args.sem_bot:
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix='carga-')
+        processo = await iniciar_bot(args, data_dir)
+        print(f"gastos.py iniciado (DATA_DIR={data_dir}, log em {data_dir}/bot.log)")
+    try:
+        await asyncio.wait_for(api.primeira_consulta.wait(), 60)
+    except asyncio.TimeoutError:
+        if processo:
+            await encerrar_bot(api, processo)
+        sys.exit("O bot não chamou getUpdates em 60 s; veja o log.")
+
+    rng = random.Random(args.semente)
+    inicio = time.monotonic()
+    fim = inicio + args.duracao
+    sessoes = []
+    for i in range(args.usuarios):
+        if time.monotonic() >= fim:
+            break
+        usuario = UsuarioVirtual(api, args.primeiro_id + i, metricas, random.Random(rng.random()), args.timeout)
+        usuarios[usuario.telegram_id] = usuario
+        sessoes.append(asyncio.create_task(sessao(usuario, args, fim)))
+        await asyncio.sleep(rng.expovariate(args.chegadas))
+    # Quem está no meio de uma etapa termina (ou estoura o timeout) antes do relatório.
+    await asyncio.gather(*sessoes)
+    duracao = time.monotonic() - inicio
+    if processo:
+        await encerrar_bot(api, processo)
+    else:
+        api.encerrar()
+
+    etapas = sum(len(latencias) for latencias in metricas.latencias.values())
+    erros = sum(metricas.erros.values())
+    print(f"\n{len(usuarios)} usuários em {duracao:.1f}s: {etapas / duracao:.1f} etapas/s, "
+          f"{sum(api.chamadas.values()) / duracao:.1f} chamadas/s à Bot API, {erros} erros ({erros / max(etapas + erros, 1):.2%})")
+    print(f"\n{'etapa':<20} {'n':>7} {'erros':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'máx (ms)':>10}")
+    for etapa in sorted(set(metricas.latencias) | set(metricas.erros)):
+        latencias = metricas.latencias.get(etapa) or [float('nan')]
+        print(f"{etapa:<20} {len(metricas.latencias.get(etapa, [])):>7} {metricas.erros[etapa]:>6} {percentil(latencias, 0.50) * 1000:>10.1f} "
+              f"{percentil(latencias, 0.95) * 1000:>10.1f} {percentil(latencias, 0.99) * 1000:>10.1f} {max(latencias) * 1000:>10.1f}")
+    print("\nFluxos concluídos: " + ", ".join(f"{nome} {n}" for nome, n in metricas.desfechos.most_common()))
+    print("Chamadas à Bot API: " + ", ".join(f"{metodo} {n}" for metodo, n in api.chamadas.most_common()))
+    if api.recusas:
+        print("429 devolvidos: " + ", ".join(f"{metodo} {n}" for metodo, n in api.recusas.most_common()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--usuarios', type=int, default=1000, help="usuários virtuais (no máximo)")
+    parser.add_argument('--chegadas', type=float, default=20, help="novos usuários por segundo")
+    parser.add_argument('--duracao', type=float, default=60, help="segundos de teste, contando a chegada dos usuários")
+    parser.add_argument('--pensar', type=float, default=2.0, help="média do tempo entre um fluxo e o próximo (s)")
+    parser.add_argument('--timeout', type=float, default=15.0, help="espera máxima pela resposta de cada etapa (s)")
+    parser.add_argument('--fluxos', nargs='*', choices=list(FLUXOS))
+    parser.add_argument('--desfazer', type=float, default=0.1, help="fração dos lançamentos desfeitos")
+    parser.add_argument('--erros-digitacao', type=float, default=0.1, help="fração dos lançamentos com o nome da categoria errado")
+    parser.add_argument('--taxa-retry-after', type=float, default=0.0, help="fração dos envios do bot que recebe 429")
+    parser.add_argument('--limite-envios', type=int, default=0, help="envios por segundo antes do 429 (0 = sem limite)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--porta', type=int, default=8081)
+    parser.add_argument('--token', default='123456:carga')
+    parser.add_argument('--primeiro-id', type=int, default=700000000, help="telegram_id do primeiro usuário virtual")
+    parser.add_argument('--data-dir', help="DATA_DIR do bot (padrão: diretório temporário novo)")
+    parser.add_argument('--sem-bot', action='store_true', help="não inicia o gastos.py")
+    parser.add_argument('--semente', type=int, default=1)
+    asyncio.run(principal(parser.parse_args()))
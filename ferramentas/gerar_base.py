@@ -0,0 +1,156 @@
+"""Gera um gastos_bot.db sintético para benchmarks.
+
+Uso:
+    python ferramentas/gerar_base.py --destino /tmp/bench.db --usuarios 10000 --meses 24
+
+Cria usuários com categorias, cartões, orçamentos, agendamentos e assinaturas
+(uma fração premium) e anos de transacoes com volume desigual entre usuários:
+a maioria lança pouco e alguns lançam muito, como na base real. O esquema vem
+das migrações e resumo_mensal é reconstruído no final, então a base sai igual
+à de produção. A mesma --semente gera sempre a mesma base.
+
+Os telegram_id começam em --primeiro-id (os mesmos usados por
+ferramentas/benchmark.py). 1M de usuários com 24 meses dá centenas de milhões
+de lançamentos: ajuste --lancamentos-mes ao disco disponível.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+from dateutil.relativedelta import relativedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agendador  # noqa: E402
+import migracoes  # noqa: E402
+import repositorio  # noqa: E402
+import unidades  # noqa: E402
+
+# Categoria -> (faixa de valor em centavos, peso na escolha)
+CATEGORIAS = {
+    'mercado': ((1500, 45000), 20), 'restaurante': ((2000, 15000), 14), 'uber': ((900, 6000), 12),
+    'farmacia': ((1200, 25000), 6), 'padaria': ((500, 4000), 10), 'lazer': ((3000, 30000), 6),
+    'combustivel': ((5000, 35000), 8), 'assinaturas': ((1990, 5990), 4), 'pets': ((2500, 20000), 3),
+    'roupas': ((5000, 40000), 3), 'presentes': ((3000, 25000), 2), 'academia': ((8000, 15000), 2),
+}
+CONTAS_FIXAS = [('aluguel', 150000), ('luz', 18000), ('internet', 11990), ('condominio', 60000), ('celular', 5990)]
+CARTOES = ['Nubank', 'Inter', 'Itau', 'C6', 'Santander']
+LOTE_USUARIOS = 500
+
+
+def gerar_usuario(rng, user_id, primeiro_id, inicio, fim, args, ids):
+    """Monta as linhas de um usuário; `ids` guarda os próximos ids de categoria/cartão/agendamento."""
+    linhas = {tabela: [] for tabela in ('usuarios', 'categorias', 'cartoes', 'orcamentos', 'assinaturas', 'agendamentos', 'transacoes')}
+    telegram_id = primeiro_id + user_id
+    criado_em = rng.randint(inicio, fim - 86400)
+    linhas['usuarios'].append((user_id, telegram_id, telegram_id, f"usuario{user_id}", unidades.texto_utc(criado_em), None, 0))
+
+    nomes = rng.sample(list(CATEGORIAS), rng.randint(3, len(CATEGORIAS)))
+    categorias = {}
+    for nome in [*nomes, 'salario']:
+        categorias[nome] = ids['categoria']
+        linhas['categorias'].append((ids['categoria'], user_id, nome))
+        ids['categoria'] += 1
+
+    cartoes = []
+    for nome in rng.sample(CARTOES, rng.choice((0, 1, 1, 2, 2, 3))):
+        cartoes.append(ids['cartao'])
+        linhas['cartoes'].append((ids['cartao'], user_id, nome, rng.choice((1000, 2500, 5000, 12000)), rng.randint(1, 28)))
+        ids['cartao'] += 1
+
+    premium = rng.random() < args.premium
+    if premium:
+        expiracao = unidades.momento_utc(fim) + relativedelta(months=rng.randint(1, 12))
+        linhas['assinaturas'].append((user_id, 'mensal', expiracao.strftime('%Y-%m-%d')))
+        for nome in rng.sample(nomes, min(len(nomes), rng.randint(0, 4))):
+            linhas['orcamentos'].append((user_id, categorias[nome], round(CATEGORIAS[nome][0][1] * rng.randint(3, 10) / 100, -1)))
+        for titulo, valor in rng.sample(CONTAS_FIXAS, rng.randint(0, 2)):
+            linhas['agendamentos'].append((ids['agendamento'], user_id, rng.randint(1, 28), f"{rng.randint(7, 21):02d}:00", titulo, valor / 100, telegram_id))
+            ids['agendamento'] += 1
+
+    # Atividade com cauda longa: a maioria lança pouco, alguns muito.
+    por_mes = args.lancamentos_mes * min(rng.lognormvariate(0, 0.9), 8)
+    quantidade = int(por_mes * (fim - criado_em) / (30 * 86400))
+    pesos = [CATEGORIAS[nome][1] for nome in nomes]
+    for _ in range(quantidade):
+        momento = rng.randint(criado_em, fim)
+        if rng.random() < 0.06:
+            tipo, valor, id_categoria, id_cartao = 'entrada', rng.randint(20000, 800000), categorias['salario'], None
+        else:
+            tipo, nome = 'saida', rng.choices(nomes, pesos)[0]
+            valor = rng.randint(*CATEGORIAS[nome][0])
+            id_categoria = categorias[nome]
+            id_cartao = rng.choice(cartoes) if cartoes and rng.random() < 0.55 else None
+        linhas['transacoes'].append((user_id, id_categoria, valor / 100, valor, tipo, unidades.texto_utc(momento), momento, id_cartao))
+    return linhas
+
+
+SQL_INSERCAO = {
+    'usuarios': "INSERT INTO usuarios (id, telegram_id, chat_id, nome_usuario, data_criacao, ultimo_lancamento, dias_sequencia) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    'categorias': "INSERT INTO categorias (id, id_usuario, nome) VALUES (?, ?, ?)",
+    'cartoes': "INSERT INTO cartoes (id, id_usuario, nome, limite, dia_fechamento) VALUES (?, ?, ?, ?, ?)",
+    'orcamentos': "INSERT INTO orcamentos (id_usuario, id_categoria, valor) VALUES (?, ?, ?)",
+    'assinaturas': "INSERT INTO assinaturas (id_usuario, plano, data_expiracao) VALUES (?, ?, ?)",
+    'agendamentos': "INSERT INTO agendamentos (id, id_usuario, dia, horario, titulo, valor, chat_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    # valor e data_transacao continuam sendo gravados, como fazem os caminhos de escrita do bot.
+    'transacoes': "INSERT INTO transacoes (id_usuario, id_categoria, valor, valor_centavos, tipo, data_transacao, data_epoch, id_cartao) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+
+def gerar(args):
+    if os.path.exists(args.destino):
+        if not args.sobrescrever:
+            sys.exit(f"{args.destino} já existe (use --sobrescrever).")
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(args.destino + sufixo):
+                os.remove(args.destino + sufixo)
+    migracoes.aplicar(args.destino)
+    conn = sqlite3.connect(args.destino)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    rng = random.Random(args.semente)
+    agora = datetime.now(timezone.utc)
+    fim = unidades.epoch(agora)
+    inicio = unidades.epoch(agora - relativedelta(months=args.meses))
+    ids = {'categoria': 1, 'cartao': 1, 'agendamento': 1}
+    total_transacoes = 0
+    comeco = time.perf_counter()
+    for primeiro in range(1, args.usuarios + 1, LOTE_USUARIOS):
+        lote = {tabela: [] for tabela in SQL_INSERCAO}
+        for user_id in range(primeiro, min(primeiro + LOTE_USUARIOS, args.usuarios + 1)):
+            for tabela, linhas in gerar_usuario(rng, user_id, args.primeiro_id, inicio, fim, args, ids).items():
+                lote[tabela].extend(linhas)
+        # Inserir em ordem de data deixa transacoes com a mesma localidade da base real.
+        lote['transacoes'].sort(key=lambda linha: linha[6])
+        with conn:
+            for tabela, sql in SQL_INSERCAO.items():
+                conn.executemany(sql, lote[tabela])
+            for id_agendamento, user_id, dia, horario, _, _, chat_id in lote['agendamentos']:
+                agendador.definir_tarefa(conn, agendador.AGENDAMENTO, user_id, chat_id, horario, dia, id_agendamento, agora=agora)
+        total_transacoes += len(lote['transacoes'])
+        print(f"\r{min(primeiro + LOTE_USUARIOS - 1, args.usuarios)}/{args.usuarios} usuários, {total_transacoes} lançamentos", end='', flush=True)
+    print()
+    with conn:
+        repositorio._reconstruir_resumo(conn)
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    tamanho = os.path.getsize(args.destino) / 1024 / 1024
+    print(f"Base gerada em {time.perf_counter() - comeco:.1f}s: {args.destino} ({tamanho:.0f} MB).")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--destino', required=True)
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--meses', type=int, default=24)
+    parser.add_argument('--lancamentos-mes', type=float, default=30, help="média por usuário; a distribuição tem cauda longa")
+    parser.add_argument('--premium', type=float, default=0.2, help="fração de usuários com assinatura ativa")
+    parser.add_argument('--primeiro-id', type=int, default=900000000)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--sobrescrever', action='store_true')
+    gerar(parser.parse_args())
@@ -0,0 +1,78 @@
+"""Simula o Telegram postando updates no webhook do bot, para testes locais.
+
+Uso:
+    BOT_MODO=webhook WEBHOOK_SEGREDO=teste WEBHOOK_URL=http://localhost:8080 python gastos.py
+    python ferramentas/postar_updates.py --url http://localhost:8080/telegram --segredo teste --usuarios 50 --mensagens 5
+
+Cada usuário fictício manda `--mensagens` textos; os POSTs são feitos em paralelo
+(até `--conexoes` por vez). Ao final são impressos os códigos HTTP e a latência
+de aceite do webhook. Também confere que um POST sem o segredo recebe 403.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+import httpx
+
+TEXTOS = ["-25 mercado", "-12,50 uber", "+100 salario", "-8 cafe", "/start", "-40 farmacia"]
+
+_ids_update = itertools.count(1)
+
+
+def montar_update(telegram_id, texto):
+    agora = int(time.time())
+    mensagem = {
+        'message_id': next(_ids_update),
+        'date': agora,
+        'chat': {'id': telegram_id, 'type': 'private', 'first_name': f"Teste {telegram_id}"},
+        'from': {'id': telegram_id, 'is_bot': False, 'first_name': f"Teste {telegram_id}"},
+        'text': texto,
+    }
+    if texto.startswith('/'):
+        mensagem['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(texto.split()[0])}]
+    return {'update_id': mensagem['message_id'], 'message': mensagem}
+
+
+async def postar(cliente, url, segredo, update, limite, resultados):
+    async with limite:
+        inicio = time.perf_counter()
+        try:
+            resposta = await cliente.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': segredo})
+            resultados.append((resposta.status_code, time.perf_counter() - inicio))
+        except httpx.HTTPError as erro:
+            resultados.append((type(erro).__name__, time.perf_counter() - inicio))
+
+
+async def principal(args):
+    async with httpx.AsyncClient(timeout=30) as cliente:
+        recusado = await cliente.post(args.url, json=montar_update(1, "-1 teste"), headers={'X-Telegram-Bot-Api-Secret-Token': 'errado'})
+        print(f"POST com segredo errado: HTTP {recusado.status_code} ({'ok' if recusado.status_code == 403 else 'ESPERADO 403'})")
+
+        limite = asyncio.Semaphore(args.conexoes)
+        resultados = []
+        usuarios = [args.primeiro_id + i for i in range(args.usuarios)]
+        updates = [montar_update(u, random.choice(TEXTOS)) for _ in range(args.mensagens) for u in usuarios]
+        inicio = time.perf_counter()
+        await asyncio.gather(*(postar(cliente, args.url, args.segredo, update, limite, resultados) for update in updates))
+        duracao = time.perf_counter() - inicio
+
+    codigos = {}
+    for codigo, _ in resultados:
+        codigos[codigo] = codigos.get(codigo, 0) + 1
+    latencias = sorted(latencia for _, latencia in resultados)
+    print(f"{len(updates)} updates em {duracao:.2f}s ({len(updates) / duracao:.0f}/s); códigos: {codigos}")
+    for nome, p in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        print(f"  latência {nome}: {latencias[min(len(latencias) - 1, int(p * len(latencias)))] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080/telegram')
+    parser.add_argument('--segredo', required=True)
+    parser.add_argument('--usuarios', type=int, default=10)
+    parser.add_argument('--mensagens', type=int, default=3)
+    parser.add_argument('--conexoes', type=int, default=40)
+    parser.add_argument('--primeiro-id', type=int, default=900000000)
+    asyncio.run(principal(parser.parse_args()))
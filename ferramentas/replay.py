@@ -0,0 +1,194 @@
+"""Reproduz um diário de updates (diario.py) contra uma cópia do banco.
+
+Uso:
+    DIARIO_UPDATES=/data/diario.jsonl.gz DIARIO_SEGREDO=... python gastos.py
+    python ferramentas/replay.py --diario diario.jsonl.gz --base snapshot.db --segredo ... --resultado antes.json
+    git checkout minha-mudanca
+    python ferramentas/replay.py --diario diario.jsonl.gz --base snapshot.db --segredo ... --comparar antes.json
+
+Cada update passa pelos handlers de verdade (gastos.registrar_handlers, com
+persistência de conversas), um por vez e sem pausa entre eles, com o relógio
+(relogio.py) congelado no instante em que o update chegou em produção: sequência
+de dias, mês do orçamento, ciclo da fatura e validade do premium saem iguais a
+cada execução. As chamadas à Bot API vão para a BotApiFalsa no mesmo processo
+(RequisicaoLocal), sem rede.
+
+--segredo aplica à cópia da base os mesmos pseudônimos do diário (o
+DIARIO_SEGREDO usado na gravação) e ao ADMIN_TELEGRAM_ID. O snapshot deve ser
+do momento em que a gravação começou.
+
+Ao final sai a vazão, a latência por update (p50/p99) e um SHA-256 do estado do
+banco (todas as tabelas, em ordem, sem as colunas atualizado_em, que dependem
+de quando a persistência gravou). --resultado guarda tudo em JSON; --comparar lê
+o JSON de outra execução, mostra a diferença de vazão e as tabelas que
+divergiram e sai com código 1 se o estado não for idêntico.
+
+Não são reproduzidos: as tarefas do agendador (lembretes, agendamentos,
+insights), que não chegam como update, e o /importar, já que o conteúdo dos
+arquivos não vai para o diário.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import banco  # noqa: E402
+import diario  # noqa: E402
+import gastos  # noqa: E402
+import graficos  # noqa: E402
+import migracoes  # noqa: E402
+import persistencia  # noqa: E402
+import relogio  # noqa: E402
+from bot_api_falsa import BotApiFalsa, RequisicaoLocal  # noqa: E402
+
+TOKEN = "123:replay"
+# Colunas com o horário da última gravação da persistência, que varia com o intervalo de flush.
+COLUNAS_IGNORADAS = {'atualizado_em'}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def estado_banco(caminho):
+    """{tabela: [linhas, sha256]} de todas as tabelas e o SHA-256 do conjunto."""
+    conn = sqlite3.connect(caminho)
+    tabelas = {}
+    for tabela, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall():
+        colunas = ", ".join(f'"{nome}"' for _, nome, *_ in conn.execute(f'PRAGMA table_info("{tabela}")') if nome not in COLUNAS_IGNORADAS)
+        resumo, linhas = hashlib.sha256(colunas.encode()), 0
+        for linha in conn.execute(f'SELECT {colunas} FROM "{tabela}" ORDER BY {colunas}'):
+            resumo.update(repr(linha).encode() + b"\n")
+            linhas += 1
+        tabelas[tabela] = [linhas, resumo.hexdigest()]
+    conn.close()
+    total = hashlib.sha256(json.dumps(tabelas, sort_keys=True).encode()).hexdigest()
+    return tabelas, total
+
+
+def _registrar_mensagem(api, dados):
+    """Botões apertados no diário apontam para mensagens do bot que a BotApiFalsa desta execução não enviou."""
+    mensagem = (dados.get('callback_query') or {}).get('message')
+    if mensagem:
+        api.mensagens.setdefault((mensagem['chat']['id'], mensagem['message_id']), dict(mensagem))
+
+
+async def reproduzir(args, caminho):
+    api = BotApiFalsa()
+    erros = []
+
+    async def contar_erro(update, context):
+        erros.append(repr(context.error))
+
+    application = (Application.builder().token(TOKEN).request(RequisicaoLocal(api)).get_updates_request(RequisicaoLocal(api))
+                   .updater(None).persistence(persistencia.configurar()).build())
+    application.persistence.vincular(application)
+    gastos.registrar_handlers(application)
+    application.add_error_handler(contar_erro)
+    banco.configurar(caminho, leitores=args.leitores)
+    await application.initialize()
+    duracoes = []
+    inicio = time.perf_counter()
+    try:
+        for numero, (instante, dados) in enumerate(diario.ler(args.diario)):
+            if args.limite and numero >= args.limite:
+                break
+            relogio.congelar(datetime.fromtimestamp(instante, timezone.utc))
+            _registrar_mensagem(api, dados)
+            update = Update.de_json(dados, application.bot)
+            comeco = time.perf_counter()
+            await application.process_update(update)
+            duracoes.append(time.perf_counter() - comeco)
+        segundos = time.perf_counter() - inicio
+        await application.update_persistence()
+    finally:
+        await application.shutdown()
+        relogio.descongelar()
+        await banco.encerrar()
+        graficos.encerrar()
+    return duracoes, segundos, erros, sum(api.chamadas.values())
+
+
+async def principal(args):
+    diretorio = tempfile.mkdtemp(prefix='replay-')
+    caminho = args.base if args.sem_copia else os.path.join(diretorio, 'gastos_bot.db')
+    if args.base and not args.sem_copia:
+        shutil.copyfile(args.base, caminho)
+    try:
+        migracoes.aplicar(caminho)
+        if args.segredo:
+            conn = sqlite3.connect(caminho)
+            diario.pseudonimizar_base(conn, args.segredo)
+            conn.close()
+            if os.getenv("ADMIN_TELEGRAM_ID"):
+                os.environ["ADMIN_TELEGRAM_ID"] = str(diario.pseudonimo(os.environ["ADMIN_TELEGRAM_ID"], args.segredo))
+        # Só muda o texto de algumas respostas, mas assim até as chamadas à Bot API se repetem.
+        random.seed(args.semente)
+        duracoes, segundos, erros, chamadas = await reproduzir(args, caminho)
+        tabelas, total = estado_banco(caminho)
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    if not duracoes:
+        sys.exit(f"Nenhum update em {args.diario}.")
+    resultado = {
+        'updates': len(duracoes), 'segundos': segundos, 'vazao': len(duracoes) / segundos,
+        'p50_ms': percentil(duracoes, 0.50) * 1000, 'p99_ms': percentil(duracoes, 0.99) * 1000,
+        'erros': len(erros), 'chamadas_api': chamadas, 'estado': total, 'tabelas': tabelas,
+    }
+    print(f"\n{resultado['updates']} updates em {segundos:.2f}s: {resultado['vazao']:.1f} updates/s, "
+          f"p50 {resultado['p50_ms']:.2f} ms, p99 {resultado['p99_ms']:.2f} ms, {chamadas} chamadas à Bot API.")
+    if erros:
+        print(f"{len(erros)} updates terminaram em exceção; a primeira: {erros[0]}")
+    print(f"Estado do banco: {total}")
+    if args.resultado:
+        with open(args.resultado, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=1)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo)
+        variacao = (resultado['vazao'] / anterior['vazao'] - 1) * 100
+        print(f"\nVazão: {anterior['vazao']:.1f} -> {resultado['vazao']:.1f} updates/s ({variacao:+.1f}%); "
+              f"p99: {anterior['p99_ms']:.2f} -> {resultado['p99_ms']:.2f} ms")
+        if anterior['updates'] != resultado['updates']:
+            print(f"Atenção: {anterior['updates']} updates na execução anterior, {resultado['updates']} nesta.")
+        if anterior['estado'] == total:
+            print("Estado do banco idêntico.")
+            return
+        for tabela in sorted(set(anterior['tabelas']) | set(tabelas)):
+            antes, depois = anterior['tabelas'].get(tabela), tabelas.get(tabela)
+            if antes != depois:
+                print(f"- {tabela}: {antes[0] if antes else 'ausente'} -> {depois[0] if depois else 'ausente'} linhas" + (" (conteúdo diferente)" if antes and depois and antes[0] == depois[0] else ""))
+        sys.exit("Estado do banco diferente da execução comparada.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--diario', required=True, help="arquivo gravado com DIARIO_UPDATES (.jsonl ou .jsonl.gz)")
+    parser.add_argument('--base', help="snapshot do gastos_bot.db do início da gravação (sem ela, parte de um banco vazio)")
+    parser.add_argument('--segredo', help="DIARIO_SEGREDO da gravação, para pseudonimizar a cópia da base")
+    parser.add_argument('--limite', type=int, default=0, help="reproduz só os primeiros N updates")
+    parser.add_argument('--leitores', type=int, default=4)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--resultado', help="grava vazão, latências e estado do banco neste JSON")
+    parser.add_argument('--comparar', help="JSON de outra execução (--resultado) para comparar")
+    parser.add_argument('--sem-copia', action='store_true', help="altera a própria --base")
+    args = parser.parse_args()
+    if args.sem_copia and (not args.base or args.segredo):
+        parser.error("--sem-copia exige --base e não combina com --segredo")
+    asyncio.run(principal(args))
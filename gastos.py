@@ -1,25 +1,49 @@
+import asyncio
+import io
 import os
 import re
 import sqlite3
 import json
-import io
-import csv
 import random
 import logging
-import matplotlib.pyplot as plt
+import subprocess
+import sys
+import tempfile
+import threading
 from datetime import datetime, time, timezone, timedelta
 from dateutil.relativedelta import relativedelta
 import pytz
-from thefuzz import process, fuzz
 from functools import wraps
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+import agendador
+import arquivamento
+import banco
+import categorias_match
+import diario
+import envio
+import exportacao
+import faturas
+import graficos
+import importacao
+import insights
+import metricas
+import migracoes
+import perfilador
+import persistencia
+import processamento
+import relatorios
+import relogio
+import repositorio
+import unidades
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardMarkup
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -35,26 +59,18 @@ logger = logging.getLogger(__name__)
 ESCOLHER_PERIODO, AGUARDANDO_DATA_INICIO, AGUARDANDO_DATA_FIM = range(3)
 AGUARDANDO_PAGAMENTO, AGUARDANDO_SUGESTAO_CATEGORIA = range(10, 12)
 ONBOARDING_INICIO, ONBOARDING_ORCAMENTO, ONBOARDING_TRANSACAO = range(20, 23)
+AGUARDANDO_ARQUIVO_IMPORTACAO = 30
 
 # --- Configuração da Base de Dados ---
-DATA_DIR = '/data'
+DATA_DIR = os.getenv("DATA_DIR", "/data")
 DB_PATH = os.path.join(DATA_DIR, "gastos_bot.db")
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
 def inicializar_db():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    migracoes.aplicar(DB_PATH)
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS usuarios (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE, chat_id INTEGER, nome_usuario TEXT, data_criacao TEXT, ultimo_lancamento TEXT, dias_sequencia INTEGER DEFAULT 0)')
-    cursor.execute('CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY, id_usuario INTEGER, nome TEXT, UNIQUE(id_usuario, nome), FOREIGN KEY (id_usuario) REFERENCES usuarios (id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS cartoes (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, nome TEXT, limite REAL, dia_fechamento INTEGER, UNIQUE(id_usuario, nome), FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS transacoes (id INTEGER PRIMARY KEY, id_usuario INTEGER, id_categoria INTEGER, valor REAL, tipo TEXT, data_transacao TEXT, id_cartao INTEGER, FOREIGN KEY (id_usuario) REFERENCES usuarios (id), FOREIGN KEY (id_categoria) REFERENCES categorias (id), FOREIGN KEY (id_cartao) REFERENCES cartoes(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS lembretes_diarios (id_usuario INTEGER PRIMARY KEY, horario TEXT, chat_id INTEGER, FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS agendamentos (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, dia INTEGER, horario TEXT, titulo TEXT, valor REAL, chat_id INTEGER, UNIQUE(id_usuario, titulo), FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS orcamentos (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, id_categoria INTEGER, valor REAL, UNIQUE(id_usuario, id_categoria), FOREIGN KEY (id_usuario) REFERENCES usuarios(id), FOREIGN KEY (id_categoria) REFERENCES categorias(id))')
-    cursor.execute('CREATE TABLE IF NOT EXISTS assinaturas (id_usuario INTEGER PRIMARY KEY, plano TEXT, data_expiracao TEXT, FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
-    conn.commit()
+    for nome, detalhe in migracoes.verificar_planos(conn):
+        logger.warning(f"Consulta '{nome}' está varrendo a tabela: {detalhe}")
     conn.close()
 
 # --- Decorador de Acesso Premium ---
@@ -63,39 +79,26 @@ def acesso_premium_necessario(func):
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
         user_id_telegram = update.effective_user.id
-        user_id_interno = get_user_id(user_id_telegram)
+        user_id_interno = await get_user_id(user_id_telegram)
 
         if not user_id_interno:
+            metricas.acesso_premium.inc(func.__name__, 'sem_cadastro')
             await update.effective_message.reply_text("Por favor, inicie o bot com /start primeiro.")
             return
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id_interno,))
-        assinatura = cursor.fetchone()
-        conn.close()
-
-        if assinatura and datetime.strptime(assinatura[0], '%Y-%m-%d') >= datetime.now():
+        if await repositorio.usuario_premium(user_id_interno):
+            metricas.acesso_premium.inc(func.__name__, 'liberado')
             return await func(update, context, *args, **kwargs)
         else:
+            metricas.acesso_premium.inc(func.__name__, 'bloqueado')
             texto_venda = "💎 Esta é uma funcionalidade exclusiva para assinantes Premium! Faça o upgrade para ter acesso a orçamentos, insights e muito mais."
             await update.effective_message.reply_text(texto_venda)
             return
     return wrapper
 
 # --- Funções Auxiliares ---
-def get_user_id(telegram_id):
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (telegram_id,)); user = cursor.fetchone(); conn.close()
-    return user[0] if user else None
-
-def gerar_grafico_pizza(gastos_por_categoria):
-    if not gastos_por_categoria: return None
-    labels = [item[0].capitalize() for item in gastos_por_categoria]; sizes = [item[1] for item in gastos_por_categoria]
-    fig, ax = plt.subplots(figsize=(8, 6)); ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, pctdistance=0.85)
-    centre_circle = plt.Circle((0,0),0.70,fc='white'); fig.gca().add_artist(centre_circle); ax.axis('equal')
-    plt.title('Distribuição de Gastos do Período', pad=20); buf = io.BytesIO(); plt.savefig(buf, format='png', bbox_inches='tight'); plt.close(fig); buf.seek(0)
-    return buf
+async def get_user_id(telegram_id):
+    return await repositorio.obter_id_usuario(telegram_id)
 
 # --- Comandos Principais e Onboarding ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -103,17 +106,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     chat_id = update.effective_chat.id
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, dias_sequencia FROM usuarios WHERE telegram_id = ?", (telegram_id,))
-    user_data = cursor.fetchone()
+    user_data = await repositorio.obter_usuario_por_telegram(telegram_id)
 
     if not user_data:
-        data_criacao_str = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("INSERT INTO usuarios (telegram_id, chat_id, nome_usuario, data_criacao, dias_sequencia) VALUES (?, ?, ?, ?, ?)", 
-                       (telegram_id, chat_id, user.username, data_criacao_str, 0))
-        conn.commit()
-        conn.close()
+        await repositorio.criar_usuario(telegram_id, chat_id, user.username)
 
         welcome_text = (f"Olá, {user.first_name}! 👋 Seja muito bem-vindo(a) ao PlinBot!\n\n"
                         "Vejo que é sua primeira vez por aqui. Gostaria de um tour rápido para aprender a usar as principais funções?")
@@ -126,9 +122,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ONBOARDING_INICIO
     else:
         user_id_local, dias_sequencia = user_data
-        cursor.execute("UPDATE usuarios SET chat_id = ? WHERE telegram_id = ?", (chat_id, telegram_id))
-        conn.commit()
-        conn.close()
+        await repositorio.atualizar_chat_id(telegram_id, chat_id)
         
         reply_keyboard = [
             ["📊 Relatório", "💳 Cartões"], 
@@ -138,12 +132,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
         
-        agora_utc = datetime.now(timezone.utc)
-        inicio_mes_str = agora_utc.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
-        conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-        cursor.execute("SELECT SUM(valor) FROM transacoes WHERE id_usuario = ? AND tipo = 'saida' AND data_transacao >= ?", (user_id_local, inicio_mes_str))
-        gastos_mes = cursor.fetchone()[0] or 0.0
-        conn.close()
+        gastos_mes = await repositorio.somar_gastos_mes(user_id_local, repositorio.mes_atual())
         
         nome = user.first_name
         mensagem = f"Olá de volta, {nome}!\n\n"
@@ -235,14 +224,15 @@ async def ajuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "💳 *Cartões de Crédito:*\n"
         "  `/add_cartao <nome> <limite> <dia_fecha>`\n"
         "  `/list_cartoes`\n"
-        "  `/fatura <nome_cartao>`\n"
+        "  `/fatura <nome_cartao> [MM/AAAA]`\n"
         "  `/del_cartao <nome>`\n\n"
         "⏰ *Lembretes e Agendamentos (Premium):*\n"
         "  `/agendar <dia> <HH:MM> [valor] <título>`\n"
         "  `/ver_agendamentos`\n"
         "  `/cancelar_agendamento <título>`\n\n"
         "📊 *Análise e Exportação (Premium):*\n"
-        "  `/exportar`"
+        "  `/exportar [csv|csv.gz|xlsx|parquet] [tudo | MM/AAAA | DD/MM/AAAA DD/MM/AAAA]`\n"
+        "  `/importar [nome do cartão]` (extrato CSV ou OFX)"
     )
     await update.effective_message.reply_text(texto_ajuda, parse_mode='Markdown')
 
@@ -258,7 +248,7 @@ async def finalizar_onboarding_com_transacao(update: Update, context: ContextTyp
         return ONBOARDING_TRANSACAO # Permanece no mesmo estado se errar
 
     # Registra a transação de forma simplificada, sem pedir forma de pagamento
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     sinal, valor_str, nome_categoria = match.groups()
     nome_categoria = nome_categoria.strip().lower()
     
@@ -277,20 +267,14 @@ async def finalizar_onboarding_com_transacao(update: Update, context: ContextTyp
     return await onboarding_finalizar(update, context)
 # (Continuando o código...)
 async def add_cartao(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id,))
-    assinatura = cursor.fetchone()
-    is_premium = bool(assinatura and datetime.strptime(assinatura[0], '%Y-%m-%d') >= datetime.now())
+    user_id = await get_user_id(update.effective_user.id)
+    is_premium = await repositorio.usuario_premium(user_id)
 
     if not is_premium:
-        cursor.execute("SELECT COUNT(id) FROM cartoes WHERE id_usuario = ?", (user_id,))
-        num_cartoes = cursor.fetchone()[0]
+        num_cartoes = await repositorio.contar_cartoes(user_id)
         if num_cartoes >= 1:
             # <<< A MUDANÇA ESTÁ AQUI >>>
             await handle_premium_upsell(update, context, feature_name="1 cartão de crédito")
-            conn.close()
             return
 
     try:
@@ -298,38 +282,24 @@ async def add_cartao(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not (1 <= dia_fechamento <= 31 and limite > 0): raise ValueError()
     except (IndexError, ValueError):
         await update.effective_message.reply_text("Formato inválido! Use: `/add_cartao <nome> <limite> <dia_fecha>`")
-        conn.close()
         return
     
-    try:
-        cursor.execute("INSERT INTO cartoes (id_usuario, nome, limite, dia_fechamento) VALUES (?, ?, ?, ?)", (user_id, nome_cartao, limite, dia_fechamento))
-        conn.commit()
+    if await repositorio.adicionar_cartao(user_id, nome_cartao, limite, dia_fechamento):
         await update.effective_message.reply_text(f"💳 Cartão '{nome_cartao}' adicionado!")
         if context.user_data.get('onboarding'):
-            conn.close()
             return await onboarding_pedir_transacao(update, context)
-    except sqlite3.IntegrityError:
+    else:
         await update.effective_message.reply_text(f"⚠️ Já existe um cartão com o nome '{nome_cartao}'.")
-    finally:
-        conn.close()
 
 @acesso_premium_necessario
 async def set_orcamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     try:
         args = context.args
         valor = float(args[-1].replace(',', '.'))
         nome_categoria = " ".join(args[:-1]).lower()
         if not nome_categoria or valor <= 0: raise ValueError()
-        conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-        cursor.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria))
-        categoria = cursor.fetchone()
-        if not categoria:
-            cursor.execute("INSERT INTO categorias (id_usuario, nome) VALUES (?, ?)", (user_id, nome_categoria)); conn.commit()
-            categoria_id = cursor.lastrowid
-        else:
-            categoria_id = categoria[0]
-        cursor.execute("REPLACE INTO orcamentos (id_usuario, id_categoria, valor) VALUES (?, ?, ?)", (user_id, categoria_id, valor)); conn.commit(); conn.close()
+        await repositorio.definir_orcamento(user_id, nome_categoria, valor)
         await update.effective_message.reply_text(f"✅ Orçamento de R$ {valor:.2f} definido para a categoria '{nome_categoria.capitalize()}'.")
         if context.user_data.get('onboarding'):
             return await onboarding_pedir_transacao(update, context)
@@ -338,11 +308,8 @@ async def set_orcamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @acesso_premium_necessario
 async def list_orcamentos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    agora_utc = datetime.now(timezone.utc); inicio_mes_str = agora_utc.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
-    query = "SELECT c.nome, o.valor, (SELECT SUM(t.valor) FROM transacoes t WHERE t.id_categoria = c.id AND t.id_usuario = ? AND t.tipo = 'saida' AND t.data_transacao >= ?) as gasto_total FROM orcamentos o JOIN categorias c ON o.id_categoria = c.id WHERE o.id_usuario = ? ORDER BY c.nome"
-    cursor.execute(query, (user_id, inicio_mes_str, user_id)); orcamentos = cursor.fetchall(); conn.close()
+    user_id = await get_user_id(update.effective_user.id)
+    orcamentos = await repositorio.listar_orcamentos_com_gastos(user_id, repositorio.mes_atual())
     if not orcamentos:
         await update.effective_message.reply_text("Você ainda não definiu nenhum orçamento. Use `/orcamento <categoria> <valor>` para começar.")
         return
@@ -355,23 +322,18 @@ async def list_orcamentos(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @acesso_premium_necessario
 async def del_orcamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     try:
         nome_categoria = " ".join(context.args).lower()
         if not nome_categoria: raise ValueError()
-        conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-        cursor.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)); categoria = cursor.fetchone()
-        if not categoria:
-            await update.effective_message.reply_text(f"Não encontrei a categoria '{nome_categoria.capitalize()}'."); conn.close()
+        removido = await repositorio.apagar_orcamento(user_id, nome_categoria)
+        if removido is None:
+            await update.effective_message.reply_text(f"Não encontrei a categoria '{nome_categoria.capitalize()}'.")
             return
-        categoria_id = categoria[0]
-        cursor.execute("DELETE FROM orcamentos WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id))
-        if cursor.rowcount > 0:
-            conn.commit()
+        if removido:
             await update.effective_message.reply_text(f"✅ Orçamento para '{nome_categoria.capitalize()}' removido.")
         else:
             await update.effective_message.reply_text(f"Você não tinha um orçamento definido para '{nome_categoria.capitalize()}'.")
-        conn.close()
     except (IndexError, ValueError):
         await update.effective_message.reply_text("Formato inválido! Use: `/del_orcamento <categoria>`")
 
@@ -385,73 +347,58 @@ async def menu_lembretes_e_agendamentos(update: Update, context: ContextTypes.DE
 async def menu_cartoes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = ("Aqui pode gerir os seus cartões de crédito:\n\n"
              "➡️ Para adicionar:\n`/add_cartao <Nome> <Limite> <Dia do Fechamento>`\n*Exemplo:* `/add_cartao Nubank 1500 28`\n\n"
-             "➡️ Para consultar:\n`/list_cartoes`\n`/fatura <Nome do Cartão>`\n\n"
+             "➡️ Para consultar:\n`/list_cartoes`\n`/fatura <Nome do Cartão> [MM/AAAA]`\n\n"
              "➡️ Para remover:\n`/del_cartao <Nome do Cartão>`")
     await update.effective_message.reply_text(texto, parse_mode='Markdown')
 
 async def list_cartoes(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id, nome, limite, dia_fechamento FROM cartoes WHERE id_usuario = ? ORDER BY nome", (user_id,)); cartoes = cursor.fetchall()
-    if not cartoes: await update.effective_message.reply_text("Nenhum cartão adicionado. Use `/add_cartao`."); conn.close(); return
+    user_id = await get_user_id(update.effective_user.id)
+    faturas_abertas = await faturas.calcular(user_id, limite_lancamentos=0)
+    if not faturas_abertas: await update.effective_message.reply_text("Nenhum cartão adicionado. Use `/add_cartao`."); return
     resposta = ["💳 *Sua Carteira de Cartões:*\n"]
-    for id_cartao, nome, limite, dia_fechamento in cartoes:
-        fatura_atual, _, _ = calcular_fatura(id_cartao, dia_fechamento); limite_disponivel = limite - fatura_atual
-        resposta.append(f"Card: *{nome}* (Fecha dia {dia_fechamento})"); resposta.append(f"Fatura Aberta: R$ {fatura_atual:.2f}"); resposta.append(f"Limite Disponível: R$ {limite_disponivel:.2f}\n")
-    conn.close(); await update.effective_message.reply_text("\n".join(resposta), parse_mode='Markdown')
-
-def calcular_fatura(id_cartao, dia_fechamento):
-    hoje = datetime.now(pytz.timezone('America/Sao_Paulo'))
-    if hoje.day > dia_fechamento: data_fim_fatura = (hoje + relativedelta(months=1)).replace(day=dia_fechamento)
-    else: data_fim_fatura = hoje.replace(day=dia_fechamento)
-    data_inicio_fatura = (data_fim_fatura - relativedelta(months=1)) + timedelta(days=1)
-    inicio_str = data_inicio_fatura.replace(hour=0, minute=0, second=0).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    fim_str = data_fim_fatura.replace(hour=23, minute=59, second=59).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT SUM(valor) FROM transacoes WHERE id_cartao = ? AND tipo = 'saida' AND data_transacao BETWEEN ? AND ?", (id_cartao, inicio_str, fim_str)); fatura_total = cursor.fetchone()[0] or 0.0; conn.close()
-    return fatura_total, data_inicio_fatura, data_fim_fatura
+    for f in faturas_abertas:
+        resposta.append(f"Card: *{f.nome}* (Fecha dia {f.dia_fechamento})"); resposta.append(f"Fatura Aberta: R$ {f.total:.2f}"); resposta.append(f"Limite Disponível: R$ {f.limite_disponivel:.2f}\n")
+    await update.effective_message.reply_text("\n".join(resposta), parse_mode='Markdown')
 
 async def fatura(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
-    try: nome_cartao = " ".join(context.args).capitalize();
-    except IndexError: await update.effective_message.reply_text("Uso: `/fatura <nome do cartão>`"); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id, limite, dia_fechamento FROM cartoes WHERE id_usuario = ? AND nome = ?", (user_id, nome_cartao)); cartao = cursor.fetchone()
-    if not cartao: await update.effective_message.reply_text(f"Não encontrei o cartão '{nome_cartao}'."); conn.close(); return
-    id_cartao, limite, dia_fechamento = cartao
-    fatura_total, data_inicio, data_fim = calcular_fatura(id_cartao, dia_fechamento); limite_disponivel = limite - fatura_total
-    resposta = [f"📊 *Fatura Aberta - {nome_cartao}*", f"Período: {data_inicio.strftime('%d/%m')} a {data_fim.strftime('%d/%m')}\n", f"Total da Fatura: *R$ {fatura_total:.2f}*", f"Limite Disponível: R$ {limite_disponivel:.2f}\n"]
-    inicio_str = data_inicio.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'); fim_str = data_fim.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute("SELECT valor, c.nome FROM transacoes t JOIN categorias c ON t.id_categoria = c.id WHERE t.id_cartao = ? AND t.data_transacao BETWEEN ? AND ? ORDER BY t.data_transacao DESC LIMIT 5", (id_cartao, inicio_str, fim_str)); ultimos_gastos = cursor.fetchall(); conn.close()
-    if ultimos_gastos:
+    user_id = await get_user_id(update.effective_user.id)
+    args = list(context.args or []); referencia = None
+    if args and re.fullmatch(r'\d{1,2}/\d{4}', args[-1]):
+        mes, ano = map(int, args.pop().split('/'))
+        if not 1 <= mes <= 12: await update.effective_message.reply_text("Mês inválido. Use `/fatura <nome do cartão> [MM/AAAA]`", parse_mode='Markdown'); return
+        referencia = (ano, mes)
+    nome_cartao = " ".join(args).capitalize()
+    if not nome_cartao: await update.effective_message.reply_text("Uso: `/fatura <nome do cartão> [MM/AAAA]`", parse_mode='Markdown'); return
+    encontradas = await faturas.calcular(user_id, nome_cartao, referencia=referencia)
+    if not encontradas: await update.effective_message.reply_text(f"Não encontrei o cartão '{nome_cartao}'."); return
+    f = encontradas[0]
+    resposta = [f"📊 *Fatura {'Aberta' if f.aberta else 'Fechada'} - {f.nome}*", f"Período: {f.inicio.strftime('%d/%m')} a {f.fim.strftime('%d/%m/%Y')}\n", f"Total da Fatura: *R$ {f.total:.2f}*"]
+    if f.aberta: resposta.append(f"Limite Disponível: R$ {f.limite_disponivel:.2f}\n")
+    else: resposta.append("")
+    if f.ultimos_lancamentos:
         resposta.append("*Últimos Lançamentos:*")
-        for valor, categoria in ultimos_gastos: resposta.append(f"- {categoria.capitalize()}: R$ {valor:.2f}")
+        for valor, categoria in f.ultimos_lancamentos: resposta.append(f"- {(categoria or relatorios.SEM_CATEGORIA).capitalize()}: R$ {valor:.2f}")
     await update.effective_message.reply_text("\n".join(resposta), parse_mode='Markdown')
 
 async def del_cartao(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     try: nome_cartao = " ".join(context.args).capitalize()
     except IndexError: await update.effective_message.reply_text("Uso: `/del_cartao <nome>`"); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM cartoes WHERE id_usuario = ? AND nome = ?", (user_id, nome_cartao)); cartao = cursor.fetchone()
-    if not cartao: await update.effective_message.reply_text(f"Não encontrei o cartão '{nome_cartao}'."); conn.close(); return
-    cartao_id = cartao[0]; cursor.execute("UPDATE transacoes SET id_cartao = NULL WHERE id_cartao = ?", (cartao_id,)); cursor.execute("DELETE FROM cartoes WHERE id = ?", (cartao_id,)); conn.commit(); conn.close()
+    if not await repositorio.apagar_cartao(user_id, nome_cartao): await update.effective_message.reply_text(f"Não encontrei o cartão '{nome_cartao}'."); return
     await update.effective_message.reply_text(f"✅ Cartão '{nome_cartao}' removido.")
 
 async def list_categorias(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT nome FROM categorias WHERE id_usuario = ? ORDER BY nome", (user_id,)); categorias = cursor.fetchall(); conn.close()
+    user_id = await get_user_id(update.effective_user.id)
+    categorias = await repositorio.listar_nomes_categorias(user_id)
     if not categorias: await update.effective_message.reply_text("Você ainda não tem categorias."); return
-    lista_formatada = ["*Suas Categorias:*\n"] + [f"- {nome.capitalize()}" for nome, in categorias]
+    lista_formatada = ["*Suas Categorias:*\n"] + [f"- {nome.capitalize()}" for nome in categorias]
     await update.effective_message.reply_text("\n".join(lista_formatada), parse_mode='Markdown')
 
 async def del_categoria(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     try: nome_categoria = context.args[0].lower()
     except IndexError: await update.effective_message.reply_text("Uso: `/del_categoria <nome>`"); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)); categoria = cursor.fetchone()
-    if not categoria: await update.effective_message.reply_text(f"Categoria '{nome_categoria}' não encontrada."); conn.close(); return
-    categoria_id = categoria[0]; cursor.execute("UPDATE transacoes SET id_categoria = NULL WHERE id_categoria = ?", (categoria_id,)); cursor.execute("DELETE FROM categorias WHERE id = ?", (categoria_id,)); conn.commit(); conn.close()
+    if not await repositorio.apagar_categoria(user_id, nome_categoria): await update.effective_message.reply_text(f"Categoria '{nome_categoria}' não encontrada."); return
     await update.effective_message.reply_text(f"✅ Categoria '{nome_categoria}' apagada.")
 
 ESCOLHER_PERIODO, AGUARDANDO_DATA_INICIO, AGUARDANDO_DATA_FIM = range(3)
@@ -459,7 +406,7 @@ async def iniciar_relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("Mês Atual", callback_data="rel_mes_atual")], [InlineKeyboardButton("Mês Anterior", callback_data="rel_mes_anterior")], [InlineKeyboardButton("Período Específico", callback_data="rel_periodo_especifico")]]
     await update.effective_message.reply_text("Qual período gostaria de analisar?", reply_markup=InlineKeyboardMarkup(keyboard)); return ESCOLHER_PERIODO
 async def processar_escolha_periodo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query; await query.answer(); escolha = query.data; agora = datetime.now(timezone.utc)
+    query = update.callback_query; await query.answer(); escolha = query.data; agora = relogio.agora()
     if escolha == "rel_mes_atual":
         await query.edit_message_text("Gerando relatório do mês atual..."); inicio = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0); fim = (inicio + relativedelta(months=1)) - timedelta(seconds=1)
         return await gerar_relatorio(update, context, inicio, fim)
@@ -484,39 +431,32 @@ async def receber_data_fim(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except (ValueError, KeyError): await update.effective_message.reply_text("Ocorreu um erro. Use `DD/MM/AAAA` ou /cancelar para recomeçar."); return AGUARDANDO_DATA_FIM
 async def gerar_relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE, data_inicio, data_fim):
     user_id_telegram = update.effective_user.id
-    user_id_interno = get_user_id(user_id_telegram)
-    
-    inicio_str = data_inicio.strftime('%Y-%m-%d %H:%M:%S')
-    fim_str = data_fim.strftime('%Y-%m-%d %H:%M:%S')
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    user_id_interno = await get_user_id(user_id_telegram)
     
     # ### MUDANÇA ###: Verifica se o usuário é premium
-    cursor.execute("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id_interno,))
-    assinatura = cursor.fetchone()
-    is_premium = bool(assinatura and datetime.strptime(assinatura[0], '%Y-%m-%d') >= datetime.now())
+    is_premium = await repositorio.usuario_premium(user_id_interno)
     # ### FIM DA MUDANÇA ###
     
-    cursor.execute("SELECT SUM(valor) FROM transacoes WHERE id_usuario = ? AND tipo = 'entrada' AND data_transacao BETWEEN ? AND ?", (user_id_interno, inicio_str, fim_str)); entradas = cursor.fetchone()[0] or 0.0
-    cursor.execute("SELECT SUM(valor) FROM transacoes WHERE id_usuario = ? AND tipo = 'saida' AND data_transacao BETWEEN ? AND ?", (user_id_interno, inicio_str, fim_str)); saidas = cursor.fetchone()[0] or 0.0
-    saldo = entradas - saidas
-    cursor.execute("SELECT c.nome, SUM(t.valor) FROM transacoes t LEFT JOIN categorias c ON t.id_categoria = c.id WHERE t.id_usuario = ? AND t.tipo = 'saida' AND data_transacao BETWEEN ? AND ? GROUP BY c.nome ORDER BY SUM(t.valor) DESC", (user_id_interno, inicio_str, fim_str)); gastos_por_categoria = cursor.fetchall()
-    conn.close()
+    resultado = await relatorios.gerar(user_id_interno, unidades.epoch(data_inicio), unidades.epoch(data_fim))
+    gastos_por_categoria = resultado.gastos_por_categoria()
     
     titulo_periodo = f"de {data_inicio.astimezone(pytz.timezone('America/Sao_Paulo')).strftime('%d/%m/%Y')} a {data_fim.astimezone(pytz.timezone('America/Sao_Paulo')).strftime('%d/%m/%Y')}"
-    legenda_texto = [f"📊 *Relatório do Período*\n_{titulo_periodo}_", f"🟢 Entradas: R$ {entradas:.2f}", f"🔴 Saídas: R$ {saidas:.2f}", f"💰 Saldo do Período: R$ {saldo:.2f}"]
+    legenda_texto = [f"📊 *Relatório do Período*\n_{titulo_periodo}_", f"🟢 Entradas: R$ {resultado.entradas:.2f}", f"🔴 Saídas: R$ {resultado.saidas:.2f}", f"💰 Saldo do Período: R$ {resultado.saldo:.2f}"]
     
     if gastos_por_categoria:
         legenda_texto.append("\n*Gastos por Categoria:*")
         for nome, total in gastos_por_categoria:
-            percentual = (total / saidas) * 100 if saidas > 0 else 0
-            legenda_texto.append(f"  - {nome.capitalize()}: R$ {total:.2f} ({percentual:.1f}%)")
+            percentual = (total / resultado.saidas) * 100 if resultado.saidas > 0 else 0
+            legenda_texto.append(f"  - {nome.capitalize()}: R$ {total:.2f} ({percentual:.1f}%)")
+    gastos_por_cartao = resultado.gastos_por_cartao()
+    if any(nome != relatorios.SEM_CARTAO for nome, _ in gastos_por_cartao):
+        legenda_texto.append("\n*Gastos por Forma de Pagamento:*")
+        for nome, total in gastos_por_cartao: legenda_texto.append(f"  - {nome}: R$ {total:.2f}")
             
     # ### MUDANÇA ###: Só gera o gráfico se for premium
     buffer_imagem = None
     if is_premium:
-        buffer_imagem = gerar_grafico_pizza(gastos_por_categoria)
+        buffer_imagem = await graficos.gerar_grafico_pizza(gastos_por_categoria, titulo_periodo)
     # ### FIM DA MUDANÇA ###
     
     mensagem_final = "\n".join(legenda_texto)
@@ -530,21 +470,51 @@ async def gerar_relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE, da
         
     return ConversationHandler.END
 async def cancelar_conversa(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    for key in ['data_inicio_relatorio', 'transacao_pendente', 'sugestao_categoria']:
+    for key in ['data_inicio_relatorio', 'transacao_pendente', 'sugestao_categoria', 'importacao_cartao']:
         if key in context.user_data: del context.user_data[key]
     await update.effective_message.reply_text("Operação cancelada."); return ConversationHandler.END
 
 @acesso_premium_necessario
-async def exportar_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); agora_utc = datetime.now(timezone.utc); inicio_mes_utc_str = agora_utc.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S'); conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT t.data_transacao, t.tipo, t.valor, c.nome as cat_nome, cart.nome as cart_nome FROM transacoes t LEFT JOIN categorias c ON t.id_categoria = c.id LEFT JOIN cartoes cart ON t.id_cartao = cart.id WHERE t.id_usuario = ? AND t.data_transacao >= ? ORDER BY t.data_transacao ASC", (user_id, inicio_mes_utc_str)); transacoes = cursor.fetchall(); conn.close()
-    if not transacoes: await update.effective_message.reply_text("Não há transações neste mês para exportar."); return
-    output = io.StringIO(); writer = csv.writer(output, delimiter=';'); writer.writerow(['Data (UTC)', 'Tipo', 'Valor', 'Categoria', 'Forma Pagamento'])
-    for data, tipo, valor, cat_nome, cart_nome in transacoes:
-        forma_pagamento = cart_nome if cart_nome else 'Dinheiro/Débito'
-        writer.writerow([data, tipo, str(valor).replace('.',','), cat_nome.capitalize() if cat_nome else 'Sem Categoria', forma_pagamento])
-    output.seek(0); data_bytes = output.getvalue().encode('utf-8'); mes_ano = agora_utc.strftime('%Y_%m'); file_name = f"relatorio_{mes_ano}.csv"
-    await context.bot.send_document(chat_id=update.effective_chat.id, document=data_bytes, filename=file_name, caption="Aqui está o seu relatório de transações do mês.")
+async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = await get_user_id(update.effective_user.id)
+    try: extensao, inicio, fim, descricao = exportacao.interpretar_argumentos(context.args or [])
+    except ValueError as erro: await update.effective_message.reply_text(str(erro), parse_mode='Markdown'); return
+    try: exportado = await exportacao.exportar(user_id, extensao, inicio, fim)
+    except exportacao.FormatoIndisponivel: await update.effective_message.reply_text(f"A exportação em {extensao} não está disponível no momento. Use `csv`.", parse_mode='Markdown'); return
+    if exportado.arquivo is None: await update.effective_message.reply_text(f"Não há transações {descricao} para exportar."); return
+    with exportado.arquivo:
+        if exportado.tamanho > exportacao.LIMITE_UPLOAD: await update.effective_message.reply_text("O arquivo ficou grande demais para o Telegram. Tente um período menor ou `csv.gz`/`parquet`.", parse_mode='Markdown'); return
+        # read_file_handle=False: o httpx lê o arquivo em blocos durante o envio, em vez de o PTB carregá-lo inteiro na memória.
+        documento = InputFile(exportado.arquivo, filename=exportado.nome, read_file_handle=False)
+        await context.bot.send_document(chat_id=update.effective_chat.id, document=documento, caption=f"Aqui estão suas {exportado.resultado.quantidade} transações {descricao}.")
+
+@acesso_premium_necessario
+async def iniciar_importacao(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = await get_user_id(update.effective_user.id); nome_cartao = " ".join(context.args or []).capitalize(); context.user_data['importacao_cartao'] = None
+    if nome_cartao:
+        cartao = await repositorio.obter_cartao(user_id, nome_cartao)
+        if not cartao: await update.effective_message.reply_text(f"Não encontrei o cartão '{nome_cartao}'. Use `/importar [nome do cartão]`.", parse_mode='Markdown'); return ConversationHandler.END
+        context.user_data['importacao_cartao'] = cartao[0]
+    await update.effective_message.reply_text(f"Envie o extrato em *CSV* ou *OFX*{f' do cartão {nome_cartao}' if nome_cartao else ''} (até 20 MB), ou /cancelar.", parse_mode='Markdown')
+    return AGUARDANDO_ARQUIVO_IMPORTACAO
+
+async def receber_arquivo_importacao(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    documento = update.effective_message.document; nome_arquivo = documento.file_name or 'extrato.csv'
+    if not nome_arquivo.lower().endswith(importacao.EXTENSOES): await update.effective_message.reply_text("Envie um arquivo .csv ou .ofx, ou /cancelar."); return AGUARDANDO_ARQUIVO_IMPORTACAO
+    if (documento.file_size or 0) > importacao.TAMANHO_MAX: await update.effective_message.reply_text("O arquivo passa de 20 MB, o limite do Telegram para bots. Divida o extrato e envie por partes."); return AGUARDANDO_ARQUIVO_IMPORTACAO
+    user_id = await get_user_id(update.effective_user.id); id_cartao = context.user_data.pop('importacao_cartao', None)
+    await update.effective_message.reply_text("Importando... ⏳")
+    with tempfile.SpooledTemporaryFile(max_size=exportacao.MEMORIA_MAX) as arquivo:
+        await (await documento.get_file()).download_to_memory(arquivo); arquivo.seek(0)
+        try: resumo = await importacao.importar(user_id, arquivo, nome_arquivo, id_cartao)
+        except importacao.ArquivoInvalido as erro: await update.effective_message.reply_text(f"Não consegui ler o extrato: {erro}"); return ConversationHandler.END
+    linhas = [f"📥 *Importação {resumo.formato} concluída*", f"Lançamentos importados: *{resumo.importadas}* de {resumo.lidas} linhas"]
+    if resumo.importadas: linhas += [f"Período: {resumo.primeira_data.strftime('%d/%m/%Y')} a {resumo.ultima_data.strftime('%d/%m/%Y')}", f"Entradas: R$ {resumo.entradas:.2f} | Saídas: R$ {resumo.saidas:.2f}"]
+    if resumo.duplicadas: linhas.append(f"Já registrados (ignorados): {resumo.duplicadas}")
+    if resumo.invalidas: linhas.append(f"Linhas ilegíveis: {resumo.invalidas}")
+    if resumo.sem_categoria: linhas.append(f"Sem categoria: {resumo.sem_categoria} (a descrição não bateu com nenhuma categoria sua)")
+    await update.effective_message.reply_text("\n".join(linhas), parse_mode='Markdown')
+    return ConversationHandler.END
 
 async def iniciar_processo_transacao(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.effective_message.text
@@ -552,26 +522,20 @@ async def iniciar_processo_transacao(update: Update, context: ContextTypes.DEFAU
     if not match: return ConversationHandler.END 
     sinal, valor_str, nome_categoria = match.groups(); nome_categoria = nome_categoria.strip().lower()
     if not nome_categoria: await update.effective_message.reply_text("Adicione uma categoria. Ex: `-50 mercado`"); return ConversationHandler.END
-    user_id = get_user_id(update.effective_user.id)
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)); categoria = cursor.fetchone()
-    if not categoria:
-        cursor.execute("SELECT nome FROM categorias WHERE id_usuario = ?", (user_id,)); todas_categorias = [cat[0] for cat in cursor.fetchall()]
-        conn.close()
-        if todas_categorias:
-            melhor_sugestao, score = process.extractOne(nome_categoria, todas_categorias, scorer=fuzz.token_sort_ratio)
-            if score > 70: 
-                context.user_data['sugestao_categoria'] = {'sinal': sinal, 'valor_str': valor_str, 'categoria_errada': nome_categoria, 'sugestao': melhor_sugestao}
-                keyboard = [[InlineKeyboardButton(f"Sim, usar '{melhor_sugestao.capitalize()}'", callback_data=f"sugestao_sim"), InlineKeyboardButton("Não, criar nova", callback_data=f"sugestao_nao")]]
-                await update.effective_message.reply_text(f"Hmm, não encontrei a categoria '{nome_categoria}'. Quis dizer '{melhor_sugestao.capitalize()}'?", reply_markup=InlineKeyboardMarkup(keyboard))
-                return AGUARDANDO_SUGESTAO_CATEGORIA
-    conn.close()
-    context.user_data['transacao_pendente'] = {'sinal': sinal, 'valor_str': valor_str, 'nome_categoria': nome_categoria}
+    user_id = await get_user_id(update.effective_user.id)
+    melhor_sugestao, origem, _ = await categorias_match.resolver(user_id, nome_categoria)
+    if origem in ('exata', 'apelido'):
+        nome_categoria = melhor_sugestao
+    elif origem == 'sugestao':
+        context.user_data['sugestao_categoria'] = {'sinal': sinal, 'valor_str': valor_str, 'categoria_errada': nome_categoria, 'sugestao': melhor_sugestao}
+        keyboard = [[InlineKeyboardButton(f"Sim, usar '{melhor_sugestao.capitalize()}'", callback_data=f"sugestao_sim"), InlineKeyboardButton("Não, criar nova", callback_data=f"sugestao_nao")]]
+        await update.effective_message.reply_text(f"Hmm, não encontrei a categoria '{nome_categoria}'. Quis dizer '{melhor_sugestao.capitalize()}'?", reply_markup=InlineKeyboardMarkup(keyboard))
+        return AGUARDANDO_SUGESTAO_CATEGORIA
     if sinal == '+':
         await registrar_transacao_final(update, context, user_id, nome_categoria, sinal, valor_str)
         return ConversationHandler.END
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id, nome FROM cartoes WHERE id_usuario = ? ORDER BY nome", (user_id,)); cartoes = cursor.fetchall(); conn.close()
+    context.user_data['transacao_pendente'] = {'sinal': sinal, 'valor_str': valor_str, 'nome_categoria': nome_categoria}
+    cartoes = await repositorio.listar_nomes_cartoes(user_id)
     keyboard = []
     for id_cartao, nome in cartoes: keyboard.append([InlineKeyboardButton(f"💳 {nome}", callback_data=f"cartao:{id_cartao}")])
     keyboard.append([InlineKeyboardButton("💵 Dinheiro/Débito", callback_data="cartao:0")])
@@ -584,13 +548,15 @@ async def tratar_sugestao_categoria(update: Update, context: ContextTypes.DEFAUL
     if not dados_sugestao: await query.edit_message_text("Ocorreu um erro. Tente lançar novamente."); return ConversationHandler.END
     nome_categoria_correta = dados_sugestao['sugestao'] if query.data == 'sugestao_sim' else dados_sugestao['categoria_errada']
     await query.edit_message_text(f"Ok, usando a categoria '{nome_categoria_correta.capitalize()}'...")
-    user_id = get_user_id(update.effective_user.id)
-    context.user_data['transacao_pendente'] = {'sinal': dados_sugestao['sinal'], 'valor_str': dados_sugestao['valor_str'], 'nome_categoria': nome_categoria_correta}
+    user_id = await get_user_id(update.effective_user.id)
+    if query.data == 'sugestao_sim':
+        # Da próxima vez, o mesmo texto vai direto para a categoria aceita
+        await categorias_match.aprender_apelido(user_id, dados_sugestao['categoria_errada'], nome_categoria_correta)
     if dados_sugestao['sinal'] == '+':
         await registrar_transacao_final(update, context, user_id, nome_categoria_correta, dados_sugestao['sinal'], dados_sugestao['valor_str'])
         return ConversationHandler.END
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id, nome FROM cartoes WHERE id_usuario = ? ORDER BY nome", (user_id,)); cartoes = cursor.fetchall(); conn.close()
+    context.user_data['transacao_pendente'] = {'sinal': dados_sugestao['sinal'], 'valor_str': dados_sugestao['valor_str'], 'nome_categoria': nome_categoria_correta}
+    cartoes = await repositorio.listar_nomes_cartoes(user_id)
     keyboard = []
     for id_cartao, nome in cartoes: keyboard.append([InlineKeyboardButton(f"💳 {nome}", callback_data=f"cartao:{id_cartao}")])
     keyboard.append([InlineKeyboardButton("💵 Dinheiro/Débito", callback_data="cartao:0")])
@@ -601,77 +567,40 @@ async def receber_forma_pagamento(update: Update, context: ContextTypes.DEFAULT_
     query = update.callback_query; await query.answer()
     dados_transacao = context.user_data.pop('transacao_pendente', None)
     if not dados_transacao: await query.edit_message_text("Ocorreu um erro. Tente registar novamente."); return ConversationHandler.END
-    user_id = get_user_id(update.effective_user.id)
+    user_id = await get_user_id(update.effective_user.id)
     id_cartao = int(query.data.split(':')[1]) if query.data.split(':')[1] != '0' else None
     await query.edit_message_text("Ok, registando...")
     await registrar_transacao_final(update, context, user_id, dados_transacao['nome_categoria'], dados_transacao['sinal'], dados_transacao['valor_str'], id_cartao=id_cartao)
     return ConversationHandler.END
 
-async def registrar_transacao_final(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, nome_categoria, sinal, valor_str, id_cartao=None, is_scheduled=False):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria))
-    categoria = cursor.fetchone()
-    
-    if not categoria:
-        # LÓGICA DE LIMITE DE CATEGORIAS PARA PLANO GRATUITO
-        cursor.execute("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id,))
-        assinatura = cursor.fetchone()
-        is_premium = bool(assinatura and datetime.strptime(assinatura[0], '%Y-%m-%d') >= datetime.now())
-
-        if not is_premium:
-            cursor.execute("SELECT COUNT(id) FROM categorias WHERE id_usuario = ?", (user_id,))
-            num_categorias = cursor.fetchone()[0]
-            if num_categorias >= 3:
-                # <<< A MUDANÇA ESTÁ AQUI >>>
-                await handle_premium_upsell(update, context, feature_name="3 categorias")
-                conn.close()
-                return
-        
-        cursor.execute("INSERT INTO categorias (id_usuario, nome) VALUES (?, ?)", (user_id, nome_categoria)); conn.commit()
-        categoria_id = cursor.lastrowid
-    else: 
-        categoria_id = categoria[0]
-        
+async def registrar_transacao_final(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, nome_categoria, sinal, valor_str, id_cartao=None, is_scheduled=False, chat_id=None):
     tipo = 'saida' if sinal == '-' else 'entrada'
-    valor = float(valor_str.replace(',', '.'))
-    data_str = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    
-    cursor.execute("INSERT INTO transacoes (id_usuario, id_categoria, valor, tipo, data_transacao, id_cartao) VALUES (?, ?, ?, ?, ?, ?)", (user_id, categoria_id, valor, tipo, data_str, id_cartao))
-    new_transaction_id = cursor.lastrowid
-    
+    valor_centavos = unidades.centavos(valor_str); valor = unidades.reais(valor_centavos)
+
+    # Categoria, lançamento, sequência e orçamento são gravados numa única transação
+    resultado = await repositorio.registrar_transacao(user_id, nome_categoria, tipo, valor_centavos, id_cartao=id_cartao, atualizar_sequencia=not is_scheduled)
+    if resultado is None:
+        # LÓGICA DE LIMITE DE CATEGORIAS PARA PLANO GRATUITO
+        if is_scheduled: logger.warning(f"Agendamento '{nome_categoria}' do usuário {user_id} não registrado: limite de categorias do plano gratuito."); return
+        await handle_premium_upsell(update, context, feature_name="3 categorias")
+        return
+    new_transaction_id = resultado['id_transacao']
+
     mensagem_sequencia = ""
-    if not is_scheduled:
-        hoje_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-        cursor.execute("SELECT ultimo_lancamento, dias_sequencia FROM usuarios WHERE id = ?", (user_id,))
-        ultimo_lancamento, dias_sequencia = cursor.fetchone()
-        dias_sequencia = dias_sequencia or 0
-        if ultimo_lancamento != hoje_str:
-            ontem_str = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
-            nova_sequencia = dias_sequencia + 1 if ultimo_lancamento == ontem_str else 1
-            mensagem_sequencia = f"\n\n🔥 Sequência de {nova_sequencia} dias!" if nova_sequencia > 1 else "\n\n💪 Nova sequência iniciada!"
-            cursor.execute("UPDATE usuarios SET ultimo_lancamento = ?, dias_sequencia = ? WHERE id = ?", (hoje_str, nova_sequencia, user_id))
+    nova_sequencia = resultado['nova_sequencia']
+    if nova_sequencia is not None:
+        mensagem_sequencia = f"\n\n🔥 Sequência de {nova_sequencia} dias!" if nova_sequencia > 1 else "\n\n💪 Nova sequência iniciada!"
     
     mensagem_orcamento = ""
-    if tipo == 'saida':
-        cursor.execute("SELECT valor FROM orcamentos WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id))
-        orcamento = cursor.fetchone()
-        if orcamento:
-            orcamento_valor = orcamento[0]
-            inicio_mes_str = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute("SELECT SUM(valor) FROM transacoes WHERE id_usuario = ? AND id_categoria = ? AND tipo = 'saida' AND data_transacao >= ?", (user_id, categoria_id, inicio_mes_str))
-            gasto_total_mes = cursor.fetchone()[0] or 0.0
-            percentual = (gasto_total_mes / orcamento_valor) * 100
-            mensagem_orcamento = f"\n\n💰 *Orçamento:* Você gastou R$ {gasto_total_mes:.2f} de R$ {orcamento_valor:.2f} ({percentual:.1f}%) em '{nome_categoria.capitalize()}' este mês."
-            if gasto_total_mes > orcamento_valor:
-                mensagem_orcamento += "\n⚠️ *Atenção: Você ultrapassou o orçamento para esta categoria!*"
-
-    conn.commit()
-    conn.close()
+    if resultado['orcamento']:
+        orcamento_valor, gasto_total_mes = resultado['orcamento']
+        percentual = (gasto_total_mes / orcamento_valor) * 100
+        mensagem_orcamento = f"\n\n💰 *Orçamento:* Você gastou R$ {gasto_total_mes:.2f} de R$ {orcamento_valor:.2f} ({percentual:.1f}%) em '{nome_categoria.capitalize()}' este mês."
+        if gasto_total_mes > orcamento_valor:
+            mensagem_orcamento += "\n⚠️ *Atenção: Você ultrapassou o orçamento para esta categoria!*"
     
     if is_scheduled:
-        await context.bot.send_message(chat_id=context.job.chat_id, text=f"✅ Gasto agendado de '{nome_categoria.capitalize()}' (R$ {valor:.2f}) foi registrado automaticamente.{mensagem_orcamento}", parse_mode='Markdown')
+        envio.enviar(chat_id, f"✅ Gasto agendado de '{nome_categoria.capitalize()}' (R$ {valor:.2f}) foi registrado automaticamente.{mensagem_orcamento}", parse_mode='Markdown')
         return
     
      # --- Início da Lógica Corrigida ---
@@ -683,11 +612,7 @@ async def registrar_transacao_final(update: Update, context: ContextTypes.DEFAUL
     
     # 2. Adiciona detalhes do cartão, se houver
     if id_cartao:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT nome FROM cartoes WHERE id = ?", (id_cartao,))
-        nome_cartao = cursor.fetchone()[0]
-        conn.close()
+        nome_cartao = await repositorio.obter_nome_cartao(id_cartao)
         detalhes_msg += f"\n**Cartão:** {nome_cartao}"
         
     # 3. Compõe a mensagem final
@@ -710,56 +635,42 @@ async def desfazer_lancamento(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query; await query.answer()
     try: transaction_id = int(query.data.split(':')[1])
     except (IndexError, ValueError): await query.edit_message_text("Erro ao processar."); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM transacoes WHERE id = ?", (transaction_id,))
-    if not cursor.fetchone(): await query.edit_message_text("✅ Já foi desfeito.")
-    else: cursor.execute("DELETE FROM transacoes WHERE id = ?", (transaction_id,)); conn.commit(); await query.edit_message_text("✅ Lançamento desfeito!")
-    conn.close()
+    user_id = await get_user_id(update.effective_user.id)
+    if not await repositorio.desfazer_transacao(user_id, transaction_id): await query.edit_message_text("✅ Já foi desfeito.")
+    else: await query.edit_message_text("✅ Lançamento desfeito!")
 
 async def definir_lembrete_diario(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id; user_id = get_user_id(update.effective_user.id)
+    chat_id = update.effective_chat.id; user_id = await get_user_id(update.effective_user.id)
     try:
-        horario_str = context.args[0]; fuso_horario = pytz.timezone('America/Sao_Paulo')
-        hora, minuto = map(int, horario_str.split(':')); horario_obj = time(hour=hora, minute=minuto, tzinfo=fuso_horario)
+        horario_str = context.args[0]
+        hora, minuto = map(int, horario_str.split(':')); time(hour=hora, minute=minuto)  # valida o horário
     except (IndexError, ValueError): await update.effective_message.reply_text("Uso: `/lembrete HH:MM`"); return
-    job_name = f"diario_{chat_id}"
-    for job in context.application.job_queue.get_jobs_by_name(job_name): job.schedule_removal()
-    context.application.job_queue.run_daily(lambda ctx: ctx.bot.send_message(chat_id=ctx.job.chat_id, text=random.choice(["Olá! 👋 Lembre-se de registar seus gastos hoje.", "Ei, como foram as finanças hoje? ✍️"])), time=horario_obj, chat_id=chat_id, name=job_name)
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("REPLACE INTO lembretes_diarios (id_usuario, horario, chat_id) VALUES (?, ?, ?)", (user_id, horario_str, chat_id)); conn.commit(); conn.close()
+    await repositorio.salvar_lembrete(user_id, f"{hora:02d}:{minuto:02d}", chat_id)
     await update.effective_message.reply_text(f"✅ Lembrete diário configurado para as {horario_str}.")
 async def cancelar_lembrete_diario(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id; user_id = get_user_id(update.effective_user.id); job_name = f"diario_{chat_id}"
-    jobs = context.application.job_queue.get_jobs_by_name(job_name)
-    if not jobs: await update.effective_message.reply_text("Nenhum lembrete diário ativo."); return
-    for job in jobs: job.schedule_removal()
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor(); cursor.execute("DELETE FROM lembretes_diarios WHERE id_usuario = ?", (user_id,)); conn.commit(); conn.close()
+    user_id = await get_user_id(update.effective_user.id)
+    if not await repositorio.apagar_lembrete(user_id): await update.effective_message.reply_text("Nenhum lembrete diário ativo."); return
     await update.effective_message.reply_text("✅ Lembrete diário cancelado.")
 
 @acesso_premium_necessario
 async def agendar_conta(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); chat_id = update.effective_chat.id; args = context.args
+    user_id = await get_user_id(update.effective_user.id); chat_id = update.effective_chat.id; args = context.args
     try:
         if len(args) < 3: raise ValueError()
         dia = int(args[0]); horario_str = args[1]; valor = None
         try: valor = float(args[2].replace(',', '.')); titulo = " ".join(args[3:])
         except ValueError: titulo = " ".join(args[2:])
         if not (1 <= dia <= 31) or not titulo: raise ValueError()
-        hora, minuto = map(int, horario_str.split(':')); fuso_horario = pytz.timezone('America/Sao_Paulo'); horario_obj = time(hour=hora, minute=minuto, tzinfo=fuso_horario)
+        hora, minuto = map(int, horario_str.split(':')); time(hour=hora, minute=minuto)  # valida o horário
     except (IndexError, ValueError): await update.effective_message.reply_text("Uso: `/agendar <dia> <HH:MM> [valor] <título>`"); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("REPLACE INTO agendamentos (id_usuario, dia, horario, titulo, valor, chat_id) VALUES (?, ?, ?, ?, ?, ?)", (user_id, dia, horario_str, titulo.lower(), valor, chat_id)); id_agendamento = cursor.lastrowid; conn.commit(); conn.close()
-    job_name = f"agendamento_{chat_id}_{id_agendamento}"
-    for job in context.application.job_queue.get_jobs_by_name(job_name): job.schedule_removal()
-    callback_func = callback_agendamento if valor is not None else (lambda ctx: ctx.bot.send_message(chat_id=ctx.job.chat_id, text=f"🗓️ Lembrete: Hora de pagar *{ctx.job.data['titulo'].capitalize()}*.", parse_mode='Markdown'))
-    context.application.job_queue.run_monthly(callback_func, when=horario_obj, day=dia, name=job_name, chat_id=chat_id, data={'user_id': user_id, 'nome_categoria': titulo.lower(), 'sinal': '-', 'valor_str': str(valor), 'titulo': titulo})
+    await repositorio.salvar_agendamento(user_id, dia, f"{hora:02d}:{minuto:02d}", titulo.lower(), valor, chat_id)
     if valor: await update.effective_message.reply_text(f"✅ Despesa '{titulo.capitalize()}' de R$ {valor:.2f} agendada para todo dia {dia} às {horario_str}!")
     else: await update.effective_message.reply_text(f"✅ Lembrete para '{titulo.capitalize()}' agendado para todo dia {dia} às {horario_str}!")
 
 @acesso_premium_necessario
 async def ver_agendamentos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT dia, horario, titulo, valor FROM agendamentos WHERE id_usuario = ? ORDER BY dia, horario", (user_id,)); agendamentos = cursor.fetchall(); conn.close()
+    user_id = await get_user_id(update.effective_user.id)
+    agendamentos = await repositorio.listar_agendamentos_usuario(user_id)
     if not agendamentos: await update.effective_message.reply_text("Nenhuma conta agendada."); return
     resposta = ["🗓️ *Suas Contas Agendadas:*\n"]
     for dia, horario, titulo, valor in agendamentos:
@@ -769,119 +680,135 @@ async def ver_agendamentos(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @acesso_premium_necessario
 async def cancelar_agendamento(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = get_user_id(update.effective_user.id); chat_id = update.effective_chat.id
+    user_id = await get_user_id(update.effective_user.id)
     try: titulo_para_remover = " ".join(context.args).lower().strip()
     except IndexError: await update.effective_message.reply_text("Uso: `/cancelar_agendamento <título>`"); return
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id FROM agendamentos WHERE id_usuario = ? AND titulo = ?", (user_id, titulo_para_remover)); agendamento = cursor.fetchone()
-    if not agendamento: await update.effective_message.reply_text(f"Não encontrei agendamento com o título '{titulo_para_remover}'."); conn.close(); return
-    id_agendamento = agendamento[0]; cursor.execute("DELETE FROM agendamentos WHERE id = ?", (id_agendamento,)); conn.commit(); conn.close()
-    job_name = f"agendamento_{chat_id}_{id_agendamento}"
-    for job in context.application.job_queue.get_jobs_by_name(job_name): job.schedule_removal()
+    id_agendamento = await repositorio.apagar_agendamento(user_id, titulo_para_remover)
+    if not id_agendamento: await update.effective_message.reply_text(f"Não encontrei agendamento com o título '{titulo_para_remover}'."); return
     await update.effective_message.reply_text(f"✅ Agendamento '{titulo_para_remover.capitalize()}' cancelado.")
 
-def carregar_tarefas_agendadas(application: Application):
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor(); fuso_horario = pytz.timezone('America/Sao_Paulo')
-    cursor.execute("SELECT horario, chat_id FROM lembretes_diarios")
-    for horario_str, chat_id in cursor.fetchall():
-        hora, minuto = map(int, horario_str.split(':')); horario_obj = time(hour=hora, minute=minuto, tzinfo=fuso_horario)
-        application.job_queue.run_daily(lambda ctx: ctx.bot.send_message(chat_id=ctx.job.chat_id, text=random.choice(["Olá! 👋 Lembre-se de registar seus gastos hoje.", "Ei, como foram as finanças hoje? ✍️"])), time=horario_obj, chat_id=chat_id, name=f"diario_{chat_id}")
-    print(f"Carregados {cursor.rowcount} lembretes diários.")
-    cursor.execute("SELECT id, dia, horario, titulo, valor, chat_id, id_usuario FROM agendamentos")
-    agendamentos = cursor.fetchall()
-    for id_agendamento, dia, horario_str, titulo, valor, chat_id, user_id in agendamentos:
-        hora, minuto = map(int, horario_str.split(':')); horario_obj = time(hour=hora, minute=minuto, tzinfo=fuso_horario)
-        job_name = f"agendamento_{chat_id}_{id_agendamento}"
-        callback_func = callback_agendamento if valor is not None else (lambda ctx: ctx.bot.send_message(chat_id=ctx.job.chat_id, text=f"🗓️ Lembrete: Hora de pagar *{ctx.job.data['titulo'].capitalize()}*.", parse_mode='Markdown'))
-        application.job_queue.run_monthly(callback_func, when=horario_obj, day=dia, name=job_name, chat_id=chat_id, data={'user_id': user_id, 'nome_categoria': titulo, 'sinal': '-', 'valor_str': str(valor), 'titulo': titulo})
-    print(f"Carregados {len(agendamentos)} agendamentos de contas.")
-    conn.close()
+async def lembrete_diario(context: ContextTypes.DEFAULT_TYPE, tarefa):
+    envio.enviar(tarefa.chat_id, random.choice(["Olá! 👋 Lembre-se de registar seus gastos hoje.", "Ei, como foram as finanças hoje? ✍️"]), espalhar=envio.JANELA_LEMBRETES)
 
-async def apagar_usuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def carregar_tarefas_agendadas(application: Application):
+    """Completa a agenda persistida e liga o job único que despacha as tarefas vencidas."""
+    agendador.registrar_executor(agendador.LEMBRETE, lembrete_diario)
+    agendador.registrar_executor(agendador.AGENDAMENTO, callback_agendamento)
+    agendador.registrar_executor(agendador.INSIGHT, enviar_insights_semanais)
+    criadas = await agendador.sincronizar()
+    logger.info(f"Agenda sincronizada; tarefas criadas: {criadas}.")
+    agendador.iniciar(application.job_queue)
+
+def usuario_admin(update: Update):
     admin_id = os.getenv("ADMIN_TELEGRAM_ID")
-    if not admin_id or str(update.effective_user.id) != admin_id:
+    return bool(admin_id) and str(update.effective_user.id) == admin_id
+
+async def apagar_usuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not usuario_admin(update):
         await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
         return
     try:
         target_telegram_id = int(context.args[0])
-        conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-        cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (target_telegram_id,)); user = cursor.fetchone()
-        if not user:
-            await update.effective_message.reply_text(f"Usuário com ID do Telegram {target_telegram_id} não encontrado."); conn.close()
+        if not await repositorio.apagar_usuario(target_telegram_id):
+            await update.effective_message.reply_text(f"Usuário com ID do Telegram {target_telegram_id} não encontrado.")
             return
-        id_interno = user[0]
-        cursor.execute("DELETE FROM transacoes WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM orcamentos WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM cartoes WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM categorias WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM lembretes_diarios WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM agendamentos WHERE id_usuario = ?", (id_interno,))
-        cursor.execute("DELETE FROM usuarios WHERE id = ?", (id_interno,)); conn.commit(); conn.close()
         await update.effective_message.reply_text(f"Todos os dados do usuário com ID {target_telegram_id} foram apagados com sucesso.")
     except (IndexError, ValueError):
         await update.effective_message.reply_text("Uso: /apagarusuario <ID do Telegram do usuário>")
 
-async def enviar_insight_semanal(context: ContextTypes.DEFAULT_TYPE):
-    """Calcula e envia o insight da semana para um usuário específico."""
-    job_data = context.job.data
-    user_id = job_data["user_id"]
-    chat_id = job_data["chat_id"]
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # ### VERIFICAÇÃO PREMIUM ###
-    # Verifica se o usuário ainda tem uma assinatura ativa antes de enviar o insight
-    cursor.execute("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id,))
-    assinatura = cursor.fetchone()
-    if not (assinatura and datetime.strptime(assinatura[0], '%Y-%m-%d') >= datetime.now()):
-        conn.close()
-        logger.info(f"Usuário {user_id} não é mais premium. Insight semanal não enviado.")
-        return # Para a execução se o usuário não for premium
-    # ### FIM DA VERIFICAÇÃO ###
-    
-    # Calcula a data de 7 dias atrás
-    sete_dias_atras = (datetime.now(timezone.utc) - timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Query para encontrar a categoria com maior gasto na última semana
-    cursor.execute("""
-        SELECT c.nome, SUM(t.valor) as total_gasto
-        FROM transacoes t
-        JOIN categorias c ON t.id_categoria = c.id
-        WHERE t.id_usuario = ? AND t.tipo = 'saida' AND t.data_transacao >= ?
-        GROUP BY c.nome
-        ORDER BY total_gasto DESC
-        LIMIT 1
-    """, (user_id, sete_dias_atras))
-    
-    maior_gasto = cursor.fetchone()
-    conn.close()
-    
-    if maior_gasto:
-        nome_categoria, total_gasto = maior_gasto
-        mensagem = (
-            f"💡 *Seu Insight da Semana Premium!*\n\n"
-            f"Nos últimos 7 dias, sua maior categoria de gastos foi *{nome_categoria.capitalize()}*, "
-            f"totalizando *R$ {total_gasto:.2f}*.\n\n"
-            f"Continue registrando para mais insights! 😉"
-        )
-        await context.bot.send_message(chat_id=chat_id, text=mensagem, parse_mode='Markdown')
-        
-def agendar_insights_semanais(application: Application):
-    conn = sqlite3.connect(DB_PATH); cursor = conn.cursor()
-    cursor.execute("SELECT id, chat_id FROM usuarios WHERE chat_id IS NOT NULL"); usuarios = cursor.fetchall(); conn.close()
-    fuso_horario = pytz.timezone('America/Sao_Paulo'); horario_envio = time(10, 0, tzinfo=fuso_horario)
-    for user_id, chat_id in usuarios:
-        job_name = f"insight_semanal_{user_id}"
-        for job in application.job_queue.get_jobs_by_name(job_name):
-            job.schedule_removal()
-        application.job_queue.run_daily(enviar_insight_semanal, time=horario_envio, days=(0,), chat_id=chat_id, name=job_name, data={"user_id": user_id, "chat_id": chat_id})
-    print(f"Agendados insights semanais para {len(usuarios)} usuários.")
-
-async def callback_agendamento(context: ContextTypes.DEFAULT_TYPE):
-    job_data = context.job.data
-    user_id = job_data.get('user_id'); nome_categoria = job_data.get('nome_categoria'); sinal = job_data.get('sinal'); valor_str = job_data.get('valor_str')
-    await registrar_transacao_final(update=None, context=context, user_id=user_id, nome_categoria=nome_categoria, sinal=sinal, valor_str=valor_str, is_scheduled=True)
+async def reconstruir_resumo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Recalcula os agregados mensais (de um usuário ou de todos) e informa quantos divergiam."""
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    try:
+        user_id = None
+        if context.args:
+            target_telegram_id = int(context.args[0])
+            user_id = await get_user_id(target_telegram_id)
+            if not user_id:
+                await update.effective_message.reply_text(f"Usuário com ID do Telegram {target_telegram_id} não encontrado.")
+                return
+        divergencias = await repositorio.reconstruir_resumo(user_id)
+        alvo = f"do usuário {context.args[0]}" if user_id else "de todos os usuários"
+        await update.effective_message.reply_text(f"Resumo mensal {alvo} reconstruído. {divergencias} agregado(s) estavam divergentes.")
+    except ValueError:
+        await update.effective_message.reply_text("Uso: /reconstruir_resumo [ID do Telegram do usuário]")
+
+async def arquivar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Move os meses fechados de transacoes para o arquivo, mantendo os N meses mais recentes."""
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    try: meses_ativos = int(context.args[0]) if context.args else arquivamento.MESES_ATIVOS
+    except ValueError: await update.effective_message.reply_text("Uso: /arquivar [meses mantidos, contando o atual (mínimo 2)]"); return
+    await update.effective_message.reply_text("Arquivando...")
+    resultado = await arquivamento.arquivar(meses_ativos)
+    await update.effective_message.reply_text(f"{resultado.movidas} lançamento(s) de {resultado.usuarios} usuário(s) arquivados. Em transacoes ficam os lançamentos a partir de {unidades.momento_utc(resultado.limite):%d/%m/%Y} (UTC).")
+
+async def perfilar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Liga o perfilador por amostragem por N segundos; o resultado chega como resumo e arquivo."""
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    try: segundos = int(context.args[0]) if context.args else perfilador.DURACAO
+    except ValueError: await update.effective_message.reply_text(f"Uso: /perfilar [segundos, até {perfilador.DURACAO_MAX}]"); return
+    perfil = perfilador.iniciar()
+    if perfil is None: await update.effective_message.reply_text("Já há um perfil em andamento. Use /parar_perfil para encerrá-lo."); return
+    await update.effective_message.reply_text(f"Perfilando por {min(segundos, perfilador.DURACAO_MAX)}s. Use /parar_perfil para encerrar antes.")
+    context.application.create_task(entregar_perfil(context.bot, update.effective_chat.id, perfil, segundos), name="perfilador")
+
+async def entregar_perfil(bot, chat_id, perfil, segundos):
+    resultado = await perfilador.perfilar(perfil, segundos)
+    await bot.send_message(chat_id=chat_id, text=resultado.resumo())
+    if resultado.amostras:
+        arquivo = io.BytesIO(resultado.colapsadas().encode('utf-8'))
+        await bot.send_document(chat_id=chat_id, document=arquivo, filename=f"perfil_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}.collapsed.txt",
+                                caption="Pilhas colapsadas: abra no speedscope.app ou gere o SVG com flamegraph.pl.")
+
+async def parar_perfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    if not perfilador.parar(): await update.effective_message.reply_text("Nenhum perfil em andamento."); return
+    await update.effective_message.reply_text("Encerrando o perfil; o resultado chega em seguida.")
+
+async def estatisticas_cache(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    linhas = ["*Cache em memória:*"]
+    for nome, est in {**repositorio.estatisticas_cache(), 'categorias': categorias_match.estatisticas_cache(), 'graficos': graficos.estatisticas_cache()}.items():
+        linhas.append(f"- {nome}: {est['itens']} itens, {est['acertos']} acertos, {est['falhas']} falhas ({est['taxa_acerto'] * 100:.1f}%), {est['invalidacoes']} invalidações")
+    await update.effective_message.reply_text("\n".join(linhas), parse_mode='Markdown')
+
+async def estatisticas_envio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not usuario_admin(update):
+        await update.effective_message.reply_text("Você não tem permissão para usar este comando.")
+        return
+    est = envio.estatisticas()
+    if not est: await update.effective_message.reply_text("Fila de envio ainda não iniciada."); return
+    linhas = ["*Fila de envio:*", f"- Na fila: {est['fila']} (enviando: {est['em_envio']})", f"- Enviadas: {est['enviados']}, descartadas: {est['falhas']}",
+              f"- RetryAfter: {est['retry_after']}, retentativas: {est['retentativas']}",
+              f"- Latência (fila→envio): p50 {est['latencia_p50']:.2f}s, p95 {est['latencia_p95']:.2f}s, máx {est['latencia_max']:.2f}s"]
+    processador = context.application.update_processor
+    if isinstance(processador, processamento.ProcessadorPorUsuario):
+        est = processador.estatisticas()
+        linhas += ["*Updates:*", f"- Em andamento: {est['em_andamento']}/{processador.max_concurrent_updates}, usuários ativos: {est['usuarios_ativos']}, aguardando a vez: {est['aguardando']}"]
+    await update.effective_message.reply_text("\n".join(linhas), parse_mode='Markdown')
+
+async def enviar_insights_semanais(context: ContextTypes.DEFAULT_TYPE, tarefa):
+    """Calcula numa só consulta os insights de todos os premium e entrega à fila de envio."""
+    calculados = await insights.calcular_semanais()
+    for insight in calculados:
+        envio.enviar(insight.chat_id, insights.formatar(insight), espalhar=envio.JANELA_INSIGHTS, parse_mode='Markdown')
+    logger.info(f"Insights semanais enfileirados para {len(calculados)} usuários.")
+
+async def callback_agendamento(context: ContextTypes.DEFAULT_TYPE, tarefa):
+    titulo, valor = tarefa.dados
+    if valor is None:
+        envio.enviar(tarefa.chat_id, f"🗓️ Lembrete: Hora de pagar *{titulo.capitalize()}*.", parse_mode='Markdown'); return
+    await registrar_transacao_final(update=None, context=context, user_id=tarefa.id_usuario, nome_categoria=titulo, sinal='-', valor_str=str(valor), is_scheduled=True, chat_id=tarefa.chat_id)
 
 async def handle_premium_upsell(update: Update, context: ContextTypes.DEFAULT_TYPE, feature_name: str):
     """
@@ -926,17 +853,68 @@ async def manage_categories_callback(update: Update, context: ContextTypes.DEFAU
     await query.message.reply_text("Aqui estão suas categorias atuais. Você pode usar /del_categoria para remover alguma.")
     await list_categorias(update, context) # Reutiliza sua função existente
 
-def main():
-    inicializar_db()
-    TOKEN = os.getenv("TELEGRAM_TOKEN")
-    if not TOKEN:
-        logger.error("ERRO: A variável de ambiente TELEGRAM_TOKEN não foi definida.")
+def preaquecer_dependencias():
+    """Carrega em segundo plano as dependências pesadas adiadas no import do bot."""
+    try:
+        graficos.preaquecer()
+        import rapidfuzz.process  # noqa: F401
+        logger.info("Dependências pesadas pré-carregadas.")
+    except Exception:
+        logger.exception("Falha ao pré-carregar dependências.")
+
+def perfil_inicializacao(top=25):
+    """Imprime o tempo de import do bot e das dependências carregadas sob demanda (python -X importtime)."""
+    def medir(codigo):
+        saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stderr
+        modulos = []
+        for linha in saida.splitlines():
+            if not linha.startswith('import time:') or 'self [us]' in linha: continue
+            proprio, cumulativo, nome = linha[len('import time:'):].split('|')
+            nome = nome.rstrip()[1:]  # a indentação restante indica o nível de aninhamento
+            modulos.append((int(cumulativo), int(proprio), nome))
+        return modulos
+    for titulo, codigo in [("Import do bot (gastos.py)", "import gastos"), ("Carregadas sob demanda", "import matplotlib.figure, matplotlib.backends.backend_agg, rapidfuzz.process")]:
+        modulos = medir(codigo)
+        raizes = [m for m in modulos if not m[2].startswith(' ')]
+        total_ms = sum(m[0] for m in raizes) / 1000
+        print(f"\n== {titulo}: {total_ms:.1f} ms ==")
+        print(f"{'cumulativo (ms)':>16} {'próprio (ms)':>13}  módulo")
+        for cumulativo, proprio, nome in sorted(modulos, reverse=True)[:top]:
+            print(f"{cumulativo / 1000:16.1f} {proprio / 1000:13.1f}  {nome.strip()}")
+
+async def pos_inicializacao(application: Application):
+    """Roda dentro do event loop, antes do polling começar."""
+    threading.Thread(target=preaquecer_dependencias, name="preaquecimento", daemon=True).start()
+    envio.configurar(application.bot)
+    await carregar_tarefas_agendadas(application)
+    if metricas.PORTA: metricas.iniciar(application)
+
+async def pos_encerramento(application: Application):
+    metricas.encerrar()
+    diario.fechar()
+    graficos.encerrar()
+    await envio.encerrar()
+    await banco.encerrar()
+
+def iniciar_webhook(application: Application):
+    """Recebe os updates por webhook (servidor HTTP do python-telegram-bot) em vez de long polling.
+
+    O Telegram envia o segredo no cabeçalho X-Telegram-Bot-Api-Secret-Token;
+    requisições sem ele ou com valor errado recebem 403.
+    """
+    segredo = os.getenv("WEBHOOK_SEGREDO")
+    url_publica = os.getenv("WEBHOOK_URL")  # endereço público (proxy reverso), sem o caminho
+    if not segredo or not url_publica:
+        logger.error("ERRO: o modo webhook exige WEBHOOK_SEGREDO e WEBHOOK_URL.")
         return
-    application = Application.builder().token(TOKEN).build()
-    
-    carregar_tarefas_agendadas(application)
-    agendar_insights_semanais(application)
-
+    caminho = os.getenv("WEBHOOK_CAMINHO", "telegram").strip('/')
+    host = os.getenv("WEBHOOK_HOST", "0.0.0.0"); porta = int(os.getenv("WEBHOOK_PORTA", "8080"))
+    logger.info(f"Webhook ouvindo em {host}:{porta}/{caminho}, publicado em {url_publica.rstrip('/')}/{caminho}.")
+    application.run_webhook(listen=host, port=porta, url_path=caminho, secret_token=segredo, webhook_url=f"{url_publica.rstrip('/')}/{caminho}",
+                            max_connections=int(os.getenv("WEBHOOK_MAX_CONEXOES", "40")), allowed_updates=Update.ALL_TYPES)
+
+def registrar_handlers(application: Application):
+    """Conversas, comandos e botões do bot. Também usada pelo replay de diários (ferramentas/replay.py)."""
     onboarding_conv = ConversationHandler(
     entry_points=[CommandHandler("start", start)],
     states={
@@ -957,6 +935,8 @@ def main():
         ],
     },
     fallbacks=[CommandHandler('start', start)],
+    name="onboarding",
+    persistent=True,
 )
     
     transacao_conv = ConversationHandler(
@@ -966,6 +946,8 @@ def main():
             AGUARDANDO_SUGESTAO_CATEGORIA: [CallbackQueryHandler(tratar_sugestao_categoria, pattern="^sugestao_")],
         },
         fallbacks=[CommandHandler('cancelar', cancelar_conversa)],
+        name="transacao",
+        persistent=True,
     )
 
     relatorio_conv = ConversationHandler(
@@ -979,15 +961,29 @@ def main():
             AGUARDANDO_DATA_FIM: [MessageHandler(filters.TEXT & ~filters.COMMAND, receber_data_fim)],
         },
         fallbacks=[CommandHandler('cancelar', cancelar_conversa)],
+        name="relatorio",
+        persistent=True,
+    )
+
+    importacao_conv = ConversationHandler(
+        entry_points=[CommandHandler('importar', iniciar_importacao)],
+        states={
+            AGUARDANDO_ARQUIVO_IMPORTACAO: [MessageHandler(filters.Document.ALL, receber_arquivo_importacao)],
+        },
+        fallbacks=[CommandHandler('cancelar', cancelar_conversa)],
+        name="importacao",
+        persistent=True,
     )
 
     application.add_handler(onboarding_conv)
     application.add_handler(transacao_conv)
     application.add_handler(relatorio_conv)
+    application.add_handler(importacao_conv)
 
 
 # ... no seu main()
     application.add_handler(CallbackQueryHandler(dismiss_upsell, pattern="^dismiss_upsell$"))
+    application.add_handler(CallbackQueryHandler(desfazer_lancamento, pattern="^undo:"))
     application.add_handler(CallbackQueryHandler(manage_categories_callback, pattern="^manage_categories$"))
 # Adicione também o handler para 'upgrade_premium'
     #application.add_handler(CallbackQueryHandler(funcao_de_assinar, pattern="^upgrade_premium$"))
@@ -996,7 +992,7 @@ def main():
     application.add_handler(CommandHandler("add_cartao", add_cartao))
     application.add_handler(CommandHandler("listarcategorias", list_categorias))
     application.add_handler(CommandHandler("del_categoria", del_categoria))
-    application.add_handler(CommandHandler("exportar", exportar_csv))
+    application.add_handler(CommandHandler("exportar", exportar))
     application.add_handler(CommandHandler("list_cartoes", list_cartoes))
     application.add_handler(CommandHandler("fatura", fatura))
     application.add_handler(CommandHandler("del_cartao", del_cartao))
@@ -1008,17 +1004,52 @@ def main():
     application.add_handler(CommandHandler("meus_orcamentos", list_orcamentos))
     application.add_handler(CommandHandler("del_orcamento", del_orcamento))
     application.add_handler(CommandHandler("apagarusuario", apagar_usuario))
+    application.add_handler(CommandHandler("reconstruir_resumo", reconstruir_resumo))
+    application.add_handler(CommandHandler("arquivar", arquivar))
+    application.add_handler(CommandHandler("estatisticas_cache", estatisticas_cache))
+    application.add_handler(CommandHandler("estatisticas_envio", estatisticas_envio))
+    application.add_handler(CommandHandler("perfilar", perfilar))
+    application.add_handler(CommandHandler("parar_perfil", parar_perfil))
     # Botões do menu que não são entry points
     application.add_handler(MessageHandler(filters.Regex('^🗂️ Categorias$'), list_categorias))
     application.add_handler(MessageHandler(filters.Regex('^💳 Cartões$'), menu_cartoes))
     
     application.add_handler(MessageHandler(filters.Regex('^💡 Ajuda$'), ajuda))
     application.add_handler(MessageHandler(filters.Regex('^⏰ Lembretes/Agendamentos$'), menu_lembretes_e_agendamentos))
-    application.add_handler(MessageHandler(filters.Regex('^⬇️ Exportar$'), exportar_csv))
+    application.add_handler(MessageHandler(filters.Regex('^⬇️ Exportar$'), exportar))
     application.add_handler(MessageHandler(filters.Regex('^🏠 Menu Principal$'), start))
 
+def main():
+    if '--profile-startup' in sys.argv:
+        perfil_inicializacao()
+        return
+    inicializar_db()
+    TOKEN = os.getenv("TELEGRAM_TOKEN")
+    if not TOKEN:
+        logger.error("ERRO: A variável de ambiente TELEGRAM_TOKEN não foi definida.")
+        return
+    # Com métricas ligadas, cada comando SQL é cronometrado (ver metricas.ConexaoMedida).
+    banco.configurar(DB_PATH, leitores=int(os.getenv("DB_LEITORES", "4")), fabrica=metricas.ConexaoMedida if metricas.PORTA else None)
+    # Fila limitada faz o webhook segurar a resposta ao Telegram quando os handlers ficam para trás.
+    construtor = Application.builder().token(TOKEN).post_init(pos_inicializacao).post_shutdown(pos_encerramento)
+    # Outro servidor da Bot API: um local, ou o falso de ferramentas/bot_api_falsa.py nos testes de carga.
+    if os.getenv("TELEGRAM_BASE_URL"): construtor = construtor.base_url(os.getenv("TELEGRAM_BASE_URL"))
+    if os.getenv("TELEGRAM_BASE_FILE_URL"): construtor = construtor.base_file_url(os.getenv("TELEGRAM_BASE_FILE_URL"))
+    construtor = construtor.update_queue(asyncio.Queue(maxsize=int(os.getenv("BOT_FILA_UPDATES_MAX", "0"))))
+    # Usuários diferentes em paralelo; os updates de cada usuário continuam em ordem (ver processamento.py).
+    construtor = construtor.concurrent_updates(processamento.ProcessadorPorUsuario(int(os.getenv("BOT_UPDATES_SIMULTANEOS", "16"))))
+    # Conversas e user_data pendentes sobrevivem a deploys (ver persistencia.py).
+    construtor = construtor.persistence(persistencia.configurar())
+    application = construtor.build()
+    application.persistence.vincular(application)
+
+    registrar_handlers(application)
+    # Grupo -1: o update entra no diário antes de qualquer handler (ver diario.py).
+    if diario.ativo(): application.add_handler(TypeHandler(Update, diario.registrar_update), group=-1)
+
     logger.info("Bot v23 (Paywall Completo) iniciado!")
-    application.run_polling()
+    if os.getenv("BOT_MODO", "polling") == "webhook": iniciar_webhook(application)
+    else: application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""Renderização dos gráficos de relatório fora do event loop.
+
+Os PNGs são gerados num pool de processos com a API orientada a objetos do
+matplotlib (Figure + FigureCanvasAgg), sem o estado global do pyplot. Gráficos
+idênticos são servidos de um cache endereçado pelo conteúdo.
+
+GRAFICOS_FILA_MAX limita os gráficos no pool, não só os aguardados: um gráfico
+que estoura GRAFICOS_TIMEOUT continua ocupando a vaga até o processo filho
+terminar de renderizá-lo.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import AUSENTE, CacheTTL
+
+logger = logging.getLogger(__name__)
+
+PROCESSOS = int(os.getenv("GRAFICOS_PROCESSOS", "2"))
+FILA_MAX = int(os.getenv("GRAFICOS_FILA_MAX", "8"))
+TIMEOUT = float(os.getenv("GRAFICOS_TIMEOUT", "10"))
+
+_cache_png = CacheTTL(tamanho_max=int(os.getenv("GRAFICOS_CACHE_MAX", "256")), ttl=float(os.getenv("GRAFICOS_CACHE_TTL", "3600")))
+_executor = None
+_em_andamento = 0  # renderizações no pool (na fila ou rodando)
+_lock_em_andamento = threading.Lock()
+
+
+def _renderizar_pizza(gastos_por_categoria):
+    """Roda no processo filho; devolve os bytes do PNG."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.patches import Circle
+
+    labels = [item[0].capitalize() for item in gastos_por_categoria]; sizes = [item[1] for item in gastos_por_categoria]
+    fig = Figure(figsize=(8, 6)); FigureCanvasAgg(fig); ax = fig.add_subplot()
+    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=140, pctdistance=0.85)
+    ax.add_artist(Circle((0, 0), 0.70, fc='white')); ax.axis('equal')
+    ax.set_title('Distribuição de Gastos do Período', pad=20)
+    buf = io.BytesIO(); fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+
+def _importar_matplotlib():
+    import matplotlib.figure  # noqa: F401
+    import matplotlib.backends.backend_agg  # noqa: F401
+
+
+def preaquecer():
+    """Sobe os processos do pool e importa o matplotlib neles antes do primeiro relatório."""
+    executor = _obter_executor()
+    for _ in range(PROCESSOS):
+        executor.submit(_importar_matplotlib)
+
+
+def _chave(gastos_por_categoria, periodo):
+    conteudo = repr((tuple((nome, round(total, 2)) for nome, total in gastos_por_categoria), periodo))
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+
+def _obter_executor():
+    global _executor
+    if _executor is None:
+        # 'spawn' evita herdar as threads do pool SQLite e do event loop no fork.
+        _executor = ProcessPoolExecutor(max_workers=PROCESSOS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _liberar_vaga(_futuro):
+    """Done-callback do futuro no pool: roda quando o filho termina, mesmo que ninguém espere mais."""
+    global _em_andamento
+    with _lock_em_andamento:
+        _em_andamento -= 1
+
+
+async def gerar_grafico_pizza(gastos_por_categoria, periodo):
+    """Devolve um BytesIO com o PNG, ou None se não houver dados ou o pool estiver saturado."""
+    global _em_andamento
+    if not gastos_por_categoria: return None
+    chave = _chave(gastos_por_categoria, periodo)
+    png = _cache_png.obter(chave)
+    if png is AUSENTE:
+        with _lock_em_andamento:
+            if _em_andamento >= FILA_MAX:
+                logger.warning(f"Fila de gráficos cheia ({_em_andamento}); relatório enviado sem gráfico.")
+                return None
+            _em_andamento += 1
+        try:
+            futuro = _obter_executor().submit(_renderizar_pizza, list(gastos_por_categoria))
+        except Exception:
+            _liberar_vaga(None)
+            logger.exception("Falha ao enviar gráfico ao pool.")
+            return None
+        futuro.add_done_callback(_liberar_vaga)
+        try:
+            png = await asyncio.wait_for(asyncio.wrap_future(futuro), TIMEOUT)
+        except BrokenProcessPool:
+            logger.exception("Pool de gráficos quebrado; será recriado na próxima chamada.")
+            encerrar()
+            return None
+        except Exception:
+            logger.exception("Falha ao renderizar gráfico de pizza.")
+            return None
+        _cache_png.definir(chave, png)
+    return io.BytesIO(png)
+
+
+def profundidade_fila():
+    return _em_andamento
+
+
+def estatisticas_cache():
+    return _cache_png.estatisticas()
+
+
+def encerrar():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,357 @@
+"""Importação de extratos bancários (CSV ou OFX) para transacoes.
+
+O arquivo é lido em fluxo, em lotes de IMPORTACAO_LOTE linhas: cada lote é
+interpretado numa thread, tem as descrições classificadas de uma vez pelo
+categorias_match e é gravado numa única unidade de escrita com executemany,
+já ajustando resumo_mensal.
+
+Duplicatas são descartadas de dois jeitos: pelo id_externo (FITID do OFX ou
+hash da linha do CSV), que torna reimportar o mesmo arquivo inofensivo, e por
+dia/tipo/valor contra lançamentos já existentes (digitados no chat ou vindos
+de outro arquivo), cada um absorvendo no máximo uma linha importada.
+
+Datas sem horário entram ao meio-dia de São Paulo; valores negativos são
+saídas, a não ser que o CSV tenha uma coluna de tipo (como o do /exportar).
+"""
+import asyncio
+import codecs
+import csv
+import hashlib
+import io
+import itertools
+import os
+import re
+import unicodedata
+from collections import Counter, namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+import pytz
+
+import arquivamento
+import banco
+import categorias_match
+import repositorio
+import unidades
+
+FUSO = pytz.timezone('America/Sao_Paulo')
+LOTE = int(os.getenv("IMPORTACAO_LOTE", "500"))
+TAMANHO_MAX = 20 * 1024 * 1024  # limite de download de arquivos da Bot API
+EXTENSOES = ('.csv', '.ofx', '.qfx', '.txt')
+
+# `data` é date (dia local) ou datetime (UTC, quando o arquivo traz horário); `valor` em centavos.
+LinhaExtrato = namedtuple('LinhaExtrato', 'data tipo valor descricao categoria id_externo')
+
+# {tabela}: transacoes, ou transacoes_completas se o lote tem datas já arquivadas.
+SQL_IDS_EXTERNOS = "SELECT id_externo FROM {tabela} WHERE id_usuario = ? AND id_externo IN ({marcadores})"
+SQL_EXISTENTES_PERIODO = "SELECT data_epoch, tipo, valor_centavos FROM {tabela} WHERE id_usuario = ? AND data_epoch BETWEEN ? AND ?"
+
+CONSULTAS_QUENTES = {
+    'ids_externos': (SQL_IDS_EXTERNOS.format(tabela='transacoes', marcadores='?, ?'), (1, 'ofx:a', 'ofx:b')),
+    'ids_externos_arquivo': (SQL_IDS_EXTERNOS.format(tabela='transacoes_completas', marcadores='?, ?'), (1, 'ofx:a', 'ofx:b')),
+    'existentes_periodo': (SQL_EXISTENTES_PERIODO.format(tabela='transacoes'), (1, 946684800, 949363199)),
+    'existentes_periodo_arquivo': (SQL_EXISTENTES_PERIODO.format(tabela='transacoes_completas'), (1, 946684800, 949363199)),
+}
+
+# Nome normalizado do cabeçalho -> campo.
+COLUNAS_CSV = {
+    'data': 'data', 'date': 'data', 'data (utc)': 'data', 'data lancamento': 'data', 'data movimento': 'data', 'dt': 'data',
+    'descricao': 'descricao', 'historico': 'descricao', 'description': 'descricao', 'memo': 'descricao', 'title': 'descricao',
+    'titulo': 'descricao', 'lancamento': 'descricao', 'estabelecimento': 'descricao',
+    'valor': 'valor', 'amount': 'valor', 'value': 'valor', 'valor (r$)': 'valor', 'quantia': 'valor',
+    'tipo': 'tipo',
+    'categoria': 'categoria', 'category': 'categoria',
+}
+FORMATOS_DATA = ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%Y', '%d.%m.%Y')
+
+
+class ArquivoInvalido(Exception):
+    """O arquivo não é um CSV/OFX que dê para interpretar."""
+
+
+@dataclass
+class ResumoImportacao:
+    formato: str
+    lidas: int = 0
+    importadas: int = 0
+    duplicadas: int = 0
+    invalidas: int = 0
+    sem_categoria: int = 0
+    entradas_centavos: int = 0
+    saidas_centavos: int = 0
+    primeira_data: date = None
+    ultima_data: date = None
+
+    @property
+    def entradas(self):
+        return unidades.reais(self.entradas_centavos)
+
+    @property
+    def saidas(self):
+        return unidades.reais(self.saidas_centavos)
+
+    def registrar_periodo(self, dia):
+        if self.primeira_data is None or dia < self.primeira_data:
+            self.primeira_data = dia
+        if self.ultima_data is None or dia > self.ultima_data:
+            self.ultima_data = dia
+
+
+# --- Interpretação ---
+def _sem_acento(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto.strip().lower()) if not unicodedata.combining(c))
+
+
+def interpretar_valor(texto):
+    """'R$ -1.234,56', '1234.56', '(50,00)' e '50,00 D' viram float com sinal."""
+    texto = texto.strip().upper().replace('R$', '').replace(' ', '')
+    negativo = texto.startswith('(') and texto.endswith(')')
+    texto = texto.strip('()')
+    if texto.endswith(('D', 'C')):
+        negativo, texto = negativo or texto.endswith('D'), texto[:-1]
+    virgula, ponto = texto.rfind(','), texto.rfind('.')
+    if virgula > ponto:
+        texto = texto.replace('.', '').replace(',', '.')
+    elif ponto > virgula and virgula >= 0:
+        texto = texto.replace(',', '')
+    elif texto.count('.') > 1 or (ponto >= 0 and len(texto) - ponto - 1 == 3):
+        texto = texto.replace('.', '')  # '1.234' é milhar, não decimal
+    valor = float(texto)
+    return -abs(valor) if negativo else valor
+
+
+def interpretar_data(texto):
+    texto = texto.strip()
+    if len(texto) >= 19 and texto[4] == '-':
+        return datetime.strptime(texto[:19], '%Y-%m-%d %H:%M:%S')
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto[:10].strip(), formato).date()
+        except ValueError:
+            continue
+    raise ValueError(texto)
+
+
+def _decodificar(arquivo):
+    """Envolve o arquivo binário num leitor de texto, em UTF-8 ou, se não for, Windows-1252."""
+    amostra = arquivo.read(64 * 1024)
+    arquivo.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'cp1252'
+    return io.TextIOWrapper(arquivo, encoding=codificacao, errors='replace', newline=''), amostra
+
+
+def _id_csv(ocorrencias, data, valor, descricao):
+    # Linhas idênticas no mesmo arquivo (dois cafés no mesmo dia) ganham ids diferentes pela ordem.
+    chave = (str(data), f"{valor:.2f}", descricao)
+    ocorrencias[chave] += 1
+    return 'csv:' + hashlib.sha1('|'.join((*chave, str(ocorrencias[chave]))).encode('utf-8')).hexdigest()[:20]
+
+
+def ler_csv(texto, amostra, resumo):
+    try:
+        dialeto = csv.Sniffer().sniff(amostra.decode('latin-1').split('\n', 1)[0], delimiters=';,\t|')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.reader(texto, dialeto)
+    campos = {}
+    for cabecalho in leitor:
+        campos = {COLUNAS_CSV[nome]: posicao for posicao, nome in enumerate(map(_sem_acento, cabecalho)) if nome in COLUNAS_CSV}
+        if {'data', 'valor'} <= campos.keys():
+            break
+    else:
+        raise ArquivoInvalido("Não encontrei as colunas de data e valor no CSV.")
+    ocorrencias = Counter()
+    for linha in leitor:
+        if not any(celula.strip() for celula in linha):
+            continue
+        resumo.lidas += 1
+        try:
+            data = interpretar_data(linha[campos['data']])
+            valor = interpretar_valor(linha[campos['valor']])
+        except (ValueError, IndexError):
+            resumo.invalidas += 1
+            continue
+        tipo_coluna = _sem_acento(linha[campos['tipo']]) if 'tipo' in campos and campos['tipo'] < len(linha) else ''
+        tipo = tipo_coluna if tipo_coluna in ('entrada', 'saida') else ('saida' if valor < 0 else 'entrada')
+        descricao = linha[campos['descricao']].strip() if 'descricao' in campos and campos['descricao'] < len(linha) else ''
+        categoria = linha[campos['categoria']].strip() if 'categoria' in campos and campos['categoria'] < len(linha) else ''
+        yield LinhaExtrato(data, tipo, unidades.centavos(abs(valor)), descricao, categoria or None, _id_csv(ocorrencias, data, valor, descricao or categoria))
+
+
+_TAG_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+def ler_ofx(texto, resumo):
+    """Percorre as tags do OFX (SGML 1.x ou XML 2.x) sem montar a árvore."""
+    conta, transacao = '', None
+    for linha in texto:
+        for fechamento, tag, valor in _TAG_OFX.findall(linha):
+            tag, valor = tag.upper(), valor.strip()
+            if tag == 'ACCTID' and not fechamento:
+                conta = valor
+            elif tag == 'STMTTRN':
+                if not fechamento:
+                    transacao = {}
+                    continue
+                if transacao is None:
+                    continue
+                resumo.lidas += 1
+                try:
+                    data = datetime.strptime(transacao['DTPOSTED'][:8], '%Y%m%d').date()
+                    valor_transacao = float(transacao['TRNAMT'].replace(',', '.'))
+                except (KeyError, ValueError):
+                    resumo.invalidas += 1
+                else:
+                    descricao = transacao.get('MEMO') or transacao.get('NAME') or ''
+                    fitid = transacao.get('FITID') or hashlib.sha1(f"{data}|{valor_transacao}|{descricao}".encode('utf-8')).hexdigest()[:20]
+                    yield LinhaExtrato(data, 'saida' if valor_transacao < 0 else 'entrada', unidades.centavos(abs(valor_transacao)), descricao, None, f"ofx:{conta}:{fitid}")
+                transacao = None
+            elif transacao is not None and not fechamento and valor:
+                transacao[tag] = valor
+
+
+def ler_extrato(arquivo, nome_arquivo, resumo):
+    """Gera as LinhaExtrato do arquivo binário (posicionado no início)."""
+    texto, amostra = _decodificar(arquivo)
+    if nome_arquivo.lower().endswith(('.ofx', '.qfx')) or b'<OFX>' in amostra.upper():
+        resumo.formato = 'OFX'
+        return ler_ofx(texto, resumo)
+    resumo.formato = 'CSV'
+    return ler_csv(texto, amostra, resumo)
+
+
+# --- Gravação ---
+# Extratos repetem poucas datas; as conversões de fuso ficam em cache.
+@lru_cache(maxsize=4096)
+def _data_epoch(data):
+    if isinstance(data, datetime):
+        return unidades.epoch(data)
+    return unidades.epoch(FUSO.localize(datetime.combine(data, time(12))))
+
+
+@lru_cache(maxsize=4096)
+def _dia_local(data_epoch):
+    return unidades.momento_utc(data_epoch).astimezone(FUSO).date()
+
+
+class _Deduplicador:
+    """Conta os lançamentos já existentes por (dia local, tipo, centavos), carregando os dias sob demanda.
+
+    O que um lote carrega e consome fica à parte até `confirmar`, chamado depois
+    do commit: se a unidade de escrita for desfeita, o próximo lote parte do
+    estado anterior a ela.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.existentes = Counter()
+        self.dias_carregados = set()
+        self.iniciar_lote()
+
+    def iniciar_lote(self):
+        self._carregados, self._consumidos, self._dias = Counter(), Counter(), set()
+
+    def confirmar(self):
+        self.existentes.update(self._carregados)
+        self.existentes.subtract(self._consumidos)
+        self.dias_carregados |= self._dias
+        self.iniciar_lote()
+
+    def carregar(self, conn, dias):
+        conhecidos = self.dias_carregados | self._dias
+        novos = sorted(set(dias) - conhecidos)
+        if not novos:
+            return
+        inicio = unidades.epoch(FUSO.localize(datetime.combine(novos[0], time.min)))
+        fim = unidades.epoch(FUSO.localize(datetime.combine(novos[-1] + timedelta(days=1), time.min))) - 1
+        sql = SQL_EXISTENTES_PERIODO.format(tabela=arquivamento.tabela_transacoes(conn, inicio))
+        for data_epoch, tipo, valor_centavos in conn.execute(sql, (self.user_id, inicio, fim)):
+            dia = _dia_local(data_epoch)
+            if dia not in conhecidos:
+                self._carregados[(dia, tipo, valor_centavos)] += 1
+        self._dias.update(novos[0] + timedelta(days=n) for n in range((novos[-1] - novos[0]).days + 1))
+
+    def consumir(self, dia, tipo, valor_centavos):
+        chave = (dia, tipo, valor_centavos)
+        if self.existentes[chave] + self._carregados[chave] - self._consumidos[chave] > 0:
+            self._consumidos[chave] += 1
+            return True
+        return False
+
+
+def _gravar_lote(conn, user_id, id_cartao, linhas, ids_categoria, deduplicador):
+    """Insere as linhas que não são duplicatas e devolve as inseridas."""
+    epochs = [_data_epoch(linha.data) for linha in linhas]
+    sql = SQL_IDS_EXTERNOS.format(tabela=arquivamento.tabela_transacoes(conn, min(epochs)), marcadores=', '.join('?' * len(linhas)))
+    ja_importados = {id_externo for id_externo, in conn.execute(sql, (user_id, *(linha.id_externo for linha in linhas)))}
+    deduplicador.iniciar_lote()
+    # Mesmo dia local que `consumir` consulta: linhas com horário vêm em UTC.
+    deduplicador.carregar(conn, [_dia_local(data_epoch) for data_epoch in epochs])
+    novas = []
+    for linha, id_categoria, data_epoch in zip(linhas, ids_categoria, epochs):
+        dia = _dia_local(data_epoch)
+        # A linha já importada também consome o lançamento que ela gerou.
+        existente = deduplicador.consumir(dia, linha.tipo, linha.valor)
+        if linha.id_externo in ja_importados or existente:
+            continue
+        ja_importados.add(linha.id_externo)
+        cartao = id_cartao if linha.tipo == 'saida' else None
+        novas.append((user_id, id_categoria, linha.valor, linha.tipo, data_epoch, cartao, linha.id_externo))
+    # valor e data_transacao continuam sendo gravados para leitores antigos.
+    conn.executemany("""
+        INSERT INTO transacoes (id_usuario, id_categoria, valor_centavos, tipo, data_epoch, id_cartao, id_externo, valor, data_transacao)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ? / 100.0, datetime(?, 'unixepoch'))
+    """, [(*nova, nova[2], nova[4]) for nova in novas])
+    return novas
+
+
+def _agrupar_resumo(novas):
+    """(mes, tipo, categoria, cartão) -> (centavos, quantidade) dos lançamentos inseridos."""
+    grupos = {}
+    for _, id_categoria, valor_centavos, tipo, data_epoch, id_cartao, _ in novas:
+        chave = (_mes_utc(data_epoch), tipo, id_categoria, id_cartao)
+        total, quantidade = grupos.get(chave, (0, 0))
+        grupos[chave] = (total + valor_centavos, quantidade + 1)
+    return grupos
+
+
+@lru_cache(maxsize=4096)
+def _mes_utc(data_epoch):
+    return unidades.momento_utc(data_epoch).strftime('%Y-%m')
+
+
+async def importar(user_id, arquivo, nome_arquivo, id_cartao=None):
+    """Importa o extrato em `arquivo` (binário, no início) e devolve um ResumoImportacao.
+
+    Levanta ArquivoInvalido se o formato não for reconhecido.
+    """
+    resumo = ResumoImportacao(formato='CSV')
+    linhas = await asyncio.to_thread(ler_extrato, arquivo, nome_arquivo, resumo)
+    ids_categorias = dict(await banco.buscar_todos("SELECT nome, id FROM categorias WHERE id_usuario = ?", (user_id,)))
+    deduplicador = _Deduplicador(user_id)
+    while lote := await asyncio.to_thread(lambda: list(itertools.islice(linhas, LOTE))):
+        classificadas = await categorias_match.classificar_descricoes(user_id, [linha.categoria or linha.descricao for linha in lote])
+        ids_categoria = [ids_categorias.get(classificadas[linha.categoria or linha.descricao]) for linha in lote]
+
+        def _gravar(conn, lote=lote, ids_categoria=ids_categoria):
+            novas = _gravar_lote(conn, user_id, id_cartao, lote, ids_categoria, deduplicador)
+            for (mes, tipo, id_categoria, cartao), (total, quantidade) in _agrupar_resumo(novas).items():
+                repositorio.ajustar_resumo(conn, user_id, mes, tipo, id_categoria, cartao, total, quantidade)
+            return novas
+        novas = await banco.escrever(_gravar)
+        deduplicador.confirmar()
+        resumo.duplicadas += len(lote) - len(novas)
+        for _, id_categoria, valor_centavos, tipo, data_epoch, _, _ in novas:
+            resumo.importadas += 1
+            resumo.sem_categoria += id_categoria is None
+            if tipo == 'entrada':
+                resumo.entradas_centavos += valor_centavos
+            else:
+                resumo.saidas_centavos += valor_centavos
+            resumo.registrar_periodo(_dia_local(data_epoch))
+    return resumo
@@ -0,0 +1,107 @@
+"""Insights semanais calculados em lote para todos os assinantes premium.
+
+Uma única consulta cobre as duas últimas semanas de todos os premium com chat:
+agrupa as saídas por usuário e categoria separando a semana atual da anterior,
+e funções de janela escolhem a maior categoria e somam os totais de cada um.
+Novos tipos de insight devem sair dessa mesma passada (ou de outra consulta em
+lote), nunca de uma consulta por usuário.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+
+import banco
+import relogio
+import repositorio
+import unidades
+
+SQL_INSIGHTS_SEMANAIS = """
+    WITH premium AS (
+        SELECT u.id, u.chat_id
+        FROM assinaturas a
+        JOIN usuarios u ON u.id = a.id_usuario
+        WHERE a.data_expiracao >= ? AND u.chat_id IS NOT NULL
+    ),
+    por_categoria AS (
+        -- CROSS JOIN fixa a ordem: para cada premium, uma busca por intervalo no índice (id_usuario, data_epoch).
+        SELECT t.id_usuario, t.id_categoria,
+               SUM(CASE WHEN t.data_epoch >= ? THEN t.valor_centavos ELSE 0 END) AS atual,
+               SUM(CASE WHEN t.data_epoch < ? THEN t.valor_centavos ELSE 0 END) AS anterior
+        FROM premium
+        CROSS JOIN transacoes t ON t.id_usuario = premium.id AND t.data_epoch >= ? AND t.data_epoch < ? AND t.tipo = 'saida'
+        GROUP BY t.id_usuario, t.id_categoria
+    ),
+    ranking AS (
+        SELECT id_usuario, id_categoria, atual, anterior,
+               ROW_NUMBER() OVER (PARTITION BY id_usuario ORDER BY atual DESC) AS posicao,
+               SUM(atual) OVER (PARTITION BY id_usuario) AS total_atual,
+               SUM(anterior) OVER (PARTITION BY id_usuario) AS total_anterior
+        FROM por_categoria
+    )
+    SELECT premium.id, premium.chat_id, c.nome, ranking.atual, ranking.anterior, ranking.total_atual, ranking.total_anterior
+    FROM ranking
+    JOIN premium ON premium.id = ranking.id_usuario
+    LEFT JOIN categorias c ON c.id = ranking.id_categoria
+    WHERE ranking.posicao = 1 AND ranking.atual > 0
+"""
+
+CONSULTAS_QUENTES = {
+    'insights_semanais': (SQL_INSIGHTS_SEMANAIS, ('2000-01-15', 947289600, 947289600, 946684800, 947894400)),
+}
+
+
+@dataclass
+class InsightSemanal:
+    id_usuario: int
+    chat_id: int
+    categoria: str
+    total_categoria: float
+    total_categoria_anterior: float
+    total_semana: float
+    total_semana_anterior: float
+
+    @staticmethod
+    def _variacao(atual, anterior):
+        return (atual - anterior) / anterior * 100 if anterior else None
+
+    @property
+    def variacao_categoria(self):
+        """Variação % da maior categoria contra a semana anterior (None sem base de comparação)."""
+        return self._variacao(self.total_categoria, self.total_categoria_anterior)
+
+    @property
+    def variacao_semana(self):
+        return self._variacao(self.total_semana, self.total_semana_anterior)
+
+
+async def calcular_semanais(agora=None):
+    """Insights dos últimos 7 dias de todos os premium ativos, numa só consulta."""
+    agora = agora or relogio.agora()
+    fim = unidades.epoch(agora)
+    inicio_semana = unidades.epoch(agora - timedelta(days=7))
+    inicio_anterior = unidades.epoch(agora - timedelta(days=14))
+    # Mesmo corte de repositorio.usuario_premium, para o insight e o handler concordarem.
+    corte = repositorio.corte_premium(agora)
+    linhas = await banco.buscar_todos(SQL_INSIGHTS_SEMANAIS, (corte, inicio_semana, inicio_semana, inicio_anterior, fim))
+    return [
+        InsightSemanal(id_usuario, chat_id, categoria, *map(unidades.reais, totais))
+        for id_usuario, chat_id, categoria, *totais in linhas
+    ]
+
+
+def _descrever_variacao(percentual):
+    if percentual is None:
+        return ""
+    if abs(percentual) < 0.5:
+        return " (igual à semana anterior)"
+    return f" ({'+' if percentual > 0 else ''}{percentual:.0f}% vs. semana anterior)"
+
+
+def formatar(insight):
+    categoria = (insight.categoria or 'sem categoria').capitalize()
+    return (
+        f"💡 *Seu Insight da Semana Premium!*\n\n"
+        f"Nos últimos 7 dias, sua maior categoria de gastos foi *{categoria}*, "
+        f"totalizando *R$ {insight.total_categoria:.2f}*{_descrever_variacao(insight.variacao_categoria)}.\n"
+        f"No total, você gastou R$ {insight.total_semana:.2f}{_descrever_variacao(insight.variacao_semana)}.\n\n"
+        f"Continue registrando para mais insights! 😉"
+    )
@@ -0,0 +1,327 @@
+"""Métricas de desempenho no formato texto do Prometheus.
+
+Ligadas por METRICAS_PORTA: o bot passa a servir GET /metrics em
+METRICAS_HOST:METRICAS_PORTA (por padrão só em 127.0.0.1) com:
+
+- latência e erros de cada handler registrado (inclusive os dentro das
+  conversas), medidos por fora de acesso_premium_necessario, e o resultado
+  da checagem de premium;
+- latência e erros dos jobs do JobQueue e de cada tipo de tarefa do agendador;
+- tempo e contagem de cada comando SQL, pelo nome da consulta em
+  CONSULTAS_QUENTES ou, fora delas, por "<comando> <tabela>";
+- profundidade das filas: updates, processamento por usuário, jobs,
+  escrita e leitura do banco e envio.
+
+O tempo de um SELECT é o da execução até a primeira linha; o fetch das demais
+não entra. As observações vêm do event loop e das threads do banco, por isso
+cada série tem um lock.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+PORTA = int(os.getenv("METRICAS_PORTA", "0"))
+HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+PREFIXO = "robo_"
+
+BALDES_HANDLER = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BALDES_SQL = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ''
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores_rotulos, quantidade=1):
+        with self._lock:
+            self._valores[valores_rotulos] = self._valores.get(valores_rotulos, 0) + quantidade
+
+    def linhas(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        for chave, valor in valores:
+            yield f"{self.nome}{_rotulos(self.rotulos, chave)} {valor}"
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), baldes=BALDES_HANDLER):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self.baldes = tuple(baldes)
+        self._series = {}  # rótulos -> [contagens por balde (não cumulativas)..., soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, segundos, *valores_rotulos):
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [0] * (len(self.baldes) + 2)
+            for i, limite in enumerate(self.baldes):
+                if segundos <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += segundos
+            serie[-1] += 1
+
+    def linhas(self):
+        with self._lock:
+            series = [(chave, list(serie)) for chave, serie in self._series.items()]
+        nomes = (*self.rotulos, 'le')
+        for chave, serie in series:
+            acumulado = 0
+            for limite, contagem in zip(self.baldes, serie):
+                acumulado += contagem
+                yield f"{self.nome}_bucket{_rotulos(nomes, (*chave, repr(limite)))} {acumulado}"
+            yield f"{self.nome}_bucket{_rotulos(nomes, (*chave, '+Inf'))} {serie[-1]}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {serie[-2]}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, chave)} {serie[-1]}"
+
+
+class Medidor:
+    """Gauge lido na hora da coleta: `funcao()` devolve o valor atual (None = sem série)."""
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, funcao):
+        self.nome, self.ajuda, self.funcao = nome, ajuda, funcao
+
+    def linhas(self):
+        try:
+            valor = self.funcao()
+        except Exception:
+            logger.exception(f"Falha ao ler a métrica {self.nome}.")
+            return
+        if valor is not None:
+            yield f"{self.nome} {valor}"
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = {}
+
+    def adicionar(self, metrica):
+        self.metricas[metrica.nome] = metrica
+        return metrica
+
+    def exportar(self):
+        """Todas as métricas no formato texto 0.0.4 do Prometheus."""
+        saida = []
+        for metrica in self.metricas.values():
+            saida.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            saida.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            saida.extend(metrica.linhas())
+        return '\n'.join(saida) + '\n'
+
+
+registro = Registro()
+handler_segundos = registro.adicionar(Histograma(f"{PREFIXO}handler_segundos", "Duração dos handlers do bot.", ('handler',)))
+handler_erros = registro.adicionar(Contador(f"{PREFIXO}handler_erros_total", "Exceções que escaparam dos handlers.", ('handler',)))
+acesso_premium = registro.adicionar(Contador(f"{PREFIXO}acesso_premium_total", "Checagens de acesso premium por resultado.", ('handler', 'resultado')))
+job_segundos = registro.adicionar(Histograma(f"{PREFIXO}job_segundos", "Duração dos jobs e das tarefas do agendador.", ('job',)))
+job_erros = registro.adicionar(Contador(f"{PREFIXO}job_erros_total", "Exceções nos jobs e nas tarefas do agendador.", ('job',)))
+sql_segundos = registro.adicionar(Histograma(f"{PREFIXO}sql_segundos", "Tempo de execução dos comandos SQL (até a primeira linha).", ('consulta',), BALDES_SQL))
+
+
+# --- Handlers e jobs ---
+def medir_handler(funcao, nome=None):
+    """Envolve um callback `(update, context)` de handler; já envolvido, devolve o mesmo."""
+    if getattr(funcao, '_medido', False):
+        return funcao
+    nome = nome or getattr(funcao, '__name__', repr(funcao))
+
+    @wraps(funcao)
+    async def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await funcao(*args, **kwargs)
+        except Exception:
+            handler_erros.inc(nome)
+            raise
+        finally:
+            handler_segundos.observar(time.perf_counter() - inicio, nome)
+    medido._medido = True
+    return medido
+
+
+def medir_job(funcao, nome=None):
+    """O mesmo que medir_handler, para callbacks de job `(context)`."""
+    if getattr(funcao, '_medido', False):
+        return funcao
+    nome = nome or getattr(funcao, '__name__', repr(funcao))
+
+    @wraps(funcao)
+    async def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return await funcao(*args, **kwargs)
+        except Exception:
+            job_erros.inc(nome)
+            raise
+        finally:
+            job_segundos.observar(time.perf_counter() - inicio, nome)
+    medido._medido = True
+    return medido
+
+
+def _handlers(handlers):
+    """Percorre os handlers, entrando nos entry points, estados e fallbacks das conversas."""
+    from telegram.ext import ConversationHandler
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            yield from _handlers(handler.entry_points)
+            for estado in handler.states.values():
+                yield from _handlers(estado)
+            yield from _handlers(handler.fallbacks)
+        else:
+            yield handler
+
+
+def instrumentar_handlers(application):
+    quantos = 0
+    for grupo in application.handlers.values():
+        for handler in _handlers(grupo):
+            handler.callback = medir_handler(handler.callback)
+            quantos += 1
+    return quantos
+
+
+def instrumentar_jobs(job_queue):
+    for job in job_queue.jobs():
+        job.callback = medir_job(job.callback, job.name)
+
+
+# --- SQL ---
+_nomes_consultas = None
+_PALAVRA = re.compile(r"[\w.]+")
+_ALVO = {'SELECT': 'FROM', 'WITH': 'FROM', 'INSERT': 'INTO', 'REPLACE': 'INTO', 'DELETE': 'FROM'}
+
+
+def _nome_generico(sql):
+    """'<comando> <tabela>' para SQL fora de CONSULTAS_QUENTES, para não explodir a cardinalidade."""
+    palavras = _PALAVRA.findall(sql)
+    if not palavras:
+        return 'vazio'
+    maiusculas = [palavra.upper() for palavra in palavras]
+    comando = maiusculas[0]
+    if comando == 'UPDATE' and len(palavras) > 1:
+        return f"update {palavras[1]}"
+    if _ALVO.get(comando) in maiusculas[1:-1]:
+        return f"{comando.lower()} {palavras[maiusculas.index(_ALVO[comando], 1) + 1]}"
+    return comando.lower()
+
+
+def nome_consulta(sql):
+    """Nome da consulta em CONSULTAS_QUENTES (ignorando espaços) ou o nome genérico."""
+    global _nomes_consultas
+    if _nomes_consultas is None:
+        import migracoes
+        _nomes_consultas = {' '.join(texto.split()): nome for nome, (texto, _) in migracoes.consultas_quentes().items()}
+    nome = _nomes_consultas.get(sql)
+    if nome is None:
+        nome = _nomes_consultas.get(' '.join(sql.split())) or _nome_generico(sql)
+        # O texto exato também vira chave; SQL montado com listas de ? variáveis não pode crescer sem fim.
+        if len(_nomes_consultas) < 5000:
+            _nomes_consultas[sql] = nome
+    return nome
+
+
+class CursorMedido(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            sql_segundos.observar(time.perf_counter() - inicio, nome_consulta(sql))
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            sql_segundos.observar(time.perf_counter() - inicio, nome_consulta(sql))
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão cujos cursores medem cada comando; use como `factory` de sqlite3.connect."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+
+# --- Filas e endpoint ---
+def registrar_filas(application):
+    import banco
+    import envio
+    import processamento
+    processador = application.update_processor
+
+    def estatistica_processador(chave):
+        if isinstance(processador, processamento.ProcessadorPorUsuario):
+            return processador.estatisticas()[chave]
+        return processador.current_concurrent_updates if chave == 'em_andamento' else None
+
+    medidores = [
+        (f"{PREFIXO}fila_updates", "Updates recebidos esperando o processador.", application.update_queue.qsize),
+        (f"{PREFIXO}updates_em_andamento", "Updates sendo processados.", lambda: estatistica_processador('em_andamento')),
+        (f"{PREFIXO}updates_aguardando_usuario", "Updates esperando o anterior do mesmo usuário.", lambda: estatistica_processador('aguardando')),
+        (f"{PREFIXO}jobs_agendados", "Jobs no JobQueue.", lambda: len(application.job_queue.jobs()) if application.job_queue else None),
+        (f"{PREFIXO}fila_escrita_db", "Escritas esperando a thread de escrita do banco.", lambda: banco.pool.profundidade_fila_escrita() if banco.pool else None),
+        (f"{PREFIXO}fila_leitura_db", "Leituras esperando um leitor livre.", lambda: banco.pool.profundidade_fila_leitura() if banco.pool else None),
+        (f"{PREFIXO}fila_envio", "Mensagens esperando a fila de envio.", lambda: envio.estatisticas().get('fila')),
+    ]
+    for nome, ajuda, funcao in medidores:
+        registro.adicionar(Medidor(nome, ajuda, funcao))
+
+
+_servidor = None
+
+
+def iniciar(application):
+    """Instrumenta handlers e jobs já registrados e sobe o endpoint. Roda dentro do event loop."""
+    global _servidor
+    import tornado.web
+
+    class ManipuladorMetricas(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.finish(registro.exportar())
+
+    quantos = instrumentar_handlers(application)
+    if application.job_queue:
+        instrumentar_jobs(application.job_queue)
+    registrar_filas(application)
+    _servidor = tornado.web.Application([(r"/metrics", ManipuladorMetricas)]).listen(PORTA, HOST)
+    logger.info(f"Métricas em http://{HOST}:{PORTA}/metrics ({quantos} handlers instrumentados).")
+
+
+def encerrar():
+    global _servidor
+    if _servidor is not None:
+        _servidor.stop()
+        _servidor = None
@@ -0,0 +1,197 @@
+"""Migrações versionadas do esquema SQLite.
+
+A versão aplicada fica em `PRAGMA user_version`. Cada migração roda numa
+transação própria junto com a atualização da versão, então um deploy
+interrompido no meio é reaplicado por inteiro no próximo start.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+def _v1_esquema_inicial(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS usuarios (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE, chat_id INTEGER, nome_usuario TEXT, data_criacao TEXT, ultimo_lancamento TEXT, dias_sequencia INTEGER DEFAULT 0)')
+    conn.execute('CREATE TABLE IF NOT EXISTS categorias (id INTEGER PRIMARY KEY, id_usuario INTEGER, nome TEXT, UNIQUE(id_usuario, nome), FOREIGN KEY (id_usuario) REFERENCES usuarios (id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS cartoes (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, nome TEXT, limite REAL, dia_fechamento INTEGER, UNIQUE(id_usuario, nome), FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS transacoes (id INTEGER PRIMARY KEY, id_usuario INTEGER, id_categoria INTEGER, valor REAL, tipo TEXT, data_transacao TEXT, id_cartao INTEGER, FOREIGN KEY (id_usuario) REFERENCES usuarios (id), FOREIGN KEY (id_categoria) REFERENCES categorias (id), FOREIGN KEY (id_cartao) REFERENCES cartoes(id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS lembretes_diarios (id_usuario INTEGER PRIMARY KEY, horario TEXT, chat_id INTEGER, FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS agendamentos (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, dia INTEGER, horario TEXT, titulo TEXT, valor REAL, chat_id INTEGER, UNIQUE(id_usuario, titulo), FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS orcamentos (id INTEGER PRIMARY KEY AUTOINCREMENT, id_usuario INTEGER, id_categoria INTEGER, valor REAL, UNIQUE(id_usuario, id_categoria), FOREIGN KEY (id_usuario) REFERENCES usuarios(id), FOREIGN KEY (id_categoria) REFERENCES categorias(id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS assinaturas (id_usuario INTEGER PRIMARY KEY, plano TEXT, data_expiracao TEXT, FOREIGN KEY (id_usuario) REFERENCES usuarios(id))')
+
+
+def _v2_indices_transacoes(conn):
+    # Índices de cobertura: incluem `valor` para que os SUMs não precisem ler a tabela.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_tipo_data ON transacoes (id_usuario, tipo, data_transacao, valor)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_cartao_data ON transacoes (id_cartao, data_transacao, tipo, valor)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_categoria_data ON transacoes (id_usuario, id_categoria, tipo, data_transacao, valor)')
+    conn.execute('ANALYZE transacoes')
+
+
+def _v3_resumo_mensal(conn):
+    # Categoria/cartão ausentes viram 0 para que a chave primária funcione no UPSERT.
+    conn.execute('CREATE TABLE IF NOT EXISTS resumo_mensal (id_usuario INTEGER NOT NULL, mes TEXT NOT NULL, tipo TEXT NOT NULL, id_categoria INTEGER NOT NULL DEFAULT 0, id_cartao INTEGER NOT NULL DEFAULT 0, total REAL NOT NULL DEFAULT 0, quantidade INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (id_usuario, mes, tipo, id_categoria, id_cartao)) WITHOUT ROWID')
+    conn.execute("DELETE FROM resumo_mensal")
+    conn.execute("INSERT INTO resumo_mensal (id_usuario, mes, tipo, id_categoria, id_cartao, total, quantidade) SELECT id_usuario, substr(data_transacao, 1, 7), tipo, COALESCE(id_categoria, 0), COALESCE(id_cartao, 0), SUM(valor), COUNT(*) FROM transacoes GROUP BY 1, 2, 3, 4, 5")
+
+
+def _v4_apelidos_categoria(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS categoria_apelidos (id_usuario INTEGER NOT NULL, apelido TEXT NOT NULL, id_categoria INTEGER NOT NULL, PRIMARY KEY (id_usuario, apelido), FOREIGN KEY (id_usuario) REFERENCES usuarios(id), FOREIGN KEY (id_categoria) REFERENCES categorias(id)) WITHOUT ROWID')
+
+
+def _v5_indice_relatorio(conn):
+    # Cobre o GROUP BY do relatório (dia, tipo, categoria, cartão) sem ler a tabela.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_data ON transacoes (id_usuario, data_transacao, tipo, id_categoria, id_cartao, valor)')
+    conn.execute('ANALYZE transacoes')
+
+
+def _v6_tarefas_agendadas(conn):
+    # Preenchida por agendador.sincronizar no start; referencia = id do agendamento (0 nos demais tipos).
+    conn.execute('CREATE TABLE IF NOT EXISTS tarefas_agendadas (tipo TEXT NOT NULL, id_usuario INTEGER NOT NULL, referencia INTEGER NOT NULL DEFAULT 0, chat_id INTEGER, dia INTEGER, horario TEXT NOT NULL, proxima_execucao TEXT NOT NULL, PRIMARY KEY (tipo, id_usuario, referencia)) WITHOUT ROWID')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tarefas_proxima_execucao ON tarefas_agendadas (proxima_execucao)')
+
+
+def _v7_insight_global(conn):
+    # Os insights passaram a ser uma tarefa única em lote (recriada por agendador.sincronizar).
+    conn.execute("DELETE FROM tarefas_agendadas WHERE tipo = 'insight'")
+    # O lote de insights parte das assinaturas ativas.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_assinaturas_expiracao ON assinaturas (data_expiracao)')
+
+
+def _v8_estado_conversas(conn):
+    # user_data e estados do ConversationHandler gravados por persistencia.PersistenciaSQLite.
+    conn.execute('CREATE TABLE IF NOT EXISTS estado_usuarios (telegram_id INTEGER PRIMARY KEY, dados TEXT NOT NULL, atualizado_em TEXT NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS estado_conversas (nome TEXT NOT NULL, chave TEXT NOT NULL, estado TEXT NOT NULL, atualizado_em TEXT NOT NULL, PRIMARY KEY (nome, chave)) WITHOUT ROWID')
+
+
+def _v9_id_externo(conn):
+    # Identifica lançamentos importados de extratos (FITID do OFX, hash da linha do CSV) para não duplicar.
+    if 'id_externo' not in {coluna[1] for coluna in conn.execute("PRAGMA table_info(transacoes)")}:
+        conn.execute('ALTER TABLE transacoes ADD COLUMN id_externo TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transacoes_id_externo ON transacoes (id_usuario, id_externo) WHERE id_externo IS NOT NULL')
+
+
+def _v10_centavos_epoch(conn):
+    # Valores em centavos inteiros e datas em segundos UTC. valor e data_transacao continuam
+    # sendo gravados (e o gatilho preenche as novas colunas para um binário antigo) durante o deploy.
+    colunas = {coluna[1] for coluna in conn.execute("PRAGMA table_info(transacoes)")}
+    if 'valor_centavos' not in colunas:
+        conn.execute('ALTER TABLE transacoes ADD COLUMN valor_centavos INTEGER')
+    if 'data_epoch' not in colunas:
+        conn.execute('ALTER TABLE transacoes ADD COLUMN data_epoch INTEGER')
+    conn.execute("UPDATE transacoes SET valor_centavos = CAST(round(valor * 100) AS INTEGER), data_epoch = CAST(strftime('%s', data_transacao) AS INTEGER) WHERE valor_centavos IS NULL OR data_epoch IS NULL")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transacoes_centavos_epoch AFTER INSERT ON transacoes
+        WHEN NEW.valor_centavos IS NULL OR NEW.data_epoch IS NULL
+        BEGIN
+            UPDATE transacoes SET valor_centavos = CAST(round(NEW.valor * 100) AS INTEGER), data_epoch = CAST(strftime('%s', NEW.data_transacao) AS INTEGER) WHERE id = NEW.id;
+        END
+    ''')
+    # Índices sobre as colunas inteiras substituem os de texto.
+    for indice in ('idx_transacoes_usuario_tipo_data', 'idx_transacoes_cartao_data', 'idx_transacoes_usuario_categoria_data', 'idx_transacoes_usuario_data'):
+        conn.execute(f'DROP INDEX IF EXISTS {indice}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_epoch ON transacoes (id_usuario, data_epoch, tipo, id_categoria, id_cartao, valor_centavos)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_cartao_epoch ON transacoes (id_cartao, data_epoch, tipo, valor_centavos)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_categoria ON transacoes (id_usuario, id_categoria)')
+    if 'total_centavos' not in {coluna[1] for coluna in conn.execute("PRAGMA table_info(resumo_mensal)")}:
+        conn.execute('ALTER TABLE resumo_mensal ADD COLUMN total_centavos INTEGER NOT NULL DEFAULT 0')
+    conn.execute("DELETE FROM resumo_mensal")
+    conn.execute("INSERT INTO resumo_mensal (id_usuario, mes, tipo, id_categoria, id_cartao, total, total_centavos, quantidade) SELECT id_usuario, strftime('%Y-%m', data_epoch, 'unixepoch'), tipo, COALESCE(id_categoria, 0), COALESCE(id_cartao, 0), SUM(valor_centavos) / 100.0, SUM(valor_centavos), COUNT(*) FROM transacoes GROUP BY 1, 2, 3, 4, 5")
+    conn.execute('ANALYZE transacoes')
+
+
+def _v11_arquivo_transacoes(conn):
+    # Meses fechados saem de transacoes para transacoes_arquivo (mesmas colunas, sem as legadas);
+    # transacoes_completas junta as duas para os períodos que chegam antes de arquivamento.limite_epoch.
+    conn.execute('CREATE TABLE IF NOT EXISTS transacoes_arquivo (id INTEGER PRIMARY KEY, id_usuario INTEGER, id_categoria INTEGER, valor_centavos INTEGER, tipo TEXT, data_epoch INTEGER, id_cartao INTEGER, id_externo TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_arquivo_usuario_epoch ON transacoes_arquivo (id_usuario, data_epoch, tipo, id_categoria, id_cartao, valor_centavos)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_arquivo_cartao_epoch ON transacoes_arquivo (id_cartao, data_epoch, tipo, valor_centavos)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transacoes_arquivo_usuario_categoria ON transacoes_arquivo (id_usuario, id_categoria)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transacoes_arquivo_id_externo ON transacoes_arquivo (id_usuario, id_externo) WHERE id_externo IS NOT NULL')
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS transacoes_completas AS
+        SELECT id, id_usuario, id_categoria, valor_centavos, tipo, data_epoch, id_cartao, id_externo FROM transacoes
+        UNION ALL
+        SELECT id, id_usuario, id_categoria, valor_centavos, tipo, data_epoch, id_cartao, id_externo FROM transacoes_arquivo
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS arquivamento (id INTEGER PRIMARY KEY CHECK (id = 1), limite_epoch INTEGER NOT NULL, atualizado_em TEXT)')
+    conn.execute("INSERT OR IGNORE INTO arquivamento (id, limite_epoch) VALUES (1, 0)")
+
+# (versão, descrição, função) em ordem crescente. Nunca edite uma migração já publicada.
+MIGRACOES = [
+    (1, "esquema inicial", _v1_esquema_inicial),
+    (2, "índices de cobertura em transacoes", _v2_indices_transacoes),
+    (3, "agregados mensais por usuário em resumo_mensal", _v3_resumo_mensal),
+    (4, "apelidos de categoria aprendidos com as sugestões", _v4_apelidos_categoria),
+    (5, "índice de cobertura para o relatório agrupado", _v5_indice_relatorio),
+    (6, "agenda única de lembretes, contas e insights", _v6_tarefas_agendadas),
+    (7, "insights semanais como uma tarefa única em lote (e índice de expiração)", _v7_insight_global),
+    (8, "estado persistido de conversas e user_data", _v8_estado_conversas),
+    (9, "id_externo para importação de extratos", _v9_id_externo),
+    (10, "valores em centavos e datas em epoch UTC em transacoes", _v10_centavos_epoch),
+    (11, "arquivo de meses fechados de transacoes", _v11_arquivo_transacoes),
+]
+
+
+def versao_atual(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar(caminho):
+    """Aplica as migrações pendentes e devolve a versão final do banco."""
+    conn = sqlite3.connect(caminho)
+    try:
+        versao = versao_atual(conn)
+        for numero, descricao, funcao in MIGRACOES:
+            if numero <= versao:
+                continue
+            conn.execute("BEGIN")
+            try:
+                funcao(conn)
+                conn.execute(f"PRAGMA user_version = {numero}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.exception(f"Falha na migração {numero} ({descricao}).")
+                raise
+            logger.info(f"Migração {numero} aplicada: {descricao}.")
+            versao = numero
+        return versao
+    finally:
+        conn.close()
+
+
+def consultas_quentes():
+    """Junta os CONSULTAS_QUENTES dos módulos: nome -> (sql, parâmetros de exemplo)."""
+    import agendador, arquivamento, exportacao, faturas, importacao, insights, relatorios, repositorio
+    consultas = {}
+    for modulo in (repositorio, relatorios, exportacao, importacao, faturas, agendador, insights, arquivamento):
+        consultas.update(modulo.CONSULTAS_QUENTES)
+    return consultas
+
+
+def verificar_planos(conn, consultas=None):
+    """Roda EXPLAIN QUERY PLAN nas consultas quentes e devolve as que fazem SCAN.
+
+    O resultado é uma lista de (nome, detalhe do plano); vazia quando todas usam
+    SEARCH em algum índice. Varreduras de CTEs, subconsultas e linhas constantes
+    (VALUES) não contam, já que não leem tabelas.
+    """
+    if consultas is None:
+        consultas = consultas_quentes()
+    problemas = []
+    for nome, (sql, params) in consultas.items():
+        intermediarias = set()
+        for linha in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detalhe = linha[-1]
+            for prefixo in ("MATERIALIZE ", "CO-ROUTINE "):
+                if detalhe.startswith(prefixo):
+                    intermediarias.add(detalhe[len(prefixo):])
+            if not detalhe.startswith("SCAN"):
+                continue
+            alvo = detalhe[len("SCAN "):]
+            if alvo in intermediarias or alvo.startswith("(subquery") or alvo.endswith(("CONSTANT ROW", "CONSTANT ROWS")):
+                continue
+            problemas.append((nome, detalhe))
+    return problemas
@@ -0,0 +1,209 @@
+"""Perfilador por amostragem, ligado sob demanda com o bot rodando.
+
+Uma thread lê as pilhas de todas as threads (`sys._current_frames`) a cada
+PERFILADOR_INTERVALO_MS: event loop, leitores e escritor do banco, gráficos...
+Amostras paradas em espera (select do loop, worker sem tarefa) são descartadas,
+então o que sobra é tempo de CPU ou de I/O síncrono. As pilhas são guardadas
+como tuplas de code objects e só viram texto no final, o que mantém o custo de
+cada amostra baixo.
+
+Para achar travamentos do event loop, uma tarefa no loop marca uma batida a
+cada BATIDA segundos. Se a última batida ficar mais velha que
+PERFILADOR_TRAVAMENTO_MS, a thread de amostragem guarda a pilha do loop
+naquele instante: a mais frequente durante o travamento é a que o causou.
+
+O resultado sai como pilhas colapsadas (uma linha "thread;f1;f2 contagem", o
+formato do flamegraph.pl e do speedscope) e um resumo com as funções mais quentes.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+INTERVALO = float(os.getenv("PERFILADOR_INTERVALO_MS", "5")) / 1000
+LIMITE_TRAVAMENTO = float(os.getenv("PERFILADOR_TRAVAMENTO_MS", "100")) / 1000
+DURACAO = int(os.getenv("PERFILADOR_DURACAO", "30"))
+DURACAO_MAX = 600
+BATIDA = 0.01
+
+# (arquivo, função) da folha de uma pilha que só está esperando trabalho.
+OCIOSAS = {
+    ('selectors.py', 'select'), ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'), ('thread.py', '_worker'),
+}
+
+atual = None  # Perfilador em andamento
+
+
+def _nome_thread(nome):
+    """'db-leitura_3' -> 'db-leitura': as threads de um pool aparecem juntas."""
+    return re.sub(r'_\d+$', '', nome)
+
+
+def _quadro(codigo):
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _pilha(frame):
+    """Code objects da raiz até a folha."""
+    codigos = []
+    while frame is not None:
+        codigos.append(frame.f_code)
+        frame = frame.f_back
+    codigos.reverse()
+    return tuple(codigos)
+
+
+def _ociosa(pilha):
+    folha = pilha[-1]
+    return (os.path.basename(folha.co_filename), folha.co_name) in OCIOSAS
+
+
+@dataclass
+class Travamento:
+    inicio: float  # segundos desde o começo do perfil
+    duracao: float
+    pilhas: Counter = field(default_factory=Counter)
+
+    def pilha_principal(self):
+        return self.pilhas.most_common(1)[0][0] if self.pilhas else ()
+
+
+@dataclass
+class ResultadoPerfil:
+    duracao: float
+    intervalo: float
+    amostras: Counter  # (thread, pilha) -> contagem
+    ociosas: int
+    travamentos: list
+
+    def colapsadas(self):
+        linhas = []
+        for (thread, pilha), contagem in self.amostras.most_common():
+            linhas.append(";".join([thread, *map(_quadro, pilha)]) + f" {contagem}")
+        return "\n".join(linhas) + "\n"
+
+    def mais_quentes(self, n=15):
+        """[(função, amostras na folha, amostras em qualquer ponto da pilha)], pelo tempo próprio."""
+        proprio, total = Counter(), Counter()
+        for (_, pilha), contagem in self.amostras.items():
+            proprio[pilha[-1]] += contagem
+            for codigo in set(pilha):
+                total[codigo] += contagem
+        return [(_quadro(codigo), contagem, total[codigo]) for codigo, contagem in proprio.most_common(n)]
+
+    def resumo(self, n=15, limite_caracteres=4000):
+        ativas = sum(self.amostras.values())
+        por_thread = Counter()
+        for (thread, _), contagem in self.amostras.items():
+            por_thread[thread] += contagem
+        linhas = [f"Perfil de {self.duracao:.0f}s, amostra a cada {self.intervalo * 1000:.0f} ms: "
+                  f"{ativas} amostras ativas ({self.ociosas} ociosas descartadas).",
+                  "Por thread: " + ", ".join(f"{thread} {contagem}" for thread, contagem in por_thread.most_common())]
+        if ativas:
+            linhas.append(f"\nTop {n} (próprio% / total%):")
+            for quadro, proprio, total in self.mais_quentes(n):
+                linhas.append(f"{proprio / ativas * 100:5.1f}% {total / ativas * 100:5.1f}%  {quadro}")
+        if self.travamentos:
+            linhas.append(f"\nTravamentos do event loop acima de {LIMITE_TRAVAMENTO * 1000:.0f} ms: {len(self.travamentos)}")
+            for travamento in sorted(self.travamentos, key=lambda t: t.duracao, reverse=True)[:5]:
+                pilha = travamento.pilha_principal()
+                linhas.append(f"- {travamento.duracao * 1000:.0f} ms aos {travamento.inicio:.1f}s:")
+                linhas.extend(f"    {_quadro(codigo)}" for codigo in pilha[-6:])
+        texto = "\n".join(linhas)
+        return texto if len(texto) <= limite_caracteres else texto[:limite_caracteres - 3] + "..."
+
+
+class Perfilador:
+    def __init__(self, intervalo=INTERVALO, limite_travamento=LIMITE_TRAVAMENTO):
+        self.intervalo = intervalo
+        self.limite_travamento = limite_travamento
+        self.amostras = Counter()
+        self.ociosas = 0
+        self.travamentos = []
+        self._parar = threading.Event()
+        self._batida = time.perf_counter()
+        self._thread_loop = None
+        self._inicio = None
+
+    def _amostrar(self):
+        propria = threading.get_ident()
+        nomes = {}
+        travamento = None
+        while not self._parar.wait(self.intervalo):
+            agora = time.perf_counter()
+            frames = sys._current_frames()
+            if len(nomes) != len(frames):
+                nomes = {thread.ident: _nome_thread(thread.name) for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == propria:
+                    continue
+                pilha = _pilha(frame)
+                if not pilha or _ociosa(pilha):
+                    self.ociosas += 1
+                    continue
+                self.amostras[(nomes.get(ident, str(ident)), pilha)] += 1
+                if ident == self._thread_loop and agora - self._batida > self.limite_travamento:
+                    if travamento is None:
+                        travamento = Travamento(self._batida - self._inicio, 0.0)
+                        self.travamentos.append(travamento)
+                    travamento.pilhas[pilha] += 1
+            if travamento is not None:
+                if agora - self._batida > self.limite_travamento:
+                    travamento.duracao = agora - self._inicio - travamento.inicio
+                else:
+                    travamento = None
+            del frames
+
+    async def executar(self, segundos):
+        """Amostra por `segundos` (ou até `parar`) e devolve o ResultadoPerfil. Roda no event loop."""
+        self._thread_loop = threading.get_ident()
+        self._inicio = self._batida = time.perf_counter()
+        thread = threading.Thread(target=self._amostrar, name="perfilador", daemon=True)
+        thread.start()
+        fim = self._inicio + segundos
+        try:
+            while not self._parar.is_set() and time.perf_counter() < fim:
+                self._batida = time.perf_counter()
+                await asyncio.sleep(BATIDA)
+        finally:
+            self._parar.set()
+            await asyncio.to_thread(thread.join)
+        duracao = time.perf_counter() - self._inicio
+        logger.info(f"Perfil de {duracao:.1f}s: {sum(self.amostras.values())} amostras, {len(self.travamentos)} travamentos do loop.")
+        return ResultadoPerfil(duracao, self.intervalo, self.amostras, self.ociosas, self.travamentos)
+
+    def parar(self):
+        self._parar.set()
+
+
+def iniciar():
+    """Cria o perfilador da vez; None se já houver um em andamento."""
+    global atual
+    if atual is not None:
+        return None
+    atual = Perfilador()
+    return atual
+
+
+async def perfilar(perfilador, segundos):
+    global atual
+    try:
+        return await perfilador.executar(min(segundos, DURACAO_MAX))
+    finally:
+        atual = None
+
+
+def parar():
+    """Encerra o perfil em andamento antes do tempo; False se não havia nenhum."""
+    if atual is None:
+        return False
+    atual.parar()
+    return True
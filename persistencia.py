@@ -0,0 +1,245 @@
+"""Persistência do user_data e das conversas no próprio gastos_bot.db.
+
+O python-telegram-bot já junta as alterações e chama os métodos update_* a
+cada `update_interval` segundos (e no encerramento). Aqui cada chamada só
+serializa o valor e o guarda num buffer; todo o lote vai para o banco numa
+única escrita, logo depois que o PTB termina de entregá-lo. Se o buffer passar
+de `limite_pendentes`, a escrita acontece na hora.
+
+Só entra no banco estado pendente: user_data vazio e conversas encerradas
+apagam a linha, e o que não é tocado há mais de `validade` é ignorado e
+removido na carga, então um restart carrega poucas linhas.
+
+Memória: o buffer de escrita tem no máximo `limite_pendentes` entradas. O
+`application.user_data`, que o PTB mantém para todo usuário que já mandou um
+update, é podado a cada gravação: sai o user_data vazio de quem não tem
+update em andamento (os handlers limpam o que guardaram ao terminar a
+conversa) e, vazio ou não, o de quem está parado há mais de `validade`, como
+aconteceria num restart. Fica em memória, portanto, só quem tem alguma
+conversa pela metade e usou o bot dentro da validade. Para isso a
+persistência precisa conhecer a Application (`vincular`).
+
+Os valores são gravados em JSON; datetime/date ganham uma marca para voltar
+com o tipo certo.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import banco
+import processamento
+import relogio
+
+logger = logging.getLogger(__name__)
+
+
+def _codificar(valor):
+    if isinstance(valor, datetime):
+        return {'__datetime__': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'__date__': valor.isoformat()}
+    raise TypeError(f"{type(valor).__name__} não é serializável")
+
+
+def _decodificar(objeto):
+    if '__datetime__' in objeto:
+        return datetime.fromisoformat(objeto['__datetime__'])
+    if '__date__' in objeto:
+        return date.fromisoformat(objeto['__date__'])
+    return objeto
+
+
+def serializar(valor):
+    return json.dumps(valor, default=_codificar, ensure_ascii=False, separators=(',', ':'))
+
+
+def desserializar(texto):
+    return json.loads(texto, object_hook=_decodificar)
+
+
+class PersistenciaSQLite(BasePersistence):
+    def __init__(self, intervalo=10, limite_pendentes=1000, validade=timedelta(hours=48)):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False), update_interval=intervalo)
+        self.limite_pendentes = limite_pendentes
+        self.validade = validade
+        # Valor None = apagar a linha.
+        self._usuarios = {}  # telegram_id -> JSON do user_data
+        self._conversas = {}  # (nome, chave JSON) -> JSON do estado
+        self._gravacao = None
+        self.gravacoes = 0
+        self.application = None
+        self._ultimo_uso = {}  # telegram_id -> time.monotonic() do último update_user_data
+        self._entregues = set()  # telegram_ids com user_data entregue desde a última gravação
+        self.liberados = 0
+
+    def vincular(self, application):
+        """Liga a remoção de user_data inativo da memória (ver docstring do módulo)."""
+        self.application = application
+
+    def _limite_validade(self):
+        return (relogio.agora() - self.validade).strftime('%Y-%m-%d %H:%M:%S')
+
+    # --- Carga ---
+    async def get_user_data(self):
+        limite = self._limite_validade()
+        await banco.executar("DELETE FROM estado_usuarios WHERE atualizado_em < ?", (limite,))
+        dados = {}
+        carga = time.monotonic()
+        for telegram_id, texto in await banco.buscar_todos("SELECT telegram_id, dados FROM estado_usuarios"):
+            try:
+                dados[telegram_id] = desserializar(texto)
+                self._ultimo_uso[telegram_id] = carga
+            except ValueError:
+                logger.warning(f"user_data persistido do usuário {telegram_id} ilegível; descartado.")
+        return dados
+
+    async def get_conversations(self, name):
+        limite = self._limite_validade()
+        await banco.executar("DELETE FROM estado_conversas WHERE nome = ? AND atualizado_em < ?", (name, limite))
+        linhas = await banco.buscar_todos("SELECT chave, estado FROM estado_conversas WHERE nome = ?", (name,))
+        return {tuple(json.loads(chave)): json.loads(estado) for chave, estado in linhas}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Alterações (só bufferizam) ---
+    async def update_user_data(self, user_id, data):
+        self._ultimo_uso[user_id] = time.monotonic()
+        self._entregues.add(user_id)
+        try:
+            self._usuarios[user_id] = serializar(data) if data else None
+        except TypeError as erro:
+            logger.warning(f"user_data do usuário {user_id} não persistido: {erro}")
+            return
+        await self._agendar_gravacao()
+
+    async def drop_user_data(self, user_id):
+        self._usuarios[user_id] = None
+        await self._agendar_gravacao()
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversas[(name, json.dumps(list(key)))] = None if new_state is None else json.dumps(new_state)
+        await self._agendar_gravacao()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- User_data em memória ---
+    def _ocupado(self, user_id):
+        processador = self.application.update_processor
+        if isinstance(processador, processamento.ProcessadorPorUsuario):
+            return processador.ocupado(user_id)
+        return processador.current_concurrent_updates > 0
+
+    def _liberar_inativos(self):
+        """Tira do application.user_data quem não precisa mais dele; o PTB apaga a linha na próxima rodada.
+
+        A cópia entregue pelo PTB pode ter sido tirada no meio de um handler, então
+        a decisão olha o user_data de agora: vazio e sem update do usuário em
+        andamento, não há o que perder.
+        """
+        entregues, self._entregues = self._entregues, set()
+        if self.application is None:
+            return
+        limite_uso = time.monotonic() - self.validade.total_seconds()
+        expirados = {user_id for user_id, momento in self._ultimo_uso.items() if momento <= limite_uso}
+        for user_id in entregues | expirados:
+            if user_id not in self.application.user_data:
+                self._ultimo_uso.pop(user_id, None)
+                continue
+            if self._ocupado(user_id) or (self.application.user_data[user_id] and user_id not in expirados):
+                continue
+            if self.application.user_data[user_id]:
+                logger.info(f"user_data de {user_id} parado há mais de {self.validade}; liberado da memória.")
+            self.application.drop_user_data(user_id)
+            self._ultimo_uso.pop(user_id, None)
+            self.liberados += 1
+
+    # --- Escrita em lote ---
+    def pendentes(self):
+        return len(self._usuarios) + len(self._conversas)
+
+    async def _agendar_gravacao(self):
+        if self.pendentes() >= self.limite_pendentes:
+            await self._gravar()
+        elif self._gravacao is None:
+            self._gravacao = asyncio.get_running_loop().create_task(self._gravar_depois_do_lote())
+
+    async def _gravar_depois_do_lote(self):
+        # O PTB entrega as alterações de um ciclo num gather; cede a vez para que todas entrem no buffer.
+        await asyncio.sleep(0)
+        self._gravacao = None
+        self._liberar_inativos()
+        await self._gravar()
+
+    async def _gravar(self):
+        if not self.pendentes():
+            return
+        usuarios, self._usuarios = self._usuarios, {}
+        conversas, self._conversas = self._conversas, {}
+        agora = relogio.agora().strftime('%Y-%m-%d %H:%M:%S')
+
+        def _gravar_lote(conn):
+            conn.executemany("""
+                INSERT INTO estado_usuarios (telegram_id, dados, atualizado_em) VALUES (?, ?, ?)
+                ON CONFLICT (telegram_id) DO UPDATE SET dados = excluded.dados, atualizado_em = excluded.atualizado_em
+            """, [(telegram_id, texto, agora) for telegram_id, texto in usuarios.items() if texto is not None])
+            conn.executemany("DELETE FROM estado_usuarios WHERE telegram_id = ?", [(telegram_id,) for telegram_id, texto in usuarios.items() if texto is None])
+            conn.executemany("""
+                INSERT INTO estado_conversas (nome, chave, estado, atualizado_em) VALUES (?, ?, ?, ?)
+                ON CONFLICT (nome, chave) DO UPDATE SET estado = excluded.estado, atualizado_em = excluded.atualizado_em
+            """, [(nome, chave, estado, agora) for (nome, chave), estado in conversas.items() if estado is not None])
+            conn.executemany("DELETE FROM estado_conversas WHERE nome = ? AND chave = ?", [chave for chave, estado in conversas.items() if estado is None])
+        try:
+            await banco.escrever(_gravar_lote)
+            self.gravacoes += 1
+        except Exception:
+            logger.exception(f"Falha ao gravar {len(usuarios) + len(conversas)} estados; ficam para a próxima gravação.")
+            # Alterações que chegaram durante a tentativa são mais novas e prevalecem.
+            for chave, valor in usuarios.items():
+                self._usuarios.setdefault(chave, valor)
+            for chave, valor in conversas.items():
+                self._conversas.setdefault(chave, valor)
+
+    async def flush(self):
+        if self._gravacao is not None:
+            self._gravacao.cancel()
+            self._gravacao = None
+        await self._gravar()
+
+
+def configurar():
+    return PersistenciaSQLite(
+        intervalo=float(os.getenv("PERSISTENCIA_INTERVALO", "10")),
+        limite_pendentes=int(os.getenv("PERSISTENCIA_PENDENTES_MAX", "1000")),
+        validade=timedelta(hours=float(os.getenv("PERSISTENCIA_VALIDADE_HORAS", "48"))),
+    )
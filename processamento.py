@@ -0,0 +1,82 @@
+"""Processamento concorrente de updates com ordem garantida por usuário.
+
+Updates de usuários diferentes rodam em paralelo (até BOT_UPDATES_SIMULTANEOS
+de uma vez), mas os de um mesmo usuário são executados um de cada vez, na
+ordem de chegada: o `-50 mercado` e o clique na forma de pagamento que vem
+depois passam pelo ConversationHandler na sequência certa.
+
+Enquanto um usuário está sendo atendido, os updates seguintes dele esperam a
+vez num lock daquele usuário (o asyncio.Lock atende na ordem de chegada). Quem
+espera continua ocupando sua vaga e só é dado como processado ao terminar, então
+o limite de simultâneos e a fila limitada de updates (BOT_FILA_UPDATES_MAX)
+seguram de verdade uma rajada: o bot para de aceitar updates em vez de acumular
+corrotinas pendentes em memória.
+"""
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def chave_serializacao(update):
+    """Usuário do update (ou o chat, se não houver usuário); None para updates sem dono."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ('usuario', update.effective_user.id)
+    if update.effective_chat is not None:
+        return ('chat', update.effective_chat.id)
+    return None
+
+
+class ProcessadorPorUsuario(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._vezes = {}  # chave -> [lock, updates da chave em andamento ou aguardando]
+        self.enfileirados = 0
+
+    async def do_process_update(self, update, coroutine):
+        chave = chave_serializacao(update)
+        if chave is None:
+            await coroutine
+            return
+        vez = self._vezes.get(chave)
+        if vez is None:
+            vez = self._vezes[chave] = [asyncio.Lock(), 0]
+        elif vez[0].locked():
+            self.enfileirados += 1
+        vez[1] += 1
+        iniciado = False
+        try:
+            async with vez[0]:
+                iniciado = True
+                await coroutine
+        except Exception:
+            logger.exception(f"Erro ao processar update de {chave[0]} {chave[1]}.")
+        finally:
+            if not iniciado:
+                coroutine.close()  # cancelado enquanto esperava a vez
+            vez[1] -= 1
+            if not vez[1]:
+                del self._vezes[chave]
+
+    def ocupado(self, user_id):
+        """Se há update deste usuário em andamento ou esperando a vez."""
+        return ('usuario', user_id) in self._vezes
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def estatisticas(self):
+        return {
+            'em_andamento': self.current_concurrent_updates,
+            'usuarios_ativos': len(self._vezes),
+            'aguardando': sum(quantos - 1 for _, quantos in self._vezes.values()),
+            'enfileirados': self.enfileirados,
+        }
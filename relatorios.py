@@ -0,0 +1,138 @@
+"""Motor de relatórios: entradas, saídas, categorias, cartões e série diária.
+
+Tudo sai de uma única consulta agrupada sobre transacoes (ou transacoes_completas,
+se o período chega aos meses arquivados), ou de resumo_mensal quando o período
+cobre meses inteiros em UTC. O resultado é um objeto só,
+consumido pelo texto do /relatorio, pelo gráfico e pelo resumo da exportação.
+Os totais são somados em centavos inteiros e convertidos para reais só na
+leitura.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+import arquivamento
+import banco
+import unidades
+
+SEM_CATEGORIA = 'sem categoria'
+SEM_CARTAO = 'Dinheiro/Débito'
+
+# data_epoch / 86400 é o dia UTC (dias desde 1970-01-01).
+SQL_RELATORIO_PERIODO = """
+    SELECT data_epoch / 86400, tipo, COALESCE(id_categoria, 0), COALESCE(id_cartao, 0), SUM(valor_centavos), COUNT(*)
+    FROM {tabela}
+    WHERE id_usuario = ? AND data_epoch BETWEEN ? AND ?
+    GROUP BY 1, 2, 3, 4
+"""
+SQL_RELATORIO_MESES = """
+    SELECT mes, tipo, id_categoria, id_cartao, SUM(total_centavos), SUM(quantidade)
+    FROM resumo_mensal
+    WHERE id_usuario = ? AND mes BETWEEN ? AND ?
+    GROUP BY 1, 2, 3, 4
+"""
+
+CONSULTAS_QUENTES = {
+    'relatorio_periodo': (SQL_RELATORIO_PERIODO.format(tabela='transacoes'), (1, 946684800, 949363199)),
+    'relatorio_periodo_arquivo': (SQL_RELATORIO_PERIODO.format(tabela='transacoes_completas'), (1, 946684800, 949363199)),
+    'relatorio_meses': (SQL_RELATORIO_MESES, (1, '2000-01', '2000-12')),
+}
+
+_DIA_ZERO = date(1970, 1, 1)
+
+
+def _reais_ordenados(totais):
+    return sorted(((nome, unidades.reais(total)) for nome, total in totais.items()), key=lambda item: item[1], reverse=True)
+
+
+@dataclass
+class ResultadoRelatorio:
+    inicio: int  # epoch UTC, inclusivo
+    fim: int  # epoch UTC, inclusivo
+    fonte: str = 'transacoes'
+    entradas_centavos: int = 0
+    saidas_centavos: int = 0
+    quantidade: int = 0
+    por_categoria: dict = field(default_factory=dict)  # nome -> centavos de saídas
+    por_cartao: dict = field(default_factory=dict)  # nome -> centavos de saídas
+    serie: dict = field(default_factory=dict)  # 'AAAA-MM-DD' (ou 'AAAA-MM') -> [entradas, saídas] em centavos
+
+    @property
+    def entradas(self):
+        return unidades.reais(self.entradas_centavos)
+
+    @property
+    def saidas(self):
+        return unidades.reais(self.saidas_centavos)
+
+    @property
+    def saldo(self):
+        return unidades.reais(self.entradas_centavos - self.saidas_centavos)
+
+    @property
+    def granularidade(self):
+        return 'mes' if self.fonte == 'resumo_mensal' else 'dia'
+
+    def acumular(self, periodo, tipo, categoria, cartao, valor_centavos, quantidade=1):
+        """Soma uma linha (ou um grupo de linhas) ao resultado."""
+        self.quantidade += quantidade
+        ponto = self.serie.setdefault(periodo, [0, 0])
+        if tipo == 'entrada':
+            self.entradas_centavos += valor_centavos
+            ponto[0] += valor_centavos
+            return
+        self.saidas_centavos += valor_centavos
+        ponto[1] += valor_centavos
+        categoria = categoria or SEM_CATEGORIA
+        cartao = cartao or SEM_CARTAO
+        self.por_categoria[categoria] = self.por_categoria.get(categoria, 0) + valor_centavos
+        self.por_cartao[cartao] = self.por_cartao.get(cartao, 0) + valor_centavos
+
+    def gastos_por_categoria(self):
+        """[(nome, total em reais)] em ordem decrescente, no formato que graficos espera."""
+        return _reais_ordenados(self.por_categoria)
+
+    def gastos_por_cartao(self):
+        return _reais_ordenados(self.por_cartao)
+
+    def serie_ordenada(self):
+        return [(periodo, unidades.reais(entradas), unidades.reais(saidas)) for periodo, (entradas, saidas) in sorted(self.serie.items())]
+
+
+def _inicio_de_mes(momento):
+    return momento == momento.replace(day=1, hour=0, minute=0, second=0)
+
+
+def meses_alinhados(inicio, fim):
+    """Devolve ('AAAA-MM', 'AAAA-MM') se o período (epochs inclusivos) cobre meses UTC inteiros, senão None."""
+    if not _inicio_de_mes(unidades.momento_utc(inicio)) or not _inicio_de_mes(unidades.momento_utc(fim + 1)):
+        return None
+    return unidades.momento_utc(inicio).strftime('%Y-%m'), unidades.momento_utc(fim).strftime('%Y-%m')
+
+
+def _nomes(conn, tabela, user_id):
+    return dict(conn.execute(f"SELECT id, nome FROM {tabela} WHERE id_usuario = ?", (user_id,)).fetchall())
+
+
+async def gerar(user_id, inicio, fim, serie_diaria=False):
+    """Calcula o relatório de [inicio, fim] (segundos UTC, fim inclusivo).
+
+    Com serie_diaria=False, períodos de meses inteiros saem de resumo_mensal e a
+    série fica por mês; caso contrário a série é diária e vem de transacoes.
+    """
+    meses = None if serie_diaria else meses_alinhados(inicio, fim)
+
+    def _gerar(conn):
+        if meses:
+            resultado = ResultadoRelatorio(inicio, fim, fonte='resumo_mensal')
+            linhas = conn.execute(SQL_RELATORIO_MESES, (user_id, *meses)).fetchall()
+        else:
+            resultado = ResultadoRelatorio(inicio, fim)
+            sql = SQL_RELATORIO_PERIODO.format(tabela=arquivamento.tabela_transacoes(conn, inicio))
+            linhas = [(str(_DIA_ZERO + timedelta(days=dia)), *resto) for dia, *resto in conn.execute(sql, (user_id, inicio, fim))]
+        if not linhas:
+            return resultado
+        categorias, cartoes = _nomes(conn, 'categorias', user_id), _nomes(conn, 'cartoes', user_id)
+        for periodo, tipo, id_categoria, id_cartao, total, quantidade in linhas:
+            resultado.acumular(periodo, tipo, categorias.get(id_categoria), cartoes.get(id_cartao), total, quantidade)
+        return resultado
+    return await banco.ler(_gerar)
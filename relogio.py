@@ -0,0 +1,30 @@
+"""Relógio do bot.
+
+Todo "agora" que decide o que vai para o banco (sequência de dias, mês do
+orçamento, ciclo da fatura, validade do premium, próxima execução de tarefas)
+passa por `agora()`. Em produção é só `datetime.now`; o replay de diários
+(ferramentas/replay.py) congela o relógio no instante em que cada update chegou,
+então a mesma entrada produz o mesmo banco.
+"""
+from datetime import datetime, timezone
+
+_congelado = None
+
+
+def agora(fuso=timezone.utc):
+    """Instante atual no `fuso`; com fuso None, datetime local sem fuso (como `datetime.now()`)."""
+    momento = _congelado if _congelado is not None else datetime.now(timezone.utc)
+    if fuso is None:
+        return momento.astimezone().replace(tzinfo=None)
+    return momento.astimezone(fuso)
+
+
+def congelar(momento):
+    """Fixa o relógio em `momento` (datetime com fuso) até `descongelar`."""
+    global _congelado
+    _congelado = momento
+
+
+def descongelar():
+    global _congelado
+    _congelado = None
@@ -0,0 +1,391 @@
+"""Consultas do bot, agrupadas por entidade.
+
+Funções simples são corrotinas que usam o pool de `banco`. Operações com várias
+etapas rodam como uma unidade na conexão de escrita e devolvem um status que o
+handler transforma na resposta ao usuário.
+"""
+import os
+import sqlite3
+from datetime import datetime, time, timedelta
+
+import agendador
+import banco
+import categorias_match
+import relogio
+import unidades
+from cache import AUSENTE, CacheTTL
+
+# --- Consultas quentes ---
+# Mantidas como constantes para que migracoes.verificar_planos confira, via
+# EXPLAIN QUERY PLAN, que continuam usando índices em vez de varrer tabelas.
+SQL_SOMA_SAIDAS_MES = "SELECT SUM(total_centavos) FROM resumo_mensal WHERE id_usuario = ? AND mes = ? AND tipo = 'saida'"
+SQL_GASTO_CATEGORIA_MES = "SELECT SUM(total_centavos) FROM resumo_mensal WHERE id_usuario = ? AND mes = ? AND tipo = 'saida' AND id_categoria = ?"
+SQL_ORCAMENTOS_COM_GASTOS = "SELECT c.nome, o.valor, SUM(r.total_centavos) as gasto_centavos FROM orcamentos o JOIN categorias c ON o.id_categoria = c.id LEFT JOIN resumo_mensal r ON r.id_usuario = o.id_usuario AND r.mes = ? AND r.tipo = 'saida' AND r.id_categoria = o.id_categoria WHERE o.id_usuario = ? GROUP BY o.id ORDER BY c.nome"
+
+CONSULTAS_QUENTES = {
+    'soma_saidas_mes': (SQL_SOMA_SAIDAS_MES, (1, '2000-01')),
+    'gasto_categoria_mes': (SQL_GASTO_CATEGORIA_MES, (1, '2000-01', 1)),
+    'orcamentos_com_gastos': (SQL_ORCAMENTOS_COM_GASTOS, ('2000-01', 1)),
+}
+
+
+# --- Cache de identidade e assinatura ---
+# telegram_id -> id interno (inclusive None, para quem ainda não deu /start) e
+# id interno -> data de expiração da assinatura. A expiração é comparada com o
+# relógio a cada consulta, então o TTL só limita o atraso para enxergar uma
+# assinatura alterada fora do bot.
+_cache_ids = CacheTTL(tamanho_max=int(os.getenv("CACHE_USUARIOS_MAX", "50000")), ttl=float(os.getenv("CACHE_USUARIOS_TTL", "600")))
+_cache_assinaturas = CacheTTL(tamanho_max=int(os.getenv("CACHE_USUARIOS_MAX", "50000")), ttl=float(os.getenv("CACHE_ASSINATURAS_TTL", "60")))
+
+
+def invalidar_assinatura(user_id):
+    """Deve ser chamada por qualquer código que altere a tabela assinaturas."""
+    _cache_assinaturas.invalidar(user_id)
+
+
+def invalidar_usuario(telegram_id, user_id=None):
+    _cache_ids.invalidar(telegram_id)
+    if user_id is not None:
+        _cache_assinaturas.invalidar(user_id)
+
+
+def estatisticas_cache():
+    return {'usuarios': _cache_ids.estatisticas(), 'assinaturas': _cache_assinaturas.estatisticas()}
+
+
+def mes_atual():
+    """Chave 'AAAA-MM' (UTC) usada em resumo_mensal."""
+    return relogio.agora().strftime('%Y-%m')
+
+
+# --- Agregados mensais ---
+# resumo_mensal é mantido dentro das mesmas unidades de escrita que alteram
+# transacoes; qualquer novo caminho de escrita precisa chamar estes helpers.
+# `total` (REAL) ainda é mantido junto de total_centavos enquanto houver leitores antigos.
+def ajustar_resumo(conn, user_id, mes, tipo, id_categoria, id_cartao, delta_centavos, delta_quantidade):
+    """Soma os deltas à linha de resumo_mensal (criando-a) e apaga a que ficou sem lançamentos."""
+    conn.execute("""
+        INSERT INTO resumo_mensal (id_usuario, mes, tipo, id_categoria, id_cartao, total, total_centavos, quantidade) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id_usuario, mes, tipo, id_categoria, id_cartao) DO UPDATE SET total = total + excluded.total, total_centavos = total_centavos + excluded.total_centavos, quantidade = quantidade + excluded.quantidade
+    """, (user_id, mes, tipo, id_categoria or 0, id_cartao or 0, delta_centavos / 100, delta_centavos, delta_quantidade))
+    conn.execute("DELETE FROM resumo_mensal WHERE id_usuario = ? AND mes = ? AND tipo = ? AND id_categoria = ? AND id_cartao = ? AND quantidade <= 0",
+                 (user_id, mes, tipo, id_categoria or 0, id_cartao or 0))
+
+
+def _mover_resumo(conn, user_id, coluna, id_antigo):
+    """Junta as linhas de uma categoria/cartão apagado no balde 0 ('sem categoria'/'sem cartão')."""
+    outras = 'id_cartao' if coluna == 'id_categoria' else 'id_categoria'
+    conn.execute(f"""
+        INSERT INTO resumo_mensal (id_usuario, mes, tipo, {coluna}, {outras}, total, total_centavos, quantidade)
+        SELECT id_usuario, mes, tipo, 0, {outras}, total, total_centavos, quantidade FROM resumo_mensal WHERE id_usuario = ? AND {coluna} = ?
+        ON CONFLICT (id_usuario, mes, tipo, id_categoria, id_cartao) DO UPDATE SET total = total + excluded.total, total_centavos = total_centavos + excluded.total_centavos, quantidade = quantidade + excluded.quantidade
+    """, (user_id, id_antigo))
+    conn.execute(f"DELETE FROM resumo_mensal WHERE id_usuario = ? AND {coluna} = ?", (user_id, id_antigo))
+
+
+def _reconstruir_resumo(conn, user_id=None):
+    filtro, params = ("WHERE id_usuario = ?", (user_id,)) if user_id is not None else ("", ())
+    conn.execute(f"DELETE FROM resumo_mensal {filtro}", params)
+    conn.execute(f"INSERT INTO resumo_mensal (id_usuario, mes, tipo, id_categoria, id_cartao, total, total_centavos, quantidade) SELECT id_usuario, strftime('%Y-%m', data_epoch, 'unixepoch'), tipo, COALESCE(id_categoria, 0), COALESCE(id_cartao, 0), SUM(valor_centavos) / 100.0, SUM(valor_centavos), COUNT(*) FROM transacoes_completas {filtro} GROUP BY 1, 2, 3, 4, 5", params)
+
+
+async def reconstruir_resumo(user_id=None):
+    """Recalcula resumo_mensal a partir de transacoes (e do arquivo) e devolve quantas chaves divergiam."""
+    def _reconstruir(conn):
+        filtro, params = ("WHERE id_usuario = ?", (user_id,)) if user_id is not None else ("", ())
+        antes = {linha[:5]: linha[5:] for linha in conn.execute(f"SELECT id_usuario, mes, tipo, id_categoria, id_cartao, total_centavos, quantidade FROM resumo_mensal {filtro}", params)}
+        _reconstruir_resumo(conn, user_id)
+        depois = {linha[:5]: linha[5:] for linha in conn.execute(f"SELECT id_usuario, mes, tipo, id_categoria, id_cartao, total_centavos, quantidade FROM resumo_mensal {filtro}", params)}
+        return sum(1 for chave in antes.keys() | depois.keys() if antes.get(chave) != depois.get(chave))
+    return await banco.escrever(_reconstruir)
+
+
+# --- Usuários e assinaturas ---
+async def obter_id_usuario(telegram_id):
+    user_id = _cache_ids.obter(telegram_id)
+    if user_id is AUSENTE:
+        user = await banco.buscar_um("SELECT id FROM usuarios WHERE telegram_id = ?", (telegram_id,))
+        user_id = user[0] if user else None
+        _cache_ids.definir(telegram_id, user_id)
+    return user_id
+
+
+async def obter_usuario_por_telegram(telegram_id):
+    return await banco.buscar_um("SELECT id, dias_sequencia FROM usuarios WHERE telegram_id = ?", (telegram_id,))
+
+
+async def criar_usuario(telegram_id, chat_id, nome_usuario):
+    data_criacao_str = relogio.agora().strftime('%Y-%m-%d %H:%M:%S')
+    await banco.executar("INSERT INTO usuarios (telegram_id, chat_id, nome_usuario, data_criacao, dias_sequencia) VALUES (?, ?, ?, ?, ?)",
+                         (telegram_id, chat_id, nome_usuario, data_criacao_str, 0))
+    _cache_ids.invalidar(telegram_id)
+
+
+async def atualizar_chat_id(telegram_id, chat_id):
+    await banco.executar("UPDATE usuarios SET chat_id = ? WHERE telegram_id = ?", (chat_id, telegram_id))
+
+
+async def obter_data_expiracao(user_id):
+    """Data de expiração da assinatura (datetime) ou None para o plano gratuito."""
+    data_expiracao = _cache_assinaturas.obter(user_id)
+    if data_expiracao is AUSENTE:
+        assinatura = await banco.buscar_um("SELECT data_expiracao FROM assinaturas WHERE id_usuario = ?", (user_id,))
+        data_expiracao = datetime.strptime(assinatura[0], '%Y-%m-%d') if assinatura and assinatura[0] else None
+        _cache_assinaturas.definir(user_id, data_expiracao)
+    return data_expiracao
+
+
+def corte_premium(agora=None):
+    """Menor data_expiracao ('%Y-%m-%d') ainda válida em `agora`.
+
+    A assinatura vale até 00:00, hora local do servidor, do dia de expiração.
+    usuario_premium e os insights semanais (que filtram no SQL) usam este corte.
+    """
+    local = (agora or relogio.agora()).astimezone().replace(tzinfo=None)
+    dia = local.date() if local.time() == time.min else local.date() + timedelta(days=1)
+    return dia.strftime('%Y-%m-%d')
+
+
+async def usuario_premium(user_id):
+    data_expiracao = await obter_data_expiracao(user_id)
+    return bool(data_expiracao and data_expiracao.strftime('%Y-%m-%d') >= corte_premium())
+
+
+async def apagar_usuario(telegram_id):
+    """Remove o usuário e todos os seus dados. Devolve False se ele não existir."""
+    def _apagar(conn):
+        user = conn.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (telegram_id,)).fetchone()
+        if not user:
+            return None
+        id_interno = user[0]
+        conn.execute("DELETE FROM transacoes WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM transacoes_arquivo WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM resumo_mensal WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM orcamentos WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM cartoes WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM categoria_apelidos WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM categorias WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM lembretes_diarios WHERE id_usuario = ?", (id_interno,))
+        conn.execute("DELETE FROM agendamentos WHERE id_usuario = ?", (id_interno,))
+        agendador.remover_tarefas_usuario(conn, id_interno)
+        conn.execute("DELETE FROM usuarios WHERE id = ?", (id_interno,))
+        return id_interno
+    id_interno = await banco.escrever(_apagar)
+    invalidar_usuario(telegram_id, id_interno)
+    if id_interno is not None:
+        categorias_match.invalidar(id_interno)
+    return id_interno is not None
+
+
+# --- Categorias ---
+async def listar_nomes_categorias(user_id):
+    return [nome for nome, in await banco.buscar_todos("SELECT nome FROM categorias WHERE id_usuario = ? ORDER BY nome", (user_id,))]
+
+
+async def apagar_categoria(user_id, nome_categoria):
+    def _apagar(conn):
+        categoria = conn.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)).fetchone()
+        if not categoria:
+            return False
+        categoria_id = categoria[0]
+        conn.execute("UPDATE transacoes SET id_categoria = NULL WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id))
+        conn.execute("UPDATE transacoes_arquivo SET id_categoria = NULL WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id))
+        _mover_resumo(conn, user_id, 'id_categoria', categoria_id)
+        conn.execute("DELETE FROM categoria_apelidos WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id))
+        conn.execute("DELETE FROM categorias WHERE id = ?", (categoria_id,))
+        return True
+    apagada = await banco.escrever(_apagar)
+    categorias_match.invalidar(user_id)
+    return apagada
+
+
+# --- Orçamentos ---
+async def definir_orcamento(user_id, nome_categoria, valor):
+    def _definir(conn):
+        categoria = conn.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)).fetchone()
+        if not categoria:
+            categoria_id = conn.execute("INSERT INTO categorias (id_usuario, nome) VALUES (?, ?)", (user_id, nome_categoria)).lastrowid
+        else:
+            categoria_id = categoria[0]
+        conn.execute("REPLACE INTO orcamentos (id_usuario, id_categoria, valor) VALUES (?, ?, ?)", (user_id, categoria_id, valor))
+        return categoria is None
+    if await banco.escrever(_definir):
+        categorias_match.invalidar(user_id)
+
+
+async def listar_orcamentos_com_gastos(user_id, mes):
+    """[(categoria, orçamento, gasto no mês)], com o gasto em reais."""
+    linhas = await banco.buscar_todos(SQL_ORCAMENTOS_COM_GASTOS, (mes, user_id))
+    return [(nome, valor, unidades.reais(gasto_centavos)) for nome, valor, gasto_centavos in linhas]
+
+
+async def apagar_orcamento(user_id, nome_categoria):
+    """Devolve None se a categoria não existe, senão se algum orçamento foi removido."""
+    def _apagar(conn):
+        categoria = conn.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)).fetchone()
+        if not categoria:
+            return None
+        return conn.execute("DELETE FROM orcamentos WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria[0])).rowcount > 0
+    return await banco.escrever(_apagar)
+
+
+# --- Cartões ---
+async def contar_cartoes(user_id):
+    return (await banco.buscar_um("SELECT COUNT(id) FROM cartoes WHERE id_usuario = ?", (user_id,)))[0]
+
+
+async def adicionar_cartao(user_id, nome_cartao, limite, dia_fechamento):
+    """Devolve False se já existir um cartão com o mesmo nome."""
+    try:
+        await banco.executar("INSERT INTO cartoes (id_usuario, nome, limite, dia_fechamento) VALUES (?, ?, ?, ?)", (user_id, nome_cartao, limite, dia_fechamento))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+async def listar_nomes_cartoes(user_id):
+    return await banco.buscar_todos("SELECT id, nome FROM cartoes WHERE id_usuario = ? ORDER BY nome", (user_id,))
+
+
+async def obter_cartao(user_id, nome_cartao):
+    return await banco.buscar_um("SELECT id, limite, dia_fechamento FROM cartoes WHERE id_usuario = ? AND nome = ?", (user_id, nome_cartao))
+
+
+async def obter_nome_cartao(id_cartao):
+    return (await banco.buscar_um("SELECT nome FROM cartoes WHERE id = ?", (id_cartao,)))[0]
+
+
+async def apagar_cartao(user_id, nome_cartao):
+    def _apagar(conn):
+        cartao = conn.execute("SELECT id FROM cartoes WHERE id_usuario = ? AND nome = ?", (user_id, nome_cartao)).fetchone()
+        if not cartao:
+            return False
+        conn.execute("UPDATE transacoes SET id_cartao = NULL WHERE id_cartao = ?", (cartao[0],))
+        conn.execute("UPDATE transacoes_arquivo SET id_cartao = NULL WHERE id_cartao = ?", (cartao[0],))
+        _mover_resumo(conn, user_id, 'id_cartao', cartao[0])
+        conn.execute("DELETE FROM cartoes WHERE id = ?", (cartao[0],))
+        return True
+    return await banco.escrever(_apagar)
+
+
+# --- Transações ---
+async def somar_gastos_mes(user_id, mes):
+    resultado = await banco.buscar_um(SQL_SOMA_SAIDAS_MES, (user_id, mes))
+    return unidades.reais(resultado[0])
+
+
+async def registrar_transacao(user_id, nome_categoria, tipo, valor_centavos, id_cartao=None, atualizar_sequencia=True, limite_categorias_gratis=3):
+    """Grava a transação numa única transação de escrita.
+
+    Devolve None quando o usuário gratuito atingiu o limite de categorias; senão
+    um dict com o id da transação, a nova sequência (ou None) e o estado do
+    orçamento da categoria em reais (ou None).
+    """
+    is_premium = await usuario_premium(user_id)
+
+    def _registrar(conn):
+        categoria = conn.execute("SELECT id FROM categorias WHERE id_usuario = ? AND nome = ?", (user_id, nome_categoria)).fetchone()
+        if not categoria:
+            if not is_premium:
+                num_categorias = conn.execute("SELECT COUNT(id) FROM categorias WHERE id_usuario = ?", (user_id,)).fetchone()[0]
+                if num_categorias >= limite_categorias_gratis:
+                    return None
+            categoria_id = conn.execute("INSERT INTO categorias (id_usuario, nome) VALUES (?, ?)", (user_id, nome_categoria)).lastrowid
+        else:
+            categoria_id = categoria[0]
+
+        agora = relogio.agora()
+        data_epoch = unidades.epoch(agora)
+        mes = agora.strftime('%Y-%m')
+        # valor e data_transacao continuam sendo gravados para leitores antigos.
+        new_transaction_id = conn.execute("INSERT INTO transacoes (id_usuario, id_categoria, valor, valor_centavos, tipo, data_transacao, data_epoch, id_cartao) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                          (user_id, categoria_id, unidades.reais(valor_centavos), valor_centavos, tipo, unidades.texto_utc(data_epoch), data_epoch, id_cartao)).lastrowid
+        ajustar_resumo(conn, user_id, mes, tipo, categoria_id, id_cartao, valor_centavos, 1)
+
+        nova_sequencia = None
+        if atualizar_sequencia:
+            hoje_str = agora.strftime('%Y-%m-%d')
+            ultimo_lancamento, dias_sequencia = conn.execute("SELECT ultimo_lancamento, dias_sequencia FROM usuarios WHERE id = ?", (user_id,)).fetchone()
+            dias_sequencia = dias_sequencia or 0
+            if ultimo_lancamento != hoje_str:
+                ontem_str = (agora - timedelta(days=1)).strftime('%Y-%m-%d')
+                nova_sequencia = dias_sequencia + 1 if ultimo_lancamento == ontem_str else 1
+                conn.execute("UPDATE usuarios SET ultimo_lancamento = ?, dias_sequencia = ? WHERE id = ?", (hoje_str, nova_sequencia, user_id))
+
+        orcamento = None
+        if tipo == 'saida':
+            linha = conn.execute("SELECT valor FROM orcamentos WHERE id_usuario = ? AND id_categoria = ?", (user_id, categoria_id)).fetchone()
+            if linha:
+                gasto_centavos = conn.execute(SQL_GASTO_CATEGORIA_MES, (user_id, mes, categoria_id)).fetchone()[0]
+                orcamento = (linha[0], unidades.reais(gasto_centavos))
+
+        return {'id_transacao': new_transaction_id, 'nova_sequencia': nova_sequencia, 'orcamento': orcamento, 'categoria_criada': categoria is None}
+    resultado = await banco.escrever(_registrar)
+    if resultado and resultado['categoria_criada']:
+        categorias_match.invalidar(user_id)
+    return resultado
+
+
+async def desfazer_transacao(user_id, transaction_id):
+    """Apaga a transação do usuário, esteja em transacoes ou já arquivada.
+
+    Devolve False se ela já tinha sido desfeita ou não é dele.
+    """
+    def _desfazer(conn):
+        for tabela in ('transacoes', 'transacoes_arquivo'):
+            transacao = conn.execute(f"SELECT strftime('%Y-%m', data_epoch, 'unixepoch'), tipo, id_categoria, id_cartao, valor_centavos FROM {tabela} WHERE id = ? AND id_usuario = ?", (transaction_id, user_id)).fetchone()
+            if transacao:
+                break
+        else:
+            return False
+        mes, tipo, id_categoria, id_cartao, valor_centavos = transacao
+        conn.execute(f"DELETE FROM {tabela} WHERE id = ? AND id_usuario = ?", (transaction_id, user_id))
+        ajustar_resumo(conn, user_id, mes, tipo, id_categoria, id_cartao, -valor_centavos, -1)
+        return True
+    return await banco.escrever(_desfazer)
+
+
+# --- Lembretes e agendamentos ---
+# Cada alteração atualiza, na mesma unidade de escrita, a tarefa correspondente
+# em tarefas_agendadas (ver agendador).
+async def salvar_lembrete(user_id, horario_str, chat_id):
+    def _salvar(conn):
+        conn.execute("REPLACE INTO lembretes_diarios (id_usuario, horario, chat_id) VALUES (?, ?, ?)", (user_id, horario_str, chat_id))
+        agendador.definir_tarefa(conn, agendador.LEMBRETE, user_id, chat_id, horario_str)
+    await banco.escrever(_salvar)
+
+
+async def apagar_lembrete(user_id):
+    """Devolve False se o usuário não tinha lembrete."""
+    def _apagar(conn):
+        agendador.remover_tarefa(conn, agendador.LEMBRETE, user_id)
+        return conn.execute("DELETE FROM lembretes_diarios WHERE id_usuario = ?", (user_id,)).rowcount > 0
+    return await banco.escrever(_apagar)
+
+
+async def salvar_agendamento(user_id, dia, horario_str, titulo, valor, chat_id):
+    def _salvar(conn):
+        anterior = conn.execute("SELECT id FROM agendamentos WHERE id_usuario = ? AND titulo = ?", (user_id, titulo)).fetchone()
+        if anterior:
+            agendador.remover_tarefa(conn, agendador.AGENDAMENTO, user_id, anterior[0])
+        id_agendamento = conn.execute("REPLACE INTO agendamentos (id_usuario, dia, horario, titulo, valor, chat_id) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (user_id, dia, horario_str, titulo, valor, chat_id)).lastrowid
+        agendador.definir_tarefa(conn, agendador.AGENDAMENTO, user_id, chat_id, horario_str, dia, id_agendamento)
+        return id_agendamento
+    return await banco.escrever(_salvar)
+
+
+async def listar_agendamentos_usuario(user_id):
+    return await banco.buscar_todos("SELECT dia, horario, titulo, valor FROM agendamentos WHERE id_usuario = ? ORDER BY dia, horario", (user_id,))
+
+
+async def apagar_agendamento(user_id, titulo):
+    """Devolve o id do agendamento removido, ou None se não existir."""
+    def _apagar(conn):
+        agendamento = conn.execute("SELECT id FROM agendamentos WHERE id_usuario = ? AND titulo = ?", (user_id, titulo)).fetchone()
+        if not agendamento:
+            return None
+        conn.execute("DELETE FROM agendamentos WHERE id = ?", (agendamento[0],))
+        agendador.remover_tarefa(conn, agendador.AGENDAMENTO, user_id, agendamento[0])
+        return agendamento[0]
+    return await banco.escrever(_apagar)
@@ -0,0 +1,38 @@
+import asyncio
+from datetime import datetime, timezone
+
+import arquivamento
+import banco
+import migracoes
+import relogio
+import repositorio
+
+
+def test_desfazer_lancamento_ja_arquivado(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        try:
+            await repositorio.criar_usuario(40, 40, "teste")
+            user_id = await repositorio.obter_id_usuario(40)
+            relogio.congelar(datetime(2026, 1, 10, 12, tzinfo=timezone.utc))
+            try:
+                antigo = (await repositorio.registrar_transacao(user_id, "mercado", 'saida', 5000))['id_transacao']
+                await repositorio.registrar_transacao(user_id, "mercado", 'saida', 1500)
+            finally:
+                relogio.descongelar()
+            resultado = await arquivamento.arquivar(agora=datetime(2026, 10, 17, tzinfo=timezone.utc))
+            # A maior id fica em transacoes; a outra vai para o arquivo.
+            assert resultado.movidas == 1
+            assert await banco.buscar_um("SELECT 1 FROM transacoes_arquivo WHERE id = ?", (antigo,))
+
+            assert await repositorio.desfazer_transacao(user_id, antigo) is True
+            assert await repositorio.desfazer_transacao(user_id, antigo) is False
+            assert await banco.buscar_um("SELECT total_centavos, quantidade FROM resumo_mensal WHERE id_usuario = ?", (user_id,)) == (1500, 1)
+            assert await repositorio.reconstruir_resumo(user_id) == 0
+        finally:
+            await banco.encerrar()
+
+    asyncio.run(cenario())
@@ -0,0 +1,25 @@
+import asyncio
+import threading
+
+import banco
+import migracoes
+
+
+def test_profundidade_fila_leitura_conta_quem_espera_um_leitor(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+    pool = banco.PoolConexoes(caminho, leitores=2)
+    liberar = threading.Event()
+
+    async def cenario():
+        leituras = [asyncio.create_task(pool.ler(lambda conn: liberar.wait(5))) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert pool.profundidade_fila_leitura() == 3
+        liberar.set()
+        await asyncio.gather(*leituras)
+        assert pool.profundidade_fila_leitura() == 0
+
+    try:
+        asyncio.run(cenario())
+    finally:
+        pool.fechar()
@@ -0,0 +1,32 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import graficos
+
+
+def test_render_que_estoura_o_timeout_continua_ocupando_a_vaga(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(graficos, '_obter_executor', lambda: executor)
+    monkeypatch.setattr(graficos, '_renderizar_pizza', lambda dados: time.sleep(0.3) or b"png")
+    monkeypatch.setattr(graficos, 'TIMEOUT', 0.05)
+    monkeypatch.setattr(graficos, 'FILA_MAX', 2)
+
+    async def cenario():
+        for periodo in ("a", "b"):
+            assert await graficos.gerar_grafico_pizza([("mercado", 10.0)], periodo) is None
+        # Os dois renders abandonados ainda rodam no pool: não cabe um terceiro.
+        assert graficos.profundidade_fila() == 2
+        assert await graficos.gerar_grafico_pizza([("mercado", 10.0)], "c") is None
+        assert graficos.profundidade_fila() == 2
+        await asyncio.sleep(0.4)
+        assert graficos.profundidade_fila() == 0
+        monkeypatch.setattr(graficos, 'TIMEOUT', 1.0)
+        png = await graficos.gerar_grafico_pizza([("mercado", 10.0)], "d")
+        assert png.getvalue() == b"png"
+
+    try:
+        asyncio.run(cenario())
+    finally:
+        executor.shutdown(wait=True)
+    assert graficos.profundidade_fila() == 0
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import pytest
+
+import banco
+import exportacao
+import importacao
+import migracoes
+import relogio
+import repositorio
+
+
+def test_lote_desfeito_nao_consome_lancamento_existente(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        try:
+            await repositorio.criar_usuario(50, 50, "teste")
+            user_id = await repositorio.obter_id_usuario(50)
+            relogio.congelar(datetime(2026, 3, 5, 15, tzinfo=timezone.utc))
+            try:
+                await repositorio.registrar_transacao(user_id, "mercado", 'saida', 5000)
+            finally:
+                relogio.descongelar()
+            deduplicador = importacao._Deduplicador(user_id)
+            linha = importacao.LinhaExtrato(date(2026, 3, 5), 'saida', 5000, "mercado", None, 'csv:a')
+
+            def _gravar(conn, linha=linha):
+                return importacao._gravar_lote(conn, user_id, None, [linha], [None], deduplicador)
+
+            def _gravar_e_falhar(conn):
+                assert _gravar(conn) == []
+                raise RuntimeError("falha depois do lote")
+            with pytest.raises(RuntimeError):
+                await banco.escrever(_gravar_e_falhar)
+
+            # O lançamento digitado continua disponível para absorver a linha.
+            assert await banco.escrever(_gravar) == []
+            deduplicador.confirmar()
+            # Já consumido: uma segunda linha igual entra.
+            novas = await banco.escrever(lambda conn: _gravar(conn, linha._replace(id_externo='csv:b')))
+            deduplicador.confirmar()
+            assert [nova[-1] for nova in novas] == ['csv:b']
+        finally:
+            await banco.encerrar()
+
+    asyncio.run(cenario())
+
+
+def test_reimportar_exportacao_do_fim_da_noite_nao_duplica(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        try:
+            await repositorio.criar_usuario(51, 51, "teste")
+            user_id = await repositorio.obter_id_usuario(51)
+            # 22h30 em São Paulo: o dia UTC já é o seguinte.
+            relogio.congelar(datetime(2026, 3, 6, 1, 30, tzinfo=timezone.utc))
+            try:
+                await repositorio.registrar_transacao(user_id, "mercado", 'saida', 5000)
+            finally:
+                relogio.descongelar()
+            exportado = await exportacao.exportar(user_id, 'csv', *exportacao.TODO_HISTORICO)
+            with exportado.arquivo:
+                resumo = await importacao.importar(user_id, exportado.arquivo, exportado.nome)
+            assert (resumo.importadas, resumo.duplicadas) == (0, 1)
+        finally:
+            await banco.encerrar()
+
+    asyncio.run(cenario())
@@ -0,0 +1,49 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import banco
+import insights
+import migracoes
+import relogio
+import repositorio
+
+
+@pytest.fixture
+def horario_de_sao_paulo(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/Sao_Paulo')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.parametrize("agora, premium", [
+    # 22h30 do dia 6 em São Paulo, já dia 7 em UTC: a assinatura que expira no dia 7 ainda vale.
+    (datetime(2026, 3, 7, 1, 30, tzinfo=timezone.utc), True),
+    # 00h30 do dia 7 em São Paulo: expirou.
+    (datetime(2026, 3, 7, 3, 30, tzinfo=timezone.utc), False),
+])
+def test_insight_semanal_usa_o_mesmo_corte_do_premium(tmp_path, horario_de_sao_paulo, agora, premium):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        relogio.congelar(agora - timedelta(days=1))
+        try:
+            await repositorio.criar_usuario(70, 70, "teste")
+            user_id = await repositorio.obter_id_usuario(70)
+            await banco.executar("INSERT INTO assinaturas (id_usuario, plano, data_expiracao) VALUES (?, 'mensal', '2026-03-07')", (user_id,))
+            repositorio.invalidar_assinatura(user_id)
+            await repositorio.registrar_transacao(user_id, "mercado", 'saida', 5000)
+            relogio.congelar(agora)
+            assert await repositorio.usuario_premium(user_id) is premium
+            assert [insight.id_usuario for insight in await insights.calcular_semanais(agora)] == ([user_id] if premium else [])
+        finally:
+            relogio.descongelar()
+            await banco.encerrar()
+
+    asyncio.run(cenario())
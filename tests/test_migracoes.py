@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+import agendador
+import arquivamento
+import exportacao
+import faturas
+import importacao
+import insights
+import migracoes
+import relatorios
+import repositorio
+
+MODULOS = [repositorio, relatorios, exportacao, importacao, faturas, agendador, insights, arquivamento]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+    conexao = sqlite3.connect(caminho)
+    yield conexao
+    conexao.close()
+
+
+def test_migracoes_chegam_a_ultima_versao(conn):
+    assert migracoes.versao_atual(conn) == migracoes.MIGRACOES[-1][0]
+
+
+def test_aplicar_de_novo_nao_muda_nada(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    versao = migracoes.aplicar(caminho)
+    assert migracoes.aplicar(caminho) == versao
+
+
+@pytest.mark.parametrize("modulo", MODULOS, ids=lambda modulo: modulo.__name__)
+def test_consultas_quentes_usam_indice(conn, modulo):
+    assert modulo.CONSULTAS_QUENTES
+    assert migracoes.verificar_planos(conn, modulo.CONSULTAS_QUENTES) == []
+
+
+def test_consultas_quentes_cobrem_todos_os_modulos():
+    todas = migracoes.consultas_quentes()
+    assert set(todas) == {nome for modulo in MODULOS for nome in modulo.CONSULTAS_QUENTES}
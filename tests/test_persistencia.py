@@ -0,0 +1,60 @@
+import asyncio
+from datetime import timedelta
+
+from telegram.ext import Application
+
+import banco
+import migracoes
+import persistencia
+import processamento
+from test_processamento import RequisicaoFalsa, texto
+
+
+async def _rodada(persistencia_, alteracoes):
+    """Entrega um lote como o PTB faz (num gather) e espera a gravação."""
+    await asyncio.gather(*alteracoes)
+    while persistencia_._gravacao is not None:
+        await asyncio.sleep(0.01)
+
+
+def test_user_data_vazio_ou_parado_sai_da_memoria(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+    processador = processamento.ProcessadorPorUsuario(4)
+    application = (Application.builder().token("123:teste").request(RequisicaoFalsa()).get_updates_request(RequisicaoFalsa())
+                   .updater(None).concurrent_updates(processador).build())
+    p = persistencia.PersistenciaSQLite(intervalo=3600, validade=timedelta(hours=1))
+    p.vincular(application)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        try:
+            # 1 e 3 no meio de uma conversa, 2 com a conversa encerrada, 4 com um update em andamento.
+            for user_id in (1, 3):
+                application.user_data[user_id]['transacao_pendente'] = {'valor_str': str(user_id)}
+            application.user_data[2]
+            application.user_data[4]
+            liberar = asyncio.Event()
+            em_andamento = asyncio.create_task(processador.process_update(texto(application.bot, 4, "-1 a"), liberar.wait()))
+            await asyncio.sleep(0)
+            await _rodada(p, [p.update_user_data(user_id, dict(application.user_data[user_id])) for user_id in (1, 2, 3, 4)])
+            assert set(application.user_data) == {1, 3, 4}
+
+            # A cópia entregue não vale: o que conta é o user_data de agora.
+            application.user_data[1].clear()
+            # 3 está parado há mais que a validade.
+            p._ultimo_uso[3] -= 2 * 3600
+            liberar.set()
+            await em_andamento
+            await _rodada(p, [p.update_user_data(1, {'transacao_pendente': {'valor_str': '1'}}), p.update_user_data(4, {})])
+            assert set(application.user_data) == set()
+            assert p.liberados == 4
+
+            # Um handler que preencheu o user_data depois da cópia mantém o usuário.
+            application.user_data[6]['transacao_pendente'] = {'valor_str': '50'}
+            await _rodada(p, [p.update_user_data(6, {})])
+            assert application.user_data[6] == {'transacao_pendente': {'valor_str': '50'}}
+        finally:
+            await banco.encerrar()
+
+    asyncio.run(cenario())
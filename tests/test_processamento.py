@@ -0,0 +1,153 @@
+"""ProcessadorPorUsuario com a conversa de lançamento (transacao_conv) de verdade.
+
+Os callbacks da conversa são trocados por versões que registram a ordem e
+demoram um pouco, para forçar a intercalação; o resto (ConversationHandler,
+fila de updates, processador) é o do bot.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, DictPersistence
+from telegram.request import BaseRequest
+
+import gastos
+import processamento
+
+_ids = itertools.count(1)
+
+
+class RequisicaoFalsa(BaseRequest):
+    """Bot API mínima: getMe e `true` para o resto."""
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        resultado = True
+        if url.endswith('/getMe'):
+            resultado = {'id': 1, 'is_bot': True, 'first_name': 'Teste', 'username': 'bot_teste'}
+        return 200, json.dumps({'ok': True, 'result': resultado}).encode()
+
+
+def _usuario(telegram_id):
+    return {'id': telegram_id, 'is_bot': False, 'first_name': f"Teste {telegram_id}"}
+
+
+def _mensagem(telegram_id, texto):
+    return {'message_id': next(_ids), 'date': int(time.time()), 'text': texto,
+            'chat': {'id': telegram_id, 'type': 'private'}, 'from': _usuario(telegram_id)}
+
+
+def texto(bot, telegram_id, conteudo):
+    return Update.de_json({'update_id': next(_ids), 'message': _mensagem(telegram_id, conteudo)}, bot)
+
+
+def botao(bot, telegram_id, dados):
+    consulta = {'id': str(next(_ids)), 'chat_instance': '1', 'data': dados, 'from': _usuario(telegram_id), 'message': _mensagem(telegram_id, "Como você pagou?")}
+    return Update.de_json({'update_id': next(_ids), 'callback_query': consulta}, bot)
+
+
+def montar(eventos, espera=0.05, simultaneos=8):
+    """Application com os handlers do bot e os callbacks de transacao_conv trocados por registradores."""
+    application = (Application.builder().token("123:teste").request(RequisicaoFalsa()).get_updates_request(RequisicaoFalsa())
+                   .updater(None).persistence(DictPersistence(update_interval=3600))
+                   .concurrent_updates(processamento.ProcessadorPorUsuario(simultaneos)).build())
+    gastos.registrar_handlers(application)
+    conversa = next(h for h in application.handlers[0] if isinstance(h, ConversationHandler) and h.name == 'transacao')
+
+    def registrador(nome, proximo):
+        async def callback(update, context):
+            detalhe = update.effective_message.text if update.message else update.callback_query.data
+            eventos.append(('inicio', update.effective_user.id, nome, detalhe, time.perf_counter()))
+            await asyncio.sleep(espera)
+            eventos.append(('fim', update.effective_user.id, nome, detalhe, time.perf_counter()))
+            return proximo
+        return callback
+    conversa.entry_points[0].callback = registrador('lancamento', gastos.AGUARDANDO_PAGAMENTO)
+    conversa.states[gastos.AGUARDANDO_PAGAMENTO][0].callback = registrador('pagamento', ConversationHandler.END)
+    return application
+
+
+async def _rodar(application, updates):
+    async with application:
+        await application.start()
+        for update in updates:
+            await application.update_queue.put(update)
+        await application.update_queue.join()
+        await application.stop()
+        await application.update_persistence()
+        return await application.persistence.get_conversations('transacao')
+
+
+def test_updates_de_um_usuario_passam_pela_conversa_em_ordem():
+    eventos = []
+    application = montar(eventos)
+    bot = application.bot
+    # Sem a serialização, o clique chegaria à conversa antes de o lançamento definir o estado e seria ignorado.
+    updates = [texto(bot, 10, "-50 mercado"), botao(bot, 10, "cartao:0"), texto(bot, 10, "-30 padaria"),
+               botao(bot, 10, "cartao:0"), texto(bot, 10, "-12 cafe")]
+    conversas = asyncio.run(_rodar(application, updates))
+
+    assert [(tipo, nome, detalhe) for tipo, _, nome, detalhe, _ in eventos] == [
+        ('inicio', 'lancamento', "-50 mercado"), ('fim', 'lancamento', "-50 mercado"),
+        ('inicio', 'pagamento', "cartao:0"), ('fim', 'pagamento', "cartao:0"),
+        ('inicio', 'lancamento', "-30 padaria"), ('fim', 'lancamento', "-30 padaria"),
+        ('inicio', 'pagamento', "cartao:0"), ('fim', 'pagamento', "cartao:0"),
+        ('inicio', 'lancamento', "-12 cafe"), ('fim', 'lancamento', "-12 cafe"),
+    ]
+    # O último lançamento ficou esperando a forma de pagamento.
+    assert conversas == {(10, 10): gastos.AGUARDANDO_PAGAMENTO}
+
+
+def test_usuarios_diferentes_rodam_em_paralelo():
+    eventos = []
+    application = montar(eventos, espera=0.2)
+    bot = application.bot
+    updates = [texto(bot, telegram_id, "-50 mercado") for telegram_id in (21, 22, 23)]
+    inicio = time.perf_counter()
+    conversas = asyncio.run(_rodar(application, updates))
+    duracao = time.perf_counter() - inicio
+
+    inicios = [momento for tipo, *_, momento in eventos if tipo == 'inicio']
+    fins = [momento for tipo, *_, momento in eventos if tipo == 'fim']
+    assert len(inicios) == 3
+    # Todos começaram antes de o primeiro terminar.
+    assert max(inicios) < min(fins)
+    assert duracao < 0.55
+    assert conversas == {(telegram_id, telegram_id): gastos.AGUARDANDO_PAGAMENTO for telegram_id in (21, 22, 23)}
+
+
+def test_update_que_espera_a_vez_so_termina_depois_de_processado():
+    processador = processamento.ProcessadorPorUsuario(4)
+    bot = montar([]).bot
+    ordem = []
+
+    async def handler(nome, espera):
+        ordem.append(('inicio', nome))
+        await asyncio.sleep(espera)
+        ordem.append(('fim', nome))
+
+    async def cenario():
+        primeiro = asyncio.create_task(processador.process_update(texto(bot, 30, "-1 a"), handler('primeiro', 0.1)))
+        await asyncio.sleep(0.01)
+        segundo = asyncio.create_task(processador.process_update(texto(bot, 30, "-2 b"), handler('segundo', 0)))
+        await asyncio.sleep(0.03)
+        # O segundo ocupa sua vaga e não volta antes de rodar: é isso que segura a fila de updates.
+        assert not segundo.done()
+        assert processador.current_concurrent_updates == 2
+        assert processador.estatisticas()['aguardando'] == 1
+        await asyncio.gather(primeiro, segundo)
+        assert processador.estatisticas()['usuarios_ativos'] == 0
+
+    asyncio.run(cenario())
+    assert ordem == [('inicio', 'primeiro'), ('fim', 'primeiro'), ('inicio', 'segundo'), ('fim', 'segundo')]
@@ -0,0 +1,30 @@
+import asyncio
+
+import banco
+import migracoes
+import repositorio
+
+
+def test_desfazer_lancamento_de_outro_usuario_nao_apaga_nada(tmp_path):
+    caminho = str(tmp_path / "gastos_bot.db")
+    migracoes.aplicar(caminho)
+
+    async def cenario():
+        banco.configurar(caminho, leitores=1)
+        try:
+            await repositorio.criar_usuario(60, 60, "a")
+            await repositorio.criar_usuario(61, 61, "b")
+            usuario_a, usuario_b = await repositorio.obter_id_usuario(60), await repositorio.obter_id_usuario(61)
+            id_transacao = (await repositorio.registrar_transacao(usuario_a, "mercado", 'saida', 5000))['id_transacao']
+
+            # Um callback "undo:<id>" forjado por B.
+            assert await repositorio.desfazer_transacao(usuario_b, id_transacao) is False
+            assert await banco.buscar_um("SELECT id_usuario FROM transacoes WHERE id = ?", (id_transacao,)) == (usuario_a,)
+            assert await banco.buscar_todos("SELECT id_usuario, total_centavos, quantidade FROM resumo_mensal") == [(usuario_a, 5000, 1)]
+
+            assert await repositorio.desfazer_transacao(usuario_a, id_transacao) is True
+            assert await banco.buscar_todos("SELECT * FROM resumo_mensal") == []
+        finally:
+            await banco.encerrar()
+
+    asyncio.run(cenario())
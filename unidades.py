@@ -0,0 +1,36 @@
+"""Conversões entre as unidades gravadas no banco e as mostradas ao usuário.
+
+Em transacoes e resumo_mensal, dinheiro é guardado em centavos inteiros (somas
+exatas) e instantes em segundos desde a época Unix, em UTC (filtros por
+intervalo comparam inteiros). A conversão para reais e datas acontece só na
+borda: na entrada do valor digitado e na formatação das respostas.
+"""
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+
+
+def centavos(valor):
+    """Converte reais (float, Decimal ou texto com vírgula ou ponto) em centavos inteiros."""
+    if isinstance(valor, str):
+        valor = valor.replace(',', '.')
+    return int(Decimal(str(valor)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+
+
+def reais(valor_centavos):
+    return (valor_centavos or 0) / 100
+
+
+def epoch(momento):
+    """Segundos UTC de um datetime; datetimes sem fuso são tratados como UTC."""
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return int(momento.timestamp())
+
+
+def momento_utc(segundos):
+    return datetime.fromtimestamp(segundos, timezone.utc)
+
+
+def texto_utc(segundos):
+    """'AAAA-MM-DD HH:MM:SS' em UTC, o formato da coluna data_transacao."""
+    return momento_utc(segundos).strftime('%Y-%m-%d %H:%M:%S')